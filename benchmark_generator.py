@@ -0,0 +1,356 @@
+#!/bin/python3
+
+# Benchmark of the generator on synthetic configurations.
+# Each axis ('Controls', 'Order', 'Sequences', 'Depth', 'Events', 'Symbols') is swept from a
+# base configuration, the other axes keeping their base value. For each point, the state
+# expansion, the decision tree and the emission (everything else in 'generate_specific') are
+# timed separately and the size of the result is reported. The report is a JSON file meant to
+# be diffed between commits.
+
+import os
+import sys
+import json
+import time
+import random
+import tempfile
+import tracemalloc
+import io
+import contextlib
+import getopt
+
+import generate
+
+BASE_PARAMETERS = {
+    "Controls": 4,
+    "Order": 2,
+    "Sequences": 4,
+    "Depth": 3,
+    "Events": 16,
+    "Symbols": 6,
+}
+
+AXES = {
+    "Controls": [2, 4, 6, 8, 10],
+    "Order": [0, 1, 2, 3, 4],
+    "Sequences": [0, 4, 16, 32, 64],
+    "Depth": [2, 3, 4, 5, 6],
+    "Events": [4, 16, 64, 128, 256],
+    "Symbols": [2, 6, 12, 24, 48],
+}
+
+# Functions of 'generate' timed per phase. The emission phase is the remaining time.
+PHASES = {
+    "Expansion": ["expand_states", "describe_states", "minimize_states"],
+    "DecisionTree": [
+        "create_decision_tree",
+        "create_decision_diagram",
+        "create_decision_table",
+    ],
+}
+
+
+# Build a (global, specific) configuration pair.
+# Symbols are local to the specific configuration : one 'Control' symbol, then booleans and
+# timers in turn. Sequences all have 'Depth' controls, so that none is the prefix of another.
+# When an axis value can't be reached (too few distinct sequences or events), fewer are built.
+# Events and sequences are drawn from their own generators, so that each axis only changes its
+# own part of the configuration.
+def synthesize_configuration(parameters, seed=0):
+    events_rng = random.Random("%d-events" % seed)
+    sequences_rng = random.Random("%d-sequences" % seed)
+    controls = ["C%d" % i for i in range(parameters["Controls"])]
+    global_configuration = {
+        "Description": "Synthetic configuration",
+        "Controls": controls,
+        "Symbols": [],
+        "Signals": {},
+        "Groups": [],
+    }
+
+    symbols = [{"Name": "last_key", "Type": "Control", "Default": controls[0]}]
+    for i in range(1, parameters["Symbols"]):
+        if i % 2 == 1:
+            symbols.append({"Name": "flag_%d" % i, "Type": "bool", "Default": "false"})
+        else:
+            symbols.append({"Name": "timer_%d" % i, "Type": "Timer", "Default": 1000})
+
+    # Two events with the same conditions can't be told apart by the decision tree.
+    events = {}
+    used = set()
+    attempts = 0
+    while len(events) < parameters["Events"] and attempts < 100 * (
+        parameters["Events"] + 1
+    ):
+        attempts += 1
+        conditions = {}
+        for s in events_rng.sample(
+            symbols, min(len(symbols), events_rng.randint(1, 3))
+        ):
+            if s["Type"] == "Control":
+                conditions[s["Name"]] = events_rng.choice(controls)
+            else:
+                conditions[s["Name"]] = events_rng.choice([True, False])
+        key = tuple(sorted(conditions.items()))
+        if key in used:
+            continue
+        used.add(key)
+        events["event_%d" % len(events)] = {"Conditions": conditions}
+
+    sequences = []
+    used = set()
+    attempts = 0
+    while len(sequences) < parameters["Sequences"] and attempts < 100 * (
+        parameters["Sequences"] + 1
+    ):
+        attempts += 1
+        sequence = tuple(
+            sequences_rng.choice(controls) for _ in range(parameters["Depth"])
+        )
+        if sequence in used:
+            continue
+        used.add(sequence)
+        sequences.append(
+            {
+                "Name": "Sequence_%d" % len(sequences),
+                "Sequence": list(sequence),
+                "Duration": sequences_rng.choice([0, 20, 2000]),
+                "Cooldown": sequences_rng.choice([0, 100, 1000]),
+            }
+        )
+
+    specific_configuration = {
+        "Name": "Synthetic",
+        "Description": "Synthetic configuration",
+        "Rules": {
+            "Order": controls[: parameters["Order"]],
+            "Symbols": symbols,
+            "Controlable": {},
+            "Events": events,
+            "Trigger": {
+                "Controls": {
+                    c: {"onPress": ["last_key"], "onRelease": ["last_key"]}
+                    for c in controls
+                },
+                "Timers": {},
+            },
+            "Frame": [s["Name"] for s in symbols if s["Type"] != "Control"],
+            "Sequences": {"Timeout": 300, "List": sequences},
+        },
+    }
+    return global_configuration, specific_configuration
+
+
+# Replace the functions of a phase by a wrapper accumulating their duration in 'timings'.
+# The result of 'create_decision_*' is kept in 'results'.
+def instrument(timings, results):
+    originals = {}
+    for phase, names in PHASES.items():
+        for name in names:
+            function = getattr(generate, name)
+            originals[name] = function
+
+            def wrapper(*args, _phase=phase, _name=name, _function=function, **kwargs):
+                start = time.perf_counter()
+                result = _function(*args, **kwargs)
+                timings[_phase] += time.perf_counter() - start
+                results[_name] = result
+                return result
+
+            setattr(generate, name, wrapper)
+    return originals
+
+
+def restore(originals):
+    for name, function in originals.items():
+        setattr(generate, name, function)
+
+
+# Run 'generate_specific' once. Return the phase durations (ms), the phase results and the
+# list of artifacts.
+def run_generator(global_configuration, specific_filepath, output_directory, options):
+    timings = {"Expansion": 0.0, "DecisionTree": 0.0}
+    results = {}
+    originals = instrument(timings, results)
+    output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output):
+            start = time.perf_counter()
+            artifacts = generate.generate_specific(
+                specific_filepath,
+                global_configuration["Controls"],
+                global_configuration["Symbols"],
+                global_configuration["Signals"],
+                global_configuration["Groups"],
+                {},
+                {},
+                False,
+                output_directory,
+                options,
+            )
+            total = time.perf_counter() - start
+    except generate.GenerationError:
+        # The progress of the failing generation is printed along with the error.
+        sys.stdout.write(output.getvalue())
+        raise
+    finally:
+        restore(originals)
+    timings["Emission"] = total - timings["Expansion"] - timings["DecisionTree"]
+    timings["Total"] = total
+    for phase in timings:
+        timings[phase] = round(timings[phase] * 1000, 3)
+    return timings, results, artifacts
+
+
+def benchmark_case(parameters, repeats, options, seed):
+    global_configuration, specific_configuration = synthesize_configuration(
+        parameters, seed
+    )
+    with tempfile.TemporaryDirectory() as working_directory:
+        specific_filepath = os.path.join(working_directory, "synthetic.json")
+        with open(specific_filepath, "w") as specific_file:
+            json.dump(specific_configuration, specific_file)
+
+        # Keep the fastest run of each phase.
+        timings = None
+        for _ in range(repeats):
+            run_timings, results, artifacts = run_generator(
+                global_configuration, specific_filepath, working_directory, options
+            )
+            if timings is None:
+                timings = run_timings
+            else:
+                for phase in timings:
+                    timings[phase] = min(timings[phase], run_timings[phase])
+
+        # Memory is measured on a separate run, tracing slows the generation down.
+        tracemalloc.start()
+        try:
+            run_generator(
+                global_configuration, specific_filepath, working_directory, options
+            )
+            _, peak_memory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        output_bytes = 0
+        for a in artifacts:
+            output_bytes += os.path.getsize(os.path.join(working_directory, a))
+        with open(
+            os.path.join(working_directory, "synthetic_fsm_pc.json"), "r"
+        ) as descriptor_file:
+            transitions = json.load(descriptor_file)["Transitions"]
+
+    case = {
+        "Parameters": parameters,
+        "Timings": timings,
+        "States": len(transitions),
+        "Transitions": sum([len(t) for t in transitions]),
+        "OutputBytes": output_bytes,
+        "PeakMemory": peak_memory,
+    }
+    if results.get("create_decision_tree") is not None:
+        depth, node_count = generate.measure_decision_tree(
+            results["create_decision_tree"]
+        )
+        case["TreeDepth"] = depth
+        case["TreeNodes"] = node_count
+    return case
+
+
+def main():
+    report_filepath = "benchmark.json"
+    repeats = 3
+    seed = 0
+    axes = list(AXES.keys())
+    options = generate.default_options()
+
+    try:
+        opts, args = getopt.getopt(
+            sys.argv[1:],
+            "o:r:a:",
+            ["seed=", "strategy=", "engine=", "minimize", "sequence-matcher"],
+        )
+    except getopt.GetoptError:
+        print(
+            (
+                "%s -o [report.json] -r [repeats] -a [axis] -a ... "
+                "--seed [seed] --strategy [count|entropy] "
+                "--engine [tree|mdd|table] --minimize --sequence-matcher"
+            )
+            % sys.argv[0]
+        )
+        sys.exit(1)
+    selected_axes = []
+    for opt, arg in opts:
+        if opt == "-o":
+            report_filepath = arg
+        elif opt == "-r":
+            try:
+                repeats = int(arg)
+            except ValueError:
+                repeats = 0
+            if repeats < 1:
+                print("!!! Invalid repeat count '%s' !!!" % arg)
+                sys.exit(1)
+        elif opt == "-a":
+            if arg not in AXES:
+                print("!!! Unknown axis '%s' (%s) !!!" % (arg, ", ".join(AXES)))
+                sys.exit(1)
+            selected_axes.append(arg)
+        elif opt == "--seed":
+            seed = int(arg)
+        elif opt == "--strategy":
+            if arg not in ["count", "entropy"]:
+                print("!!! Unknown decision tree strategy '%s' !!!" % arg)
+                sys.exit(1)
+            options["Strategy"] = arg
+        elif opt == "--engine":
+            if arg not in ["tree", "mdd", "table"]:
+                print("!!! Unknown decision engine '%s' !!!" % arg)
+                sys.exit(1)
+            options["Engine"] = arg
+        elif opt == "--minimize":
+            options["Minimize"] = True
+        elif opt == "--sequence-matcher":
+            options["SequenceMatcher"] = True
+    if len(selected_axes) > 0:
+        axes = selected_axes
+
+    report = {
+        "GeneratorVersion": generate.GENERATOR_VERSION,
+        "Options": options,
+        "Repeats": repeats,
+        "Seed": seed,
+        "Base": BASE_PARAMETERS,
+        "Axes": {},
+    }
+    for axis in axes:
+        print("## Axis %s" % axis)
+        report["Axes"][axis] = []
+        for value in AXES[axis]:
+            parameters = BASE_PARAMETERS.copy()
+            parameters[axis] = value
+            case = benchmark_case(parameters, repeats, options, seed)
+            report["Axes"][axis].append(case)
+            print(
+                "- %s = %d : %d states, %d transitions, %.1f ms (expansion %.1f, tree %.1f, emission %.1f)"
+                % (
+                    axis,
+                    value,
+                    case["States"],
+                    case["Transitions"],
+                    case["Timings"]["Total"],
+                    case["Timings"]["Expansion"],
+                    case["Timings"]["DecisionTree"],
+                    case["Timings"]["Emission"],
+                )
+            )
+
+    with open(report_filepath, "w") as report_file:
+        json.dump(report, report_file, indent=4, sort_keys=True)
+        report_file.write("\n")
+    print("Report stored in %s" % report_filepath)
+
+
+if __name__ == "__main__":
+    main()
@@ -10,36 +10,85 @@ signal sequence_readiness(sequence, progress)
 # Send a signal when an event occurs.
 signal process_event(event, pressed)
 
-class IntermediateState:
-	var state_name : String # State name
-	var access : Array = []
-	var pressed : Array = []
-	var access_name : Array = [] # Purely for debug purpose.
-	var timer_reset : Array = [] # For each control move, a timer reset can occurs.
-	var timeout_route : int # Timer timeout escape. No change in controls.
-	var fire : Array = [] # Sequence Identifier. -1 if none.
-	var freeze : Array = [] # Movement suppressor
-
 class ControlSequence:
 	var duration : int = 0 # ms
 	var cooldown : int = 0 # ms
 	var infer : Array = [] # Triggering this sequence trigger onter cooldown timers ONLY.
 
-onready var states : Array = [] # Array of IntermediateStates.
+# Version of the binary descriptor layout, see 'BINARY_DESCRIPTOR_VERSION' in generate.py.
+const BINARY_DESCRIPTOR_VERSION : int = 1
+
+# State machine, shared by the control groups. The state arrays are flat, as in the binary
+# descriptor : a control move is indexed by state * state_stride + control, the stride being the
+# control count + 1.
+onready var state_stride : int = 1
+
+# Target state of each control move.
+onready var state_access : PoolIntArray = PoolIntArray()
+
+# Expected control value of each control move : 1 for a press, 0 for a release.
+onready var state_pressed : PoolIntArray = PoolIntArray()
+
+# Sequence identifier fired by a control move. -1 if none.
+onready var state_fire : PoolIntArray = PoolIntArray()
+
+# Movement suppressor of a control move.
+onready var state_freeze : PoolIntArray = PoolIntArray()
+
+# The control move resets the sequence timer of the control group.
+onready var state_timer_reset : PoolIntArray = PoolIntArray()
+
+# The control press breaks a reachability constraint.
+onready var state_blocked : PoolIntArray = PoolIntArray()
+
+# Timer timeout escape of each state. No change in controls.
+onready var state_timeout_route : PoolIntArray = PoolIntArray()
+
+# Name of each state and target name of each control move. Purely for debug purpose, only
+# filled by a JSON descriptor generated without the '--release' option.
+onready var state_names : PoolStringArray = PoolStringArray()
+onready var access_names : PoolStringArray = PoolStringArray()
+
+# Current state of each control group. The groups have independent state machines.
+onready var current_states : PoolIntArray = PoolIntArray()
+
+# Control group of each control.
+onready var control_group : PoolIntArray = PoolIntArray()
+
+# Sequence matcher, run beside the state machine when the descriptor has been generated with the
+# '--sequence-matcher' option. The states then only track the pressed controls.
+# Next node of each node on a control press, indexed by node * (control count + 1) + control. The
+# failure links are resolved. Node 0 is the root.
+onready var matcher_goto : PoolIntArray = PoolIntArray()
+
+# Sequence identifier fired when reaching a node. -1 if none. Empty without matcher.
+onready var matcher_fire : PoolIntArray = PoolIntArray()
+
+# Movement suppressor of a node.
+onready var matcher_freeze : PoolIntArray = PoolIntArray()
 
-# Current state.
-onready var current_state : int
+# Current matcher node of each control group.
+onready var current_nodes : PoolIntArray = PoolIntArray()
 
-# Timer timeout in ms.
-onready var timer_timeout : Dictionary = {}
+# Timer timeout in ms, indexed by the timer identifiers (the '*_TIMER' constants of the
+# generated script).
+onready var timer_timeout : PoolIntArray = PoolIntArray()
 
 # Date at which the timer will expire. If -1, the timer is not in use.
-onready var timer_expire : Dictionary = {}
+onready var timer_expire : PoolIntArray = PoolIntArray()
+
+# Earliest expiration date of the running timers. -1 if no timer is running.
+# It may be earlier than the actual next expiration (a timer stopped before its date), the
+# timers are then scanned for nothing and it is computed again.
+onready var next_expiry : int = -1
+
+# A cooldown timer is running : its progress is sent on each frame.
+onready var cooldown_running : bool = false
 
 # Sequence description for cooldown and duration.
 onready var sequence : Array = []
 
-# Maximum identifier for sequence timer.
+# Maximum identifier for sequence timer. The sequence timer of each control group follows.
 onready var sequence_timer_max : int
 
 # Current state of the controls. The derived scripts might use this to determine animations,
@@ -49,8 +98,8 @@ onready var current_control : Array = []
 # Fake time. Fast alternative to OS calls.
 onready var current_time : int = 0
 
-# Keep starting state ID.
-onready var starting_state : int
+# Keep starting state ID of each control group.
+onready var starting_states : PoolIntArray = PoolIntArray()
 
 # Last control that was pressed. Can be 0 if a control as been released.
 onready var last_pressed_control : int
@@ -82,7 +131,13 @@ onready var start_date : int = -1
 # Sequence active.
 onready var sequence_active : bool = false
 
-## Initialisation. Read the JSON, collect and compute useful data.
+# An evaluation of the decision tree has been requested during the frame. Only used when the
+# script has been generated with the '--coalesce' option : 'invoke_decision_tree' then only sets
+# it, and the tree is evaluated once, at the end of '_process'.
+onready var decision_requested : bool = false
+
+## Initialisation. Read the descriptor, collect and compute useful data.
+## A descriptor ending with ".bin" is a packed binary descriptor, else it is the JSON one.
 func _ready():
 	set_process(false)
 	unshuffled_controls = [0]
@@ -91,70 +146,229 @@ func _ready():
 	var file = File.new()
 	var err = file.open(descriptor_filename, File.READ)
 	if err == OK:
-		var text_content = file.get_as_text()
-		var json_content = parse_json(text_content)
-		# Let the fun begins.
-		current_state = json_content["Start"]
-		starting_state = current_state
-		var control_count = json_content["ControlCount"]
-		for _i in range(control_count + 1):
-			current_control.append(false)
-			last_control_pressed.append(-1)
-			last_control_released.append(-1)
-		var json_sequences : Array = json_content["Sequences"]
-		var seq_count : int = json_sequences.size()
-		for i in range(seq_count):
-			var seq = json_sequences[i]
-			var control_sequence : ControlSequence = ControlSequence.new()
-			control_sequence.duration = seq["Duration"]
-			control_sequence.cooldown = seq["Cooldown"]
-			if "Infer" in seq:
-				control_sequence.infer = seq["Infer"]
-			sequence.append(control_sequence)
-			var id_duration : int = i * 2
-			var id_cooldown : int = id_duration + 1
-			timer_timeout[id_duration] = control_sequence.duration
-			timer_expire[id_duration] = -1
-			timer_timeout[id_cooldown] = control_sequence.cooldown
-			timer_expire[id_cooldown] = -1
-		sequence_timer_max = seq_count * 2
-		timer_timeout[sequence_timer_max] = json_content["SequenceTimeout"]
-		timer_expire[sequence_timer_max] = -1
-		var transitions : Array = json_content["Transitions"]
-		for t in transitions:
-			var state : IntermediateState = IntermediateState.new()
-			for _i in range(control_count+1):
-				state.access.append(0)
-				state.pressed.append(false)
-				state.access_name.append("")
-				state.fire.append(-1)
-				state.timer_reset.append([])
-				state.freeze.append(false)
-			for i in t:
-				if "Name" in i:
-					state.state_name = i["Name"]
-					continue
-				var target_id = i["Target"]
-				if "Control" in i:
-					var control : int = i["Control"]
-					state.access[control] = target_id
-					state.pressed[control] = i["Pressed"]
-					state.access_name[control] = i["State"]
-				if "Timeout" in i:
-					# For now, we only consider the "SequenceTimer" timeout.
-					state.timeout_route = target_id
-				if "Fire" in i:
-					state.fire[i["Control"]] = i["Fire"]
-				if "Timer" in i:
-					state.timer_reset[i["Control"]].append(seq_count * 2)
-				if "Freeze" in i:
-					state.freeze[i["Control"]] = i["Freeze"]
-			states.append(state)
-	else:
+		if descriptor_filename.ends_with(".bin"):
+			err = load_binary_descriptor(file)
+		else:
+			load_json_descriptor(file)
+		file.close()
+	if err != OK:
 		print("Unable to load file %s" % descriptor_filename)
 		get_tree().quit(-1)
 	set_process(true)
 
+func init_controls(control_count : int) -> void:
+	for _i in range(control_count + 1):
+		current_control.append(false)
+		last_control_pressed.append(-1)
+		last_control_released.append(-1)
+
+func add_sequence(duration : int, cooldown : int, infer : Array) -> void:
+	var control_sequence : ControlSequence = ControlSequence.new()
+	control_sequence.duration = duration
+	control_sequence.cooldown = cooldown
+	control_sequence.infer = infer
+	var id_duration : int = sequence.size() * 2
+	var id_cooldown : int = id_duration + 1
+	sequence.append(control_sequence)
+	init_timer(id_duration, control_sequence.duration)
+	init_timer(id_cooldown, control_sequence.cooldown)
+
+func init_sequence_timer(timeout : int) -> void:
+	sequence_timer_max = sequence.size() * 2
+	for g in range(starting_states.size()):
+		init_timer(sequence_timer_max + g, timeout)
+
+# Declare the control groups : their start state and the group of each control.
+func init_groups(starts : PoolIntArray, groups : PoolIntArray) -> void:
+	starting_states = starts
+	current_states = starts
+	control_group = groups
+	current_nodes.resize(starts.size())
+	for g in range(starts.size()):
+		current_nodes[g] = 0
+
+# Load the sequence matcher nodes of the JSON descriptor. The failure links are resolved once,
+# in breadth first order : the failure link of a node targets an earlier node.
+func load_matcher(nodes : Array, control_count : int) -> void:
+	var stride : int = control_count + 1
+	matcher_goto.resize(nodes.size() * stride)
+	for n in range(nodes.size()):
+		for c in range(stride):
+			matcher_goto[n * stride + c] = 0 if n == 0 else matcher_goto[nodes[n]["Fail"] * stride + c]
+		for edge in nodes[n]["Edges"]:
+			matcher_goto[n * stride + edge[0]] = edge[1]
+		matcher_fire.append(nodes[n]["Fire"] if "Fire" in nodes[n] else -1)
+		matcher_freeze.append(1 if "Freeze" in nodes[n] else 0)
+
+# Advance the sequence matcher of a control group with a pressed control. The sequence timer is
+# reset while a sequence progresses. Return the reached node.
+func step_matcher(group : int, control : int) -> int:
+	var node : int = matcher_goto[current_nodes[group] * current_control.size() + control]
+	if matcher_fire[node] >= 0:
+		current_nodes[group] = 0
+	else:
+		current_nodes[group] = node
+		if node != 0:
+			var timer : int = sequence_timer_max + group
+			schedule_timer(timer, current_time + timer_timeout[timer])
+	return node
+
+# Declare a timer, not in use, with its timeout. The timer arrays grow as needed.
+func init_timer(timer : int, timeout : int) -> void:
+	var count : int = timer_expire.size()
+	if timer >= count:
+		timer_expire.resize(timer + 1)
+		timer_timeout.resize(timer + 1)
+		for i in range(count, timer + 1):
+			timer_expire[i] = -1
+			timer_timeout[i] = 0
+	timer_timeout[timer] = timeout
+	timer_expire[timer] = -1
+
+# Set the expiration date of a timer.
+func schedule_timer(timer : int, date : int) -> void:
+	timer_expire[timer] = date
+	if date > 0 and (next_expiry < 0 or date < next_expiry):
+		next_expiry = date
+	if timer < sequence_timer_max and timer % 2 == 1:
+		cooldown_running = true
+
+# Compute the earliest expiration date of the running timers.
+func update_next_expiry() -> void:
+	next_expiry = -1
+	for i in range(timer_expire.size()):
+		var date : int = timer_expire[i]
+		if date > 0 and (next_expiry < 0 or date < next_expiry):
+			next_expiry = date
+
+# Array of 'count' values.
+func filled_int_array(count : int, value : int) -> PoolIntArray:
+	var result : PoolIntArray = PoolIntArray()
+	result.resize(count)
+	for i in range(count):
+		result[i] = value
+	return result
+
+# Allocate the state arrays with their default values. The debug names are only allocated when
+# the descriptor holds them.
+func init_states(state_count : int, control_count : int, debug_names : bool) -> void:
+	state_stride = control_count + 1
+	var size : int = state_count * state_stride
+	state_access = filled_int_array(size, 0)
+	state_pressed = filled_int_array(size, 0)
+	state_fire = filled_int_array(size, -1)
+	state_freeze = filled_int_array(size, 0)
+	state_timer_reset = filled_int_array(size, 0)
+	state_blocked = filled_int_array(size, 0)
+	state_timeout_route = filled_int_array(state_count, 0)
+	if debug_names:
+		state_names.resize(state_count)
+		access_names.resize(size)
+
+func load_json_descriptor(file : File) -> void:
+	var text_content = file.get_as_text()
+	var json_content = parse_json(text_content)
+	# Let the fun begins.
+	var control_count = json_content["ControlCount"]
+	init_controls(control_count)
+	var starts : PoolIntArray = PoolIntArray([json_content["Start"]])
+	var groups : PoolIntArray = filled_int_array(control_count + 1, 0)
+	if "Groups" in json_content:
+		starts = PoolIntArray()
+		for g in range(json_content["Groups"].size()):
+			starts.append(json_content["Groups"][g]["Start"])
+			for c in json_content["Groups"][g]["Controls"]:
+				groups[c] = g
+	init_groups(starts, groups)
+	if "Matcher" in json_content:
+		load_matcher(json_content["Matcher"], control_count)
+	var json_sequences : Array = json_content["Sequences"]
+	var seq_count : int = json_sequences.size()
+	for i in range(seq_count):
+		var seq = json_sequences[i]
+		add_sequence(seq["Duration"], seq["Cooldown"], seq["Infer"] if "Infer" in seq else [])
+	init_sequence_timer(json_content["SequenceTimeout"])
+	var transitions : Array = json_content["Transitions"]
+	# Descriptors generated with the '--release' option have neither state names nor default
+	# values.
+	var debug_names : bool = transitions.size() > 0 and transitions[0].size() > 0 and "Name" in transitions[0][0]
+	init_states(transitions.size(), control_count, debug_names)
+	for s in range(transitions.size()):
+		var offset : int = s * state_stride
+		for i in transitions[s]:
+			if "Name" in i:
+				state_names[s] = i["Name"]
+				continue
+			var target_id = i["Target"]
+			if "Control" in i:
+				var control : int = i["Control"]
+				state_access[offset + control] = target_id
+				state_pressed[offset + control] = 1 if "Pressed" in i and i["Pressed"] else 0
+				if debug_names:
+					access_names[offset + control] = i["State"]
+			if "Timeout" in i:
+				# For now, we only consider the "SequenceTimer" timeout.
+				state_timeout_route[s] = target_id
+			if "Fire" in i:
+				state_fire[offset + i["Control"]] = i["Fire"]
+			if "Timer" in i:
+				state_timer_reset[offset + i["Control"]] = 1
+			if "Freeze" in i:
+				state_freeze[offset + i["Control"]] = 1 if i["Freeze"] else 0
+			if "Blocked" in i:
+				state_blocked[offset + i["Control"]] = 1 if i["Blocked"] else 0
+
+# Read 'count' little-endian int32 values in one bulk read. The bytes are prefixed with the
+# header of a serialized PoolIntArray (its type and size), so that 'bytes2var' decodes them at
+# once.
+func read_int_array(file : File, count : int) -> PoolIntArray:
+	var header : StreamPeerBuffer = StreamPeerBuffer.new()
+	header.put_32(TYPE_INT_ARRAY)
+	header.put_32(count)
+	var data : PoolByteArray = header.data_array
+	data.append_array(file.get_buffer(count * 4))
+	return bytes2var(data)
+
+# Load the packed descriptor generated with the '--binary' option. See 'pack_descriptor' in
+# generate.py for the layout. The state sections are the runtime state arrays.
+func load_binary_descriptor(file : File) -> int:
+	if file.get_buffer(4).get_string_from_ascii() != "CFSM":
+		return ERR_FILE_UNRECOGNIZED
+	var header : PoolIntArray = read_int_array(file, 7)
+	if header[0] != BINARY_DESCRIPTOR_VERSION:
+		return ERR_FILE_UNRECOGNIZED
+	var control_count : int = header[2]
+	var state_count : int = header[4]
+	var seq_count : int = header[5]
+	init_controls(control_count)
+	var durations : PoolIntArray = read_int_array(file, seq_count)
+	var cooldowns : PoolIntArray = read_int_array(file, seq_count)
+	var infer_offsets : PoolIntArray = read_int_array(file, seq_count + 1)
+	var infer_ids : PoolIntArray = read_int_array(file, header[6])
+	for i in range(seq_count):
+		var infer : Array = []
+		for j in range(infer_offsets[i], infer_offsets[i + 1]):
+			infer.append(infer_ids[j])
+		add_sequence(durations[i], cooldowns[i], infer)
+	state_stride = control_count + 1
+	var size : int = state_count * state_stride
+	state_access = read_int_array(file, size)
+	state_pressed = read_int_array(file, size)
+	state_fire = read_int_array(file, size)
+	state_freeze = read_int_array(file, size)
+	state_timer_reset = read_int_array(file, size)
+	state_timeout_route = read_int_array(file, state_count)
+	state_blocked = read_int_array(file, size)
+	var group_count : int = read_int_array(file, 1)[0]
+	var starts : PoolIntArray = read_int_array(file, group_count)
+	init_groups(starts, read_int_array(file, state_stride))
+	var node_count : int = read_int_array(file, 1)[0]
+	matcher_goto = read_int_array(file, node_count * state_stride)
+	matcher_fire = read_int_array(file, node_count)
+	matcher_freeze = read_int_array(file, node_count)
+	init_sequence_timer(header[3])
+	return OK
+
 func set_start_date(duration : int) -> void:
 	start_date = current_time + duration
 
@@ -182,7 +396,9 @@ func reset_timers() -> void:
 # Reset the state machine.
 func reset() -> void:
 	set_process(false)
-	current_state = starting_state
+	current_states = starting_states
+	for g in range(current_nodes.size()):
+		current_nodes[g] = 0
 	reset_timers()
 	reset_controls()
 	set_process(true)
@@ -201,18 +417,29 @@ func set_move(control : int, pressed : bool) -> void:
 		last_control_released[filtered_control] = current_time
 
 	if can_move():
-		if states[current_state].pressed[filtered_control] != pressed: # Uh oh ... We're out of the scope.
+		# Only the state machine of the control group moves.
+		var group : int = control_group[filtered_control]
+		var move : int = current_states[group] * state_stride + filtered_control
+		if (state_pressed[move] != 0) != pressed: # Uh oh ... We're out of the scope.
+			return
+		if state_blocked[move] != 0: # Too many controls pressed, ignore it.
 			return
-		for timer in states[current_state].timer_reset[filtered_control]:
-			timer_expire[timer] = current_time + timer_timeout[timer]
-		var seq_id : int = states[current_state].fire[filtered_control]
+		if state_timer_reset[move] != 0:
+			var timer : int = sequence_timer_max + group
+			schedule_timer(timer, current_time + timer_timeout[timer])
+		var seq_id : int = state_fire[move]
+		var freeze : bool = state_freeze[move] != 0
+		if pressed and matcher_fire.size() > 0:
+			var node : int = step_matcher(group, filtered_control)
+			seq_id = matcher_fire[node]
+			freeze = seq_id >= 0 or matcher_freeze[node] != 0
 		var override_sequence : bool = true
 		if pressed and seq_id >= 0 and (not dampened) and start_date < 0 and sequence_active:
-			timer_expire[sequence.size() * 2] = -1
+			timer_expire[sequence_timer_max + group] = -1
 			if timer_expire[(seq_id * 2) + 1] < 0: # If the timer is a cooldown, we don't activate special move.
 				if sequence[seq_id].duration > 0:
-					timer_expire[seq_id * 2] = current_time + sequence[seq_id].duration
-				timer_expire[(seq_id * 2) + 1] = current_time + sequence[seq_id].cooldown
+					schedule_timer(seq_id * 2, current_time + sequence[seq_id].duration)
+				schedule_timer((seq_id * 2) + 1, current_time + sequence[seq_id].cooldown)
 				freezed = true
 				override_sequence = activate_sequence(seq_id, sequence[seq_id].duration, sequence[seq_id].cooldown)
 				emit_signal("sequence_readiness", seq_id, 1.0)
@@ -220,44 +447,62 @@ func set_move(control : int, pressed : bool) -> void:
 				for i in sequence[seq_id].infer:
 					var id : int = int((i * 2) + 1)
 					var inf_id : int = int(i)
-					timer_expire[id] = current_time + sequence[inf_id].cooldown
+					schedule_timer(id, current_time + sequence[inf_id].cooldown)
 		in_sequence = false
 		for i in range(sequence.size()):
 			in_sequence = in_sequence or timer_expire[i * 2] > 0
-		var next_state : int = states[current_state].access[filtered_control]
+		var next_state : int = state_access[move]
 		if pressed:
-			freezed = states[current_state].freeze[filtered_control]
+			freezed = freeze
 		if (override_sequence or (not in_sequence)) and (not freezed):
 #			invoke_decision_tree()
 			process_move(filtered_control, pressed)
 			emit_signal("process_event", filtered_control, pressed)
 		# Switch to next state.
-		current_state = next_state
+		current_states[group] = next_state
 
 # Is the character in dead-zone.
 func is_in_sequence() -> bool:
 	return in_sequence
 
-func break_sequence() -> void:
-	var next_state : int = states[current_state].timeout_route
-	current_state = next_state
-	timer_expire[sequence_timer_max] = -1
+func break_sequence(group : int) -> void:
+	if matcher_fire.size() > 0:
+		current_nodes[group] = 0
+	else:
+		var next_state : int = state_timeout_route[current_states[group]]
+		current_states[group] = next_state
+	timer_expire[sequence_timer_max + group] = -1
 
 # Processing function. Deal with the different timeouts.
 # Uses delta to increment the current time. It's a quick alternative to OS calls.
+# The timers are only scanned once the earliest expiration date is reached.
 func _process(delta : float):
 	current_time += int(delta * 1000)
 	if current_time > start_date:
 		start_date = -1
-	for i in timer_expire.keys():
-		if timer_expire[i] > 0:
-			if i < sequence_timer_max and i % 2 == 1: # Cooldown timer.
-				emit_signal("sequence_readiness", (i - 1) / 2, (timer_expire[i] - current_time) / float(timer_timeout[i]))
+	if cooldown_running:
+		cooldown_running = false
+		for s in range(sequence.size()):
+			var i : int = (s * 2) + 1
+			if timer_expire[i] > 0:
+				cooldown_running = true
+				emit_signal("sequence_readiness", s, (timer_expire[i] - current_time) / float(timer_timeout[i]))
+	if next_expiry > 0 and next_expiry <= current_time:
+		expire_timers()
+	delegate_process()
+	if decision_requested:
+		# The evaluation may request another one : it is run at the next frame.
+		decision_requested = false
+		run_decision_tree()
+
+# Stop the timers which expiration date is reached.
+func expire_timers() -> void:
+	for i in range(timer_expire.size()):
 		if timer_expire[i] <= current_time and timer_expire[i] > 0:
 			timer_expire[i] = -1
 			on_timer_expire(i)
-			if i == sequence_timer_max: #  Sequence breaker timeout.
-				break_sequence()
+			if i >= sequence_timer_max and i < sequence_timer_max + current_states.size(): #  Sequence breaker timeout.
+				break_sequence(i - sequence_timer_max)
 			elif i < sequence_timer_max:
 				if i % 2 == 1: # Cooldown timer.
 					emit_signal("sequence_readiness", (i - 1) / 2, 0.0)
@@ -266,13 +511,14 @@ func _process(delta : float):
 					in_sequence = false
 					for j in range(sequence.size()):
 						in_sequence = in_sequence or timer_expire[j * 2] > 0
-	delegate_process()
+	# The expiration callbacks may have started timers.
+	update_next_expiry()
 
 # Trigger a timer
 func trigger_timer(timer : int, override : bool = false) -> bool:
 	if current_time < timer_expire[timer] and !override:
 		return false
-	timer_expire[timer] = current_time + timer_timeout[timer]
+	schedule_timer(timer, current_time + timer_timeout[timer])
 	
 	return true
 
@@ -316,6 +562,11 @@ func block_special_moves(var flag : bool) -> void:
 func invoke_decision_tree() -> void:
 	pass
 
+# Invoked at the end of the frame when an evaluation of the decision tree has been requested
+# (coalesced mode only).
+func run_decision_tree() -> void:
+	pass
+
 # Invoked when a sequence has been completed.
 # sequence_id is the identifier of the sequence (which value matches a constant generated in the
 #   singleton.
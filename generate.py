@@ -5,19 +5,174 @@ import sys
 import json
 import queue
 import copy
+import collections
+import math
+import hashlib
+import shutil
+import struct
+import io
+import contextlib
+import traceback
+import multiprocessing
+import time
+import tracemalloc
+import cProfile
 from pprint import pprint
 import getopt
 
 VERBOSE_MODE = False
 
+# Bump whenever the generated artifacts change for an identical input.
+GENERATOR_VERSION = "1.0.0"
+
+# Default build cache cap, in megabytes.
+DEFAULT_CACHE_SIZE = 64
+
+
+# Generation options that change the generated artifacts.
+def default_options():
+    return {
+        "Minimize": False,  # Merge equivalent states of the control state machine.
+        "SequenceMatcher": False,  # Match the sequences beside the control state machine.
+        "Coalesce": False,  # Evaluate the decision tree once per frame, on request.
+        "Binary": False,  # Also store the pre-computed graph as a packed binary descriptor.
+        "Release": False,  # Minified pre-computed graph, without state names nor defaults.
+        "Strategy": "count",  # Decision tree symbol election : "count" or "entropy".
+        "Engine": "tree",  # Decision code generation : "tree", "mdd" or "table".
+        "Profile": False,  # Record the duration and memory peak of the generation phases.
+        "ProfileDirectory": None,  # Where to store the profile reports and cProfile dumps.
+    }
+
+
 type_to_class = {"bool": bool, "Timer": bool, "Control": int}
 
 
+# Errors raised by the generation. The command line prints the message and exits with the
+# status.
+class GenerationError(Exception):
+    def __init__(self, message, status=1):
+        super().__init__(message)
+        self.status = status
+
+
+# The configurations are inconsistent : undefined or mistyped symbol, unknown control, sequence
+# collision...
+class ConfigurationError(GenerationError):
+    pass
+
+
+# The generator failed on consistent configurations.
+class InternalError(GenerationError):
+    pass
+
+
 def log_verbose(message):
     if VERBOSE_MODE:
         print(message)
 
 
+# Profiling
+# While a configuration is profiled, PROFILE holds a record per phase, indexed by its path
+# ("DecisionTree/Build" for instance) : the wall time, the number of calls and the highest
+# traced memory (tracemalloc) during the phase. Phases are nested with 'profile_begin' and
+# 'profile_end', 'profile_switch' ends the current phase and begins the next one.
+PROFILE = None
+
+
+# Tracing already started by the caller (a benchmark, a test harness) is left running.
+def start_profile():
+    global PROFILE
+    PROFILE = {"Records": {}, "Stack": [], "Peaks": [0], "Tracing": False}
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+        PROFILE["Tracing"] = True
+    tracemalloc.reset_peak()
+
+
+def stop_profile():
+    global PROFILE
+    while len(PROFILE["Stack"]) > 0:
+        profile_end()
+    records = PROFILE["Records"]
+    if PROFILE["Tracing"]:
+        tracemalloc.stop()
+    PROFILE = None
+    return records
+
+
+def profile_begin(name):
+    if PROFILE is None:
+        return
+    stack = PROFILE["Stack"]
+    peaks = PROFILE["Peaks"]
+    # The peak of the enclosing phase is kept aside, the peak is then reset for this phase.
+    peaks[-1] = max(peaks[-1], tracemalloc.get_traced_memory()[1])
+    tracemalloc.reset_peak()
+    path = name if len(stack) == 0 else "%s/%s" % (stack[-1][0], name)
+    # Records are created on entry, so that a phase is listed before its sub-phases.
+    PROFILE["Records"].setdefault(path, {"Time": 0.0, "Calls": 0, "Peak": 0})
+    stack.append((path, time.perf_counter()))
+    peaks.append(0)
+
+
+def profile_end():
+    if PROFILE is None:
+        return
+    path, start = PROFILE["Stack"].pop()
+    duration = time.perf_counter() - start
+    peaks = PROFILE["Peaks"]
+    peak = max(peaks.pop(), tracemalloc.get_traced_memory()[1])
+    tracemalloc.reset_peak()
+    peaks[-1] = max(peaks[-1], peak)
+    record = PROFILE["Records"][path]
+    record["Time"] += duration
+    record["Calls"] += 1
+    record["Peak"] = max(record["Peak"], peak)
+
+
+def profile_switch(name):
+    profile_end()
+    profile_begin(name)
+
+
+def print_profile(config_filepath, records):
+    print("## Profile of '%s'" % config_filepath)
+    print("%-40s %12s %8s %12s" % ("Phase", "Time (ms)", "Calls", "Peak (KiB)"))
+    for path, record in records.items():
+        print(
+            "%-40s %12.3f %8d %12.1f"
+            % (
+                "  " * path.count("/") + path.split("/")[-1],
+                record["Time"] * 1000,
+                record["Calls"],
+                record["Peak"] / 1024,
+            )
+        )
+
+
+# Print the profile of a configuration. When a directory is given, also store the profile as
+# '{config}_profile.json' and the cProfile statistics as '{config}.prof'.
+def report_profile(config_filepath, records, profiler, profile_directory):
+    print_profile(config_filepath, records)
+    if profile_directory is None:
+        return
+    base_name = os.path.splitext(os.path.basename(config_filepath))[0]
+    report = {"Configuration": config_filepath, "Phases": {}}
+    for path, record in records.items():
+        report["Phases"][path] = {
+            "Time": round(record["Time"] * 1000, 3),
+            "Calls": record["Calls"],
+            "Peak": record["Peak"],
+        }
+    report_path = os.path.join(profile_directory, "%s_profile.json" % base_name)
+    with open(report_path, "w") as report_file:
+        json.dump(report, report_file, indent=4)
+        report_file.write("\n")
+    stats_path = os.path.join(profile_directory, "%s.prof" % base_name)
+    profiler.dump_stats(stats_path)
+    print("Profile stored in %s and %s" % (report_path, stats_path))
+
+
 def sort_counters_dict(dictionary):
     return dict(sorted(dictionary.items(), key=lambda a: a[1], reverse=True))
 
@@ -82,33 +237,26 @@ def trigger_signals(indent, signals, common_signals, control_id, file_d):
         write_indent(file_d, indent, "emit_signal(%s)" % (", ".join(arguments_list)))
 
 
+# Timers are identified by the '{NAME}_TIMER' constants of the controller. With a prefix, the
+# timers of another controller are triggered, with the constants of its own script.
 def trigger_timers(out_gd, level, triggers, prefix=""):
     for t in triggers:
-        trigger_name = "%s" % t.upper()
-        if prefix == "":
-            if "reset" == triggers[t]:
-                write_indent(
-                    out_gd,
-                    level,
-                    'trigger_timer(TIMERS_IDENTIFIER["%s"], true)' % (trigger_name),
-                )
-            else:
-                write_indent(
-                    out_gd,
-                    level,
-                    'trigger_timer(TIMERS_IDENTIFIER["%s"])' % (trigger_name),
-                )
+        timer_name = "%s%s_TIMER" % (prefix, t.upper())
+        if "reset" == triggers[t]:
+            write_indent(
+                out_gd, level, "%strigger_timer(%s, true)" % (prefix, timer_name)
+            )
         else:
-            if "reset" == triggers[t]:
-                write_indent(
-                    out_gd,
-                    level,
-                    '%strigger_timer("%s", true)' % (prefix, trigger_name),
-                )
-            else:
-                write_indent(
-                    out_gd, level, '%strigger_timer("%s")' % (prefix, trigger_name)
-                )
+            write_indent(out_gd, level, "%strigger_timer(%s)" % (prefix, timer_name))
+
+
+# Loop header over the other members of a group, from the registry of 'global_controls.gd'.
+# The controlled node of the group is not part of them.
+def group_others_loop(group):
+    return 'for i in GlobalControls.get_group_others("%s", controlled_node_%s):' % (
+        group,
+        group.lower(),
+    )
 
 
 # current_rules : Rules that are still to evaluate.
@@ -156,27 +304,6 @@ def compute_rules_sorted_by_attribute_values(current_rules, possible_attr_values
     return result
 
 
-# Retrieve rules from attributes.
-def retrieve_rules(current_rules, attributes_values):
-    result = {}
-    for rule in current_rules:
-        condition = current_rules[rule]["Conditions"]
-        compatible = True
-        for a in attributes_values:
-            attribute_name = a["Attribute"]
-            attribute_value = a["Value"]
-            if attribute_name not in condition:
-                compatible = False
-                break
-            stored_value = condition[attribute_name]
-            if stored_value != attribute_value:
-                compatible = False
-                break
-        if compatible:
-            result[rule] = current_rules[rule]
-    return result
-
-
 # The input must be sorted.
 def compute_highest(computed_values):
     candidates_attributes = []
@@ -192,25 +319,65 @@ def compute_highest(computed_values):
     return candidates_attributes
 
 
-def is_in_history(attr, history):
-    for h in history:
-        if h["Attribute"] == attr:
-            return True
-    return False
+def popcount(bitset):
+    return bin(bitset).count("1")
 
 
-# Return the symbols and their values from the current ruleset.
-def retrieve_symbols(current_rules, history):
+# Inverted rule index. Rules are numbered in declaration order and a set of rules is a bitset.
+# {
+#    "Rules" : [ "rule1", ... ],
+#    "Values" : { "attribute" : { value : bitset of the rules expecting this value } },
+#    "NonNone" : { "attribute" : bitset of the rules with a condition on the attribute },
+#    "Position" : { "attribute" : [ position of the attribute in the conditions of each rule ] }
+# }
+def build_rule_index(total_rules):
+    rules = list(total_rules.keys())
+    values = {}
+    non_none = {}
+    position = {}
+    for r in range(len(rules)):
+        conditions = total_rules[rules[r]]["Conditions"]
+        p = 0
+        for a in conditions:
+            if a not in values:
+                values[a] = {}
+                non_none[a] = 0
+                position[a] = [0] * len(rules)
+            v = conditions[a]
+            values[a][v] = values[a].get(v, 0) | (1 << r)
+            if v is not None:
+                non_none[a] |= 1 << r
+            position[a][r] = p
+            p += 1
+    return {"Rules": rules, "Values": values, "NonNone": non_none, "Position": position}
+
+
+def lowest_rule(bitset):
+    return (bitset & -bitset).bit_length() - 1
+
+
+# Return the rules of a bitset, in declaration order.
+def bitset_rules(bitset):
+    rule_ids = []
+    while bitset != 0:
+        rule_ids.append(lowest_rule(bitset))
+        bitset &= bitset - 1
+    return rule_ids
+
+
+# Return the symbols constrained by the rule set (outside the history) and their values : None
+# first, then the other values in order of appearance in the rules.
+def retrieve_symbols_from_index(rule_index, rule_set, history_attributes):
     symbols = {}
-    for c in current_rules:
-        for a in current_rules[c]["Conditions"]:
-            if is_in_history(a, history):
-                continue
-            if a not in symbols:
-                symbols[a] = []
-                symbols[a].append(None)
-            if not current_rules[c]["Conditions"][a] in symbols[a]:
-                symbols[a].append(current_rules[c]["Conditions"][a])
+    for a in rule_index["Values"]:
+        if a in history_attributes:
+            continue
+        values = []
+        for v, bitset in rule_index["Values"][a].items():
+            if v is not None and bitset & rule_set:
+                values.append((lowest_rule(bitset & rule_set), v))
+        values.sort(key=lambda e: e[0])
+        symbols[a] = [None] + [v for (_, v) in values]
     return symbols
 
 
@@ -222,6 +389,26 @@ def write_indent(fl, indent, text):
     fl.write("\n")
 
 
+# Write the generated files, given as a dictionary of contents indexed by their path relative
+# to the output directory. Each file is first written aside then renamed over its target, so
+# that a reader never sees a partially written file. The file written aside is removed when
+# the write fails.
+def write_artifacts(output_directory, artifacts):
+    for path, content in artifacts.items():
+        target = os.path.join(output_directory, path)
+        temporary = "%s.tmp%d" % (target, os.getpid())
+        try:
+            with open(
+                temporary, "wb" if isinstance(content, bytes) else "w"
+            ) as artifact_file:
+                artifact_file.write(content)
+            os.replace(temporary, target)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+
+
 # Transform stack to a more readable form
 def produce_readable_stack(stack):
     result = []
@@ -247,24 +434,10 @@ def produce_readable_stack(stack):
     return result
 
 
-# Create decision tree
-def create_decision_tree(
-    total_rules,
-    symbols_types,
-    symbols_declared_types,
-    config_name,
-    common_signals,
-    control_id,
-    is_debug,
-    output_directory,
-):
-    if VERBOSE_MODE:
-        print("## Symbols Types")
-        pprint(symbols_types)
-        print("## Rule set")
-        pprint(total_rules)
-    # rules = dictionary of rules
-    # attributes = all the attributes in the rules with name and types.
+# Build the decision tree from the rules. Branches without any rule are marked with "Prune".
+# strategy : "count" elects the symbol used by most rules (lowest cardinality on ties),
+#   "entropy" the one with best information gain per evaluation cost.
+def build_decision_tree(total_rules, symbols_declared_types, strategy):
     branches = queue.Queue()
     decision_tree = {"History": []}
     # Decision_tree structure will be:
@@ -279,23 +452,31 @@ def create_decision_tree(
     #    }
     # }
 
-    branches.put(decision_tree)
+    rule_index = build_rule_index(total_rules)
+    rules = rule_index["Rules"]
+    # Branches are queued with the set of rules compatible with their history.
+    branches.put((decision_tree, (1 << len(rules)) - 1))
     prune_count = 0
     event_count = 0
     while not branches.empty():
-        cursor = branches.get()
+        cursor, rule_set = branches.get()
         history = cursor["History"]
-        current_rules = retrieve_rules(total_rules, history)
-        current_symbols_occurrence = retrieve_symbols(current_rules, history)
+        history_attributes = set([h["Attribute"] for h in history])
+        profile_begin("RuleRetrieval")
+        current_symbols_occurrence = retrieve_symbols_from_index(
+            rule_index, rule_set, history_attributes
+        )
+        profile_end()
+        rule_count = popcount(rule_set)
         if VERBOSE_MODE:
             print("# New Iteration %s" % history)
             print("## Constrained rule set")
-            pprint(current_rules)
+            pprint([rules[r] for r in range(len(rules)) if (rule_set >> r) & 1])
             print("## Constrained symbol set")
             pprint(current_symbols_occurrence)
 
         search_attribute = True
-        if len(current_rules) == 1:  # Leaf
+        if rule_count == 1:  # Leaf
             # Not so fast ! What about the attributes ?
             # Count meaningful attributes.
             meaningful_attributes = False
@@ -306,75 +487,55 @@ def create_decision_tree(
                     name = s
                     break
             if not meaningful_attributes:
-                cursor["Event"] = list(current_rules.keys())[0]
+                cursor["Event"] = rules[lowest_rule(rule_set)]
                 log_verbose("## Leaf to '%s'" % cursor["Event"])
                 event_count += 1
                 search_attribute = False
             else:
                 log_verbose("## Still meaningful attribute '%s'. No leaf." % name)
-        elif len(current_rules) == 0:  # Leaf to prune.
+        elif rule_count == 0:  # Leaf to prune.
             cursor["Prune"] = True
             log_verbose("## Leaf to prune")
             prune_count += 1
             search_attribute = False
         if search_attribute:
             # Elect the symbols with most occurences.
+            # Symbols are considered in order of appearance in the rule set.
+            first_seen = []
+            for a in rule_index["NonNone"]:
+                constrained = rule_index["NonNone"][a] & rule_set
+                if a in history_attributes or constrained == 0:
+                    continue
+                r = lowest_rule(constrained)
+                first_seen.append(((r, rule_index["Position"][a][r]), a))
+            first_seen.sort(key=lambda e: e[0])
             symbol_count = {}
-            for c in current_rules:
-                for a in current_rules[c]["Conditions"]:
-                    if (
-                        is_in_history(a, cursor["History"])
-                        or current_rules[c]["Conditions"][a] is None
-                    ):
-                        continue
-                    if a not in symbol_count:
-                        symbol_count[a] = 1
-                    else:
-                        symbol_count[a] += 1
+            for _, a in first_seen:
+                symbol_count[a] = popcount(rule_index["NonNone"][a] & rule_set)
             if len(symbol_count) == 0:
                 cursor["Prune"] = True
                 prune_count += 1
                 continue
-            sorted_symbol_count = sort_counters_dict(symbol_count)
-            candidates = compute_highest(sorted_symbol_count)
-            if len(candidates) > 1:
-                # Let's determine, for candidates, the number of different values.
-                value_per_candidate = {}
-                for candidate in candidates:
-                    value_per_candidate[candidate] = set()
-                for c in current_rules:
-                    for a in current_rules[c]["Conditions"]:
-                        if (
-                            a in candidates
-                            and current_rules[c]["Conditions"][a] is not None
-                        ):
-                            value_per_candidate[a].add(
-                                current_rules[c]["Conditions"][a]
-                            )
-                if VERBOSE_MODE:
-                    pprint(value_per_candidate)
-                card_per_candidate = dict(
-                    {(k, len(v)) for (k, v) in value_per_candidate.items()}
+            if strategy == "entropy":
+                choosen_attribute = select_attribute_by_gain(
+                    rule_index,
+                    rule_set,
+                    symbol_count,
+                    current_symbols_occurrence,
+                    symbols_declared_types,
                 )
-                sorted_card = sort_counters_dict(card_per_candidate)
-                if VERBOSE_MODE:
-                    print("## Cardinality per candidate")
-                    print(sorted_card)
-                choosen_attribute = list(sorted_card.keys())[
-                    len(sorted_card) - 1
-                ]  # Should not be empty.
             else:
-                # Get the first (and only) one
-                choosen_attribute = list(sorted_symbol_count.keys())[
-                    0
-                ]  # Should not be empty.
+                choosen_attribute = select_attribute_by_count(
+                    symbol_count, current_symbols_occurrence
+                )
             # Hence, the cursor is attributed to the choosen_attribute.
             cursor["Attributes"] = choosen_attribute
             log_verbose("## Selected symbol : %s" % choosen_attribute)
             # Now, branch.
             cursor["Values"] = {}
+            values_rules = rule_index["Values"][choosen_attribute]
             for v in current_symbols_occurrence[choosen_attribute]:
-                new_history = copy.deepcopy(cursor["History"])
+                new_history = list(cursor["History"])
                 new_history.append({"Attribute": choosen_attribute, "Value": v})
                 new_cursor = {"History": new_history}
                 cursor["Values"][v] = new_cursor
@@ -382,469 +543,1681 @@ def create_decision_tree(
                     "### Add branch for attribute '%s' and value '%s'"
                     % (choosen_attribute, v)
                 )
-                branches.put(new_cursor)
+                branches.put((new_cursor, rule_set & values_rules.get(v, 0)))
     if event_count == 0:
         if VERBOSE_MODE:
-            print("!!! Internal Error : No event matched !!!")
             pprint(decision_tree)
-        sys.exit(1)
+        raise InternalError("No event matched")
     if prune_count > 0:
         log_verbose("!!! %d branches to prune !!!" % prune_count)
-        # Let's do this.
+
+    return decision_tree
+
+
+# Elect the symbol with most occurences. On ties, the one with the lowest number of values.
+def select_attribute_by_count(symbol_count, current_symbols_occurrence):
+    sorted_symbol_count = sort_counters_dict(symbol_count)
+    candidates = compute_highest(sorted_symbol_count)
+    if len(candidates) > 1:
+        # Let's determine, for candidates, the number of different values.
+        card_per_candidate = {}
+        for candidate in candidates:
+            card_per_candidate[candidate] = (
+                len(current_symbols_occurrence[candidate]) - 1
+            )
+        sorted_card = sort_counters_dict(card_per_candidate)
         if VERBOSE_MODE:
-            pprint(decision_tree)
-        prune = queue.Queue()
-        prune.put(decision_tree)
-        while not prune.empty():
-            cursor = prune.get()
-            to_remove = []
-            if "Event" in cursor:
-                continue
+            print("## Cardinality per candidate")
+            print(sorted_card)
+        choosen_attribute = list(sorted_card.keys())[
+            len(sorted_card) - 1
+        ]  # Should not be empty.
+    else:
+        # Get the first (and only) one
+        choosen_attribute = list(sorted_symbol_count.keys())[
+            0
+        ]  # Should not be empty.
+    return choosen_attribute
+
+
+# Relative cost of a symbol evaluation in the generated code. Timers are function calls
+# reading the 'timer_expire' PoolIntArray (a bound check and two indexed reads) while the other
+# symbols are plain variable reads. The call dominates since the timers left the dictionary.
+SYMBOL_EVALUATION_COST = {"bool": 1.0, "Timer": 2.0, "Control": 1.0}
+
+
+def rule_set_entropy(rule_set):
+    count = popcount(rule_set)
+    return math.log2(count) if count > 0 else 0.0
+
+
+# Elect the symbol with the best information gain per evaluation cost.
+# Rules without condition on a symbol stay candidates whatever its value. The gain is the
+# entropy of the rule set minus the expected entropy of the candidates once the symbol value
+# is known, values being equiprobable. Control values are tested in an 'elif' chain, so their
+# cost grows with the number of values. Ties are broken as in the 'count' strategy.
+def select_attribute_by_gain(
+    rule_index,
+    rule_set,
+    symbol_count,
+    current_symbols_occurrence,
+    symbols_declared_types,
+):
+    total_entropy = rule_set_entropy(rule_set)
+    choosen_attribute = None
+    best_score = None
+    for a in sort_counters_dict(symbol_count):
+        values = current_symbols_occurrence[a][1:]
+        none_rules = rule_set & rule_index["Values"][a].get(None, 0)
+        remaining = 0.0
+        for v in values:
+            remaining += rule_set_entropy(
+                (rule_set & rule_index["Values"][a][v]) | none_rules
+            )
+        symbol_type = symbols_declared_types[a]
+        cost = SYMBOL_EVALUATION_COST[symbol_type]
+        if symbol_type == "Control":
+            domain = len(values) + 1  # Any other control.
+            cost *= (len(values) + 1) / 2.0
+        else:
+            domain = 2
+        remaining += (domain - len(values)) * rule_set_entropy(none_rules)
+        score = (total_entropy - remaining / domain) / cost
+        log_verbose("## Score of '%s' : %f" % (a, score))
+        if best_score is None or score > best_score + 1e-9:
+            best_score = score
+            choosen_attribute = a
+    return choosen_attribute
+
+
+# And now decision tree compression. All those "None" value can be transformed in 'or' statement
+# fallthrough.
+# Post-process the tree built by 'build_decision_tree', in a single post-order pass :
+# - prune the branches without any event,
+# - remove the history,
+# - shorten the None threads : a node only holding the None value is replaced by its child,
+# - flatten the statements.
+# Flattened decision_tree structure will be:
+# [
+#   {
+#    "Attributes" : "name_of_attribute",
+#    "Values" : {
+#        "Val1" : [ { ... another branch ... }, { ... concurrent branch ... } ],
+#        "Val2" : [ { "Event" : "EventName" } ]
+#    }
+#  },
+#  { "Attributes" : "other" ... }
+# ]
+# The statements of a node are its own decision, then the ones of its None branch. Booleans are
+# sorted, True first, then False.
+# Return the flat tree, and the pruned tree with its history if 'keep_history' (debug JSON).
+def compress_decision_tree(decision_tree, symbols_types, keep_history=False):
+    flat = {}
+    history_tree = {}
+    stack = [(decision_tree, False)]
+    while len(stack) > 0:
+        cursor, visited = stack.pop()
+        if not visited and "Values" in cursor:
+            stack.append((cursor, True))
             for v in cursor["Values"]:
-                if "Prune" in cursor["Values"][v]:
-                    to_remove.append(v)
-                else:
-                    prune.put(cursor["Values"][v])
-            for v in to_remove:
-                cursor["Values"].pop(v)
-            if len(cursor["Values"]) == 0:
-                cursor["Prune"] = True
-                # We'll have to reinspect.
-                prune.put(decision_tree)  # Not optimal at all.
-
-    if is_debug:  # Generate the verbose debug JSON
-        with open(
-            "%s/debug/decision_tree_%s.json" % (output_directory, config_name), "w"
-        ) as out_json:
-            file_content = json.dumps(decision_tree, indent=4)
-            out_json.write(file_content)
-            out_json.write("\n")
-            out_json.close()
-
-    # And now decision tree compression. All those "None" value can be transformed in 'or' statement
-    # fallthrough.
-    # First, remove history.
-    log_verbose("### Remove History")
-    branches.put(decision_tree)
-    while not branches.empty():
-        cursor = branches.get()
-        if "History" in cursor:
+                stack.append((cursor["Values"][v], False))
+            continue
+        if "Event" in cursor:
+            if keep_history:
+                history_tree[id(cursor)] = {
+                    "History": cursor["History"],
+                    "Event": cursor["Event"],
+                }
             cursor.pop("History")
-        if "Values" in cursor:
-            for v in cursor["Values"]:
-                branches.put(cursor["Values"][v])
-    # Second, shorten None branching.
-    log_verbose("### Remove 'None' thread")
-    branches.put(decision_tree)
-    while not branches.empty():
-        cursor = branches.get()
-        if "Values" in cursor:
-            log_verbose(
-                "### %s (%d) (%s)"
-                % (
-                    cursor["Values"].keys(),
-                    len(cursor["Values"]),
-                    None in cursor["Values"],
-                )
-            )
-        while (
-            "Values" in cursor
-            and len(cursor["Values"]) == 1
-            and None in cursor["Values"]
-        ):
+            flat[id(cursor)] = [{"Event": cursor["Event"]}]
+            continue
+        if "Values" not in cursor:  # Leaf to prune.
+            continue
+        # Children are done. Prune.
+        for v in list(cursor["Values"].keys()):
+            if "Prune" in cursor["Values"][v]:
+                cursor["Values"].pop(v)
+        if len(cursor["Values"]) == 0:
+            cursor["Prune"] = True
+            continue
+        if keep_history:
+            history_tree[id(cursor)] = {
+                "History": cursor["History"],
+                "Attributes": cursor["Attributes"],
+                "Values": dict(
+                    (v, history_tree[id(cursor["Values"][v])]) for v in cursor["Values"]
+                ),
+            }
+        cursor.pop("History")
+        if len(cursor["Values"]) == 1 and None in cursor["Values"]:
             log_verbose("!! Thread removal")
             # We can get rid of the intermediate.
             next_entry = cursor["Values"][None]
-            log_verbose(next_entry)
             if "Event" in next_entry:
                 cursor.clear()
                 cursor["Event"] = next_entry["Event"]
             else:
                 cursor["Attributes"] = next_entry["Attributes"]
                 cursor["Values"] = next_entry["Values"]
-        if "Values" in cursor:
-            for v in cursor["Values"]:
-                log_verbose("#### Insert node %s" % v)
-                branches.put(cursor["Values"][v])
+            flat[id(cursor)] = flat[id(next_entry)]
+            continue
+        new_decision = {"Attributes": cursor["Attributes"], "Values": {}}
+        for v in cursor["Values"]:
+            if v is not None:
+                new_decision["Values"][v] = flat[id(cursor["Values"][v])]
+        if (
+            symbols_types[cursor["Attributes"]] == bool
+            and len(new_decision["Values"]) == 2
+        ):
+            falseValue = new_decision["Values"].pop(False)
+            new_decision["Values"][False] = falseValue
+        flat[id(cursor)] = [new_decision]
+        if None in cursor["Values"]:
+            flat[id(cursor)] += flat[id(cursor["Values"][None])]
+    if keep_history:
+        return flat[id(decision_tree)], history_tree[id(decision_tree)]
+    return flat[id(decision_tree)], None
+
+
+# Return the nesting depth of the tests and the number of nodes of a compressed tree.
+# The branch of the None value is evaluated after its parent, at the same depth.
+def measure_decision_tree(decision_tree):
+    if "Values" not in decision_tree:
+        return 0, 1
+    depth = 1
+    node_count = 1
+    for v in decision_tree["Values"]:
+        child_depth, child_count = measure_decision_tree(decision_tree["Values"][v])
+        node_count += child_count
+        depth = max(depth, child_depth if v is None else child_depth + 1)
+    return depth, node_count
+
+
+# Write the effects of an event, then trigger it.
+def write_event(
+    out_gd,
+    indent,
+    event_name,
+    total_rules,
+    common_signals,
+    control_id,
+    symbols_types,
+    symbols_declared_types,
+):
+    # Apply effects in any.
+    if "Effects" in total_rules[event_name]:
+        effects = total_rules[event_name]["Effects"]
+        # Launch signal if any.
+        if "Signals" in effects and len(effects["Signals"]) > 0:
+            trigger_signals(
+                indent, effects["Signals"], common_signals, control_id, out_gd
+            )
+        # Launch timers if any.
+        if "Timers" in effects and len(effects["Timers"]) > 0:
+            timer_triggers = effects["Timers"]
+            if "Self" in timer_triggers:
+                self_triggers = timer_triggers["Self"]
+                trigger_timers(out_gd, indent, self_triggers)
+            if "Distribute" in timer_triggers:
+                distribute_triggers = timer_triggers["Distribute"]
+                for grp in distribute_triggers:
+                    write_indent(out_gd, indent, group_others_loop(grp))
+                    trigger_timers(
+                        out_gd,
+                        indent + 1,
+                        distribute_triggers[grp],
+                        "i.",
+                    )
+        if "Self" in effects and len(effects["Self"]) > 0:
+            symbols_to_evaluate = effects["Self"]
+            write_indent(out_gd, indent, "var invoke : bool = false")
+            evaluate_symbols(
+                "\t" * indent,
+                symbols_to_evaluate,
+                "new",
+                out_gd,
+                symbols_types,
+                symbols_declared_types,
+            )
+        if "Distribute" in effects:
+            for target in effects["Distribute"]:
+                symbols_to_evaluate = effects["Distribute"][target]
+                write_indent(out_gd, indent, group_others_loop(target))
+                write_indent(out_gd, indent + 1, "invoke = false")
+                evaluate_symbols(
+                    "\t" * (indent + 1),
+                    symbols_to_evaluate,
+                    "new_dist",
+                    out_gd,
+                    symbols_types,
+                    symbols_declared_types,
+                    True,
+                    "i.",
+                )
+
+    # Trigger event.
+    identifier = "EVENT_%s" % event_name.upper()
+    write_indent(out_gd, indent, "trigger(%s)" % identifier)
+
+
+# Create decision tree
+def create_decision_tree(
+    total_rules,
+    symbols_types,
+    symbols_declared_types,
+    config_name,
+    common_signals,
+    control_id,
+    is_debug,
+    artifacts,
+    out_gd,
+    options,
+):
+    if VERBOSE_MODE:
+        print("## Symbols Types")
+        pprint(symbols_types)
+        print("## Rule set")
+        pprint(total_rules)
+    # rules = dictionary of rules
+    # attributes = all the attributes in the rules with name and types.
+    profile_begin("Build")
+    decision_tree = build_decision_tree(
+        total_rules, symbols_declared_types, options["Strategy"]
+    )
+
+    profile_switch("Compress")
+    flat_tree, history_tree = compress_decision_tree(
+        decision_tree, symbols_types, is_debug
+    )
+    if is_debug:  # Generate the verbose debug JSON
+        file_content = json.dumps(history_tree, indent=4)
+        artifacts["debug/decision_tree_%s.json" % config_name] = file_content + "\n"
+
+    depth, node_count = measure_decision_tree(decision_tree)
+    if options["Strategy"] != "count":
+        profile_switch("Reference")
+        reference_tree = build_decision_tree(
+            total_rules, symbols_declared_types, "count"
+        )
+        compress_decision_tree(reference_tree, symbols_types)
+        print(
+            "## Decision tree with 'count' strategy : depth %d, %d nodes"
+            % measure_decision_tree(reference_tree)
+        )
+    print(
+        "## Decision tree with '%s' strategy : depth %d, %d nodes"
+        % (options["Strategy"], depth, node_count)
+    )
 
+    branches = queue.Queue()
     if is_debug:  # Generate the dot.
-        with open(
-            "%s/debug/decision_tree_%s.dot" % (output_directory, config_name), "w"
-        ) as out_dot:
-            # The decision tree has been cleared.
-            node_id = 0
-            out_dot.write("digraph G {\n")
-            # First pass : Node attribution
-            branches.put(decision_tree)
-            while not branches.empty():
-                cursor = branches.get()
-                if "Attributes" in cursor:
-                    out_dot.write(
-                        '\tnode_%d [ label = "%s", shape = diamond ]\n'
-                        % (node_id, cursor["Attributes"])
-                    )
-                    cursor["Node"] = "node_%d" % node_id
-                    for v in cursor["Values"]:
-                        branches.put(cursor["Values"][v])
-                if "Event" in cursor:
+        profile_switch("Dot")
+        out_dot = io.StringIO()
+        # The decision tree has been cleared.
+        node_id = 0
+        out_dot.write("digraph G {\n")
+        # First pass : Node attribution
+        branches.put(decision_tree)
+        while not branches.empty():
+            cursor = branches.get()
+            if "Attributes" in cursor:
+                out_dot.write(
+                    '\tnode_%d [ label = "%s", shape = diamond ]\n'
+                    % (node_id, cursor["Attributes"])
+                )
+                cursor["Node"] = "node_%d" % node_id
+                for v in cursor["Values"]:
+                    branches.put(cursor["Values"][v])
+            if "Event" in cursor:
+                out_dot.write(
+                    '\tnode_%d [ label = "%s", shape = box ]\n'
+                    % (node_id, cursor["Event"])
+                )
+                cursor["Node"] = "node_%d" % node_id
+            node_id += 1
+        # Second pass : Edge building
+        branches.put(decision_tree)
+        while not branches.empty():
+            cursor = branches.get()
+            if "Attributes" in cursor:
+                for v in cursor["Values"]:
                     out_dot.write(
-                        '\tnode_%d [ label = "%s", shape = box ]\n'
-                        % (node_id, cursor["Event"])
+                        '%s -> %s [ label = "%s"]\n'
+                        % (cursor["Node"], cursor["Values"][v]["Node"], v)
                     )
-                    cursor["Node"] = "node_%d" % node_id
-                node_id += 1
-            # Second pass : Edge building
-            branches.put(decision_tree)
-            while not branches.empty():
-                cursor = branches.get()
-                if "Attributes" in cursor:
-                    for v in cursor["Values"]:
-                        out_dot.write(
-                            '%s -> %s [ label = "%s"]\n'
-                            % (cursor["Node"], cursor["Values"][v]["Node"], v)
-                        )
-                        branches.put(cursor["Values"][v])
-            out_dot.write("}\n")
-            out_dot.close()
-
-    # Transform the decision tree to flatten the statements.
-    # Decision_tree structure will be transformed as follow:
-    # [
-    #   {
-    #    "Attributes" : "name_of_attribute",
-    #    "Values" : {
-    #        "Val1" : [ { ... another branch ... }, { ... concurrent branch ... } ],
-    #        "Val2" : [ { "Event" : "EventName" } ]
-    #    }
-    #  },
-    #  { "Attributes" : "other" ... }
-    # ]
-    flat_tree = []
-    decision_tree["Flat"] = flat_tree
-    branches.put(decision_tree)
-    while not branches.empty():
-        cursor = branches.get()
-        # New node from the old decision tree structure.
-        # First, replicate it.
-        if "Event" in cursor:
-            new_decision = {"Event": cursor["Event"]}
-            cursor["Flat"].append(new_decision)
-        elif "Attributes" in cursor:
-            new_decision = {"Attributes": cursor["Attributes"], "Values": {}}
-            # Time to sort values in case of booleans. True first, then false.
-            for v in cursor["Values"]:
-                if v is None:
-                    none_cursor = cursor["Values"][None]
-                    branches.put(none_cursor)
-                    none_cursor["Flat"] = cursor["Flat"]
-                    continue
-                new_decision["Values"][v] = []
-                cursor["Values"][v]["Flat"] = new_decision["Values"][v]
-                branches.put(cursor["Values"][v])
-            if (
-                symbols_types[cursor["Attributes"]] == bool
-                and len(new_decision["Values"]) == 2
-            ):
-                if VERBOSE_MODE:
-                    print("## Sorting boolean values.")
-                    print("## %s" % new_decision["Values"].keys())
-                falseValue = new_decision["Values"][False]
-                new_decision["Values"].pop(False)
-                new_decision["Values"][False] = falseValue
-            cursor["Flat"].append(new_decision)
-        else:
-            print("!!! Internal error. Such a node should not exists !!!")
+                    branches.put(cursor["Values"][v])
+        out_dot.write("}\n")
+        artifacts["debug/decision_tree_%s.dot" % config_name] = out_dot.getvalue()
+
     if VERBOSE_MODE:
         print("## Flat Tree :")
         pprint(flat_tree)
 
-    with open(
-        "%s/decision_tree_%s.gd" % (output_directory, config_name), "w"
-    ) as out_gd:
-        # Try to generate code
-        # Inside the stack, we'll position a decision tree node and a counter.
-        stack = []
-        stack.append({"Node": flat_tree, "Statement": 0, "Value": 0})
-        while len(stack) > 0:
-            if VERBOSE_MODE:
-                print("## --------------------------")
-                print(produce_readable_stack(stack))
-                print("### -------------------------")
+    # Try to generate code
+    # Inside the stack, we'll position a decision tree node and a counter.
+    profile_switch("Emission")
+    stack = []
+    stack.append({"Node": flat_tree, "Statement": 0, "Value": 0})
+    while len(stack) > 0:
+        if VERBOSE_MODE:
+            print("## --------------------------")
+            print(produce_readable_stack(stack))
+            print("### -------------------------")
+        cursor = stack.pop()
+        node = cursor["Node"]
+        statement_id = cursor["Statement"]
+        value = cursor["Value"]
+        if statement_id == len(node):
+            if len(stack) == 0:
+                log_verbose("## Break because end of main statement list")
+                break
+            log_verbose("## Discard because of end of statements reached")
             cursor = stack.pop()
-            node = cursor["Node"]
-            statement_id = cursor["Statement"]
-            value = cursor["Value"]
-            if statement_id == len(node):
-                if len(stack) == 0:
-                    log_verbose("## Break because end of main statement list")
-                    break
-                log_verbose("## Discard because of end of statements reached")
-                cursor = stack.pop()
-                cursor["Value"] += 1
+            cursor["Value"] += 1
+            stack.append(cursor)
+            continue
+        statement = node[statement_id]
+        if "Event" in statement:
+            write_event(
+                out_gd,
+                len(stack),
+                statement["Event"],
+                total_rules,
+                common_signals,
+                control_id,
+                symbols_types,
+                symbols_declared_types,
+            )
+            cursor = stack.pop()
+            cursor["Value"] += 1
+            stack.append(cursor)
+            # It should be the only statement in the node. Rewind.
+        elif "Attributes" in statement:
+            if value == len(statement["Values"]):
+                cursor["Value"] = 0
+                cursor["Statement"] += 1
                 stack.append(cursor)
+                log_verbose("### Discard because of end of values reached")
                 continue
-            statement = node[statement_id]
-            if "Event" in statement:
-                event_name = statement["Event"]
-                # Apply effects in any.
-                if "Effects" in total_rules[event_name]:
-                    effects = total_rules[event_name]["Effects"]
-                    # Launch signal if any.
-                    if "Signals" in effects and len(effects["Signals"]) > 0:
-                        trigger_signals(
-                            len(stack),
-                            effects["Signals"],
-                            common_signals,
-                            control_id,
-                            out_gd,
-                        )
-                    # Launch timers if any.
-                    if "Timers" in effects and len(effects["Timers"]) > 0:
-                        timer_triggers = effects["Timers"]
-                        if "Self" in timer_triggers:
-                            self_triggers = timer_triggers["Self"]
-                            trigger_timers(out_gd, len(stack), self_triggers)
-                        if "Distribute" in timer_triggers:
-                            distribute_triggers = timer_triggers["Distribute"]
-                            for grp in distribute_triggers:
-                                group_name = grp.lower()
-                                write_indent(
-                                    out_gd,
-                                    len(stack),
-                                    'for i in get_tree().get_nodes_in_group("%s"):'
-                                    % grp,
-                                )
-                                write_indent(
-                                    out_gd,
-                                    len(stack) + 1,
-                                    "if i == controlled_node_%s:" % group_name,
-                                )
-                                write_indent(out_gd, len(stack) + 2, "continue")
-                                trigger_timers(
-                                    out_gd,
-                                    len(stack) + 1,
-                                    distribute_triggers[grp],
-                                    "i.",
-                                )
-                    if "Self" in effects and len(effects["Self"]) > 0:
-                        symbols_to_evaluate = effects["Self"]
-                        write_indent(out_gd, len(stack), "var invoke : bool = false")
-                        evaluate_symbols(
-                            "\t" * len(stack),
-                            symbols_to_evaluate,
-                            "new",
-                            out_gd,
-                            symbols_types,
-                            symbols_declared_types,
-                        )
-                    if "Distribute" in effects:
-                        for target in effects["Distribute"]:
-                            symbols_to_evaluate = effects["Distribute"][target]
-                            write_indent(
-                                out_gd,
-                                len(stack),
-                                'for i in get_tree().get_nodes_in_group("%s"):'
-                                % target,
-                            )
-                            write_indent(
-                                out_gd,
-                                len(stack) + 1,
-                                "if i == controlled_node_%s:" % (target.lower()),
-                            )
-                            write_indent(out_gd, len(stack) + 2, "continue")
-                            write_indent(out_gd, len(stack) + 1, "invoke = false")
-                            evaluate_symbols(
-                                "\t" * (len(stack) + 1),
-                                symbols_to_evaluate,
-                                "new_dist",
-                                out_gd,
-                                symbols_types,
-                                symbols_declared_types,
-                                True,
-                                "i.",
-                            )
-
-                # Trigger event.
-                identifier = "EVENT_%s" % event_name.upper()
-                write_indent(out_gd, len(stack), "trigger(%s)" % identifier)
-                cursor = stack.pop()
-                cursor["Value"] += 1
-                stack.append(cursor)
-                # It should be the only statement in the node. Rewind.
-            elif "Attributes" in statement:
-                if value == len(statement["Values"]):
-                    cursor["Value"] = 0
-                    cursor["Statement"] += 1
-                    stack.append(cursor)
-                    log_verbose("### Discard because of end of values reached")
-                    continue
-                if value == 0:
-                    # So, we begin with a new attributes.
-                    if (
-                        symbols_declared_types[statement["Attributes"]] == "bool"
-                    ):  # Boolean
-                        negate = "!" if not list(statement["Values"].keys())[0] else ""
-                        write_indent(
-                            out_gd,
-                            len(stack),
-                            "if %s%s_v:" % (negate, statement["Attributes"]),
-                        )
-                    elif symbols_declared_types[statement["Attributes"]] == "Timer":
-                        negate = "!" if not list(statement["Values"].keys())[0] else ""
-                        write_indent(
-                            out_gd,
-                            len(stack),
-                            "if %s%s():" % (negate, statement["Attributes"]),
-                        )
-                    else:
-                        value_name = list(statement["Values"].keys())[value]
-                        write_indent(
-                            out_gd,
-                            len(stack),
-                            "if %s_v == %s:" % (statement["Attributes"], value_name),
-                        )
+            if value == 0:
+                # So, we begin with a new attributes.
+                if symbols_declared_types[statement["Attributes"]] == "bool":  # Boolean
+                    negate = "!" if not list(statement["Values"].keys())[0] else ""
+                    write_indent(
+                        out_gd,
+                        len(stack),
+                        "if %s%s_v:" % (negate, statement["Attributes"]),
+                    )
+                elif symbols_declared_types[statement["Attributes"]] == "Timer":
+                    negate = "!" if not list(statement["Values"].keys())[0] else ""
+                    write_indent(
+                        out_gd,
+                        len(stack),
+                        "if %s%s():" % (negate, statement["Attributes"]),
+                    )
                 else:
-                    if symbols_types[statement["Attributes"]] == bool:  # Boolean
-                        write_indent(out_gd, len(stack), "else:")
-                    else:
-                        value_name = list(statement["Values"].keys())[value]
-                        # It can't be anything else that a control.
-                        write_indent(
-                            out_gd,
-                            len(stack),
-                            "elif %s_v == %s:" % (statement["Attributes"], value_name),
-                        )
-                # We reinject the cursor as-is. It will be modified when going up.
-                stack.append(cursor)
-                # Don't forget to append the next statement/value
-                next_statement = {
-                    "Node": statement["Values"][
-                        list(statement["Values"].keys())[value]
-                    ],
-                    "Statement": 0,
-                    "Value": 0,
-                }
-                stack.append(next_statement)
-
-        out_gd.close()
+                    value_name = list(statement["Values"].keys())[value]
+                    write_indent(
+                        out_gd,
+                        len(stack),
+                        "if %s_v == %s:" % (statement["Attributes"], value_name),
+                    )
+            else:
+                if symbols_types[statement["Attributes"]] == bool:  # Boolean
+                    write_indent(out_gd, len(stack), "else:")
+                else:
+                    value_name = list(statement["Values"].keys())[value]
+                    # It can't be anything else that a control.
+                    write_indent(
+                        out_gd,
+                        len(stack),
+                        "elif %s_v == %s:" % (statement["Attributes"], value_name),
+                    )
+            # We reinject the cursor as-is. It will be modified when going up.
+            stack.append(cursor)
+            # Don't forget to append the next statement/value
+            next_statement = {
+                "Node": statement["Values"][list(statement["Values"].keys())[value]],
+                "Statement": 0,
+                "Value": 0,
+            }
+            stack.append(next_statement)
+    profile_end()
 
     return decision_tree
 
 
-def generate_save_load(
-    file_write,
-    input_symbols
-):
-    timers = []
-    variables = []
-    for s in input_symbols:
-        if s["Type"] == "Timer":
-            timers.append(s["Name"])
+# Decision diagram engine.
+# The events are compiled into a reduced ordered multi-valued decision diagram. Each node tests
+# a symbol and has a child per value of the symbol, terminals hold the events to trigger.
+# Identical sub-diagrams are built once (unique table) and a node whose children are all the
+# same is skipped. Control symbols get a child per value used in the conditions, plus one for
+# any other value.
+# As several events can be triggered at once, the events are split in clusters of mutually
+# exclusive events. Each cluster has its own root, all of them sharing the same nodes, and the
+# clusters are evaluated one after the other.
+# {
+#    "Order" : [ "symbol tested first", ... ],
+#    "Nodes" : [ (level, (child id per value)) or (None, bitset of the rules) ],
+#    "Roots" : [ root node id per cluster ]
+# }
+OTHER_VALUE = "_"
+
+
+# Return the values tested for each symbol used in the conditions.
+def decision_diagram_domains(rule_index, symbols_declared_types):
+    domains = {}
+    for a in rule_index["NonNone"]:
+        if rule_index["NonNone"][a] == 0:
+            continue
+        if symbols_declared_types[a] == "Control":
+            values = [v for v in rule_index["Values"][a] if v is not None]
+            domains[a] = values + [OTHER_VALUE]
         else:
-            variables.append(s["Name"])
+            domains[a] = [True, False]
+    return domains
+
+
+# Split the rules in clusters of mutually exclusive rules, in declaration order : a rule joins
+# the first cluster where it has a conflicting condition with every rule. With 'same_support',
+# the rules of a cluster must also constrain the same symbols : the cluster can't share nodes
+# but don't blow up when the rules don't have much in common.
+def decision_diagram_clusters(total_rules, same_support):
+    rules = list(total_rules.keys())
+    clusters = []
+    for r in range(len(rules)):
+        conditions = total_rules[rules[r]]["Conditions"]
+        for cluster in clusters:
+            exclusive = True
+            for other in cluster:
+                other_conditions = total_rules[rules[other]]["Conditions"]
+                if same_support and [
+                    a for a in conditions if conditions[a] is not None
+                ] != [a for a in other_conditions if other_conditions[a] is not None]:
+                    exclusive = False
+                    break
+                conflict = False
+                for a in conditions:
+                    if (
+                        conditions[a] is not None
+                        and other_conditions[a] is not None
+                        and conditions[a] != other_conditions[a]
+                    ):
+                        conflict = True
+                        break
+                if not conflict:
+                    exclusive = False
+                    break
+            if exclusive:
+                cluster.append(r)
+                break
+        else:
+            clusters.append([r])
+    return [sum([1 << r for r in cluster]) for cluster in clusters]
+
+
+def build_decision_diagram(rule_index, domains, order, clusters):
+    nodes = []
+    unique = {}
+    computed = {}
+    # Rules compatible with each value of the symbols, in order.
+    compatible = []
+    for a in order:
+        none_rules = rule_index["Values"][a].get(None, 0)
+        value_rules = []
+        for v in domains[a]:
+            if v == OTHER_VALUE:
+                value_rules.append(none_rules)
+            else:
+                value_rules.append(none_rules | rule_index["Values"][a].get(v, 0))
+        compatible.append(value_rules)
+    # Rules still constrained from each level.
+    constrained = [0] * (len(order) + 1)
+    for level in range(len(order) - 1, -1, -1):
+        constrained[level] = (
+            constrained[level + 1] | rule_index["NonNone"][order[level]]
+        )
 
-    # Save State
-    file_write.write("func save_state() -> Dictionary:\n")
-    file_write.write("\tvar timers : Dictionary = {}\n")
-    for t in timers:
-        file_write.write('\ttimers["%s"] = timer_expire[%s_TIMER]\n' % ( t, t.upper() ))
-    file_write.write("\tvar variables : Dictionary = {}\n")
-    for v in variables:
-        file_write.write('\tvariables["%s"] = %s_v\n' % ( v, v ))
-    file_write.write("\tvar saved_status : Dictionary = {}\n")
-    file_write.write('\tsaved_status["timers"] = timers\n\tsaved_status["variables"] = variables\n\treturn saved_status\n\n')
+    def make_node(node):
+        if node not in unique:
+            unique[node] = len(nodes)
+            nodes.append(node)
+        return unique[node]
+
+    def build(level, rule_set):
+        key = (level, rule_set)
+        if key in computed:
+            return computed[key]
+        if rule_set & constrained[level] == 0:
+            result = make_node((None, rule_set))
+        elif rule_set & rule_index["NonNone"][order[level]] == 0:
+            result = build(level + 1, rule_set)  # Symbol not tested.
+        else:
+            children = tuple(build(level + 1, rule_set & c) for c in compatible[level])
+            if len(set(children)) == 1:
+                result = children[0]
+            else:
+                result = make_node((level, children))
+        computed[key] = result
+        return result
+
+    roots = [build(0, cluster) for cluster in clusters]
+    return {"Order": list(order), "Nodes": nodes, "Roots": roots}
+
+
+# Size of a diagram : number of decision nodes, then number of distinct edges.
+def decision_diagram_size(diagram):
+    node_count = 0
+    edge_count = 0
+    for level, children in diagram["Nodes"]:
+        if level is not None:
+            node_count += 1
+            edge_count += len(set(children))
+    return node_count, edge_count
+
+
+# Variable reordering by sifting : each symbol, most constrained first, is moved to every
+# position and kept at the one giving the smallest diagram. The diagram is rebuilt for each
+# trial, the rule sets being small enough.
+def sift_decision_diagram(rule_index, domains, clusters):
+    symbol_count = {}
+    for a in domains:
+        symbol_count[a] = popcount(rule_index["NonNone"][a])
+    order = list(sort_counters_dict(symbol_count).keys())
+    best = build_decision_diagram(rule_index, domains, order, clusters)
+    best_size = decision_diagram_size(best)
+    for a in list(order):
+        others = list(best["Order"])
+        others.remove(a)
+        for position in range(len(others) + 1):
+            candidate_order = others[:position] + [a] + others[position:]
+            if candidate_order == best["Order"]:
+                continue
+            candidate = build_decision_diagram(
+                rule_index, domains, candidate_order, clusters
+            )
+            candidate_size = decision_diagram_size(candidate)
+            if candidate_size < best_size:
+                log_verbose(
+                    "## Sifting '%s' to position %d : %d nodes"
+                    % (a, position, candidate_size[0])
+                )
+                best = candidate
+                best_size = candidate_size
+    return best
+
+
+# Return the node edges as (child, [values]), in order of values, merging the values leading to
+# the same child. For Control symbols, the values leading to the same child as any other value
+# are left to the 'else' branch.
+def decision_diagram_branches(diagram, domains, node_id):
+    level, children = diagram["Nodes"][node_id]
+    values = domains[diagram["Order"][level]]
+    branches = []
+    for i in range(len(values)):
+        if values[i] != OTHER_VALUE and values[-1] == OTHER_VALUE:
+            if children[i] == children[-1]:
+                continue
+        for b in branches:
+            if b[0] == children[i]:
+                b[1].append(values[i])
+                break
+        else:
+            branches.append((children[i], [values[i]]))
+    return branches
 
-    # Load State
-    file_write.write("func load_state(dict_state : Dictionary) -> void:\n")
-    file_write.write('\tif not(dict_state.has("timers") and dict_state.has("variables")):\n')
-    file_write.write('\t\tprint("Invalid status store ! Should never happen. Contact devs.")\n')
-    file_write.write('\t\tprint_debug()\n\t\tprint_stack()\n')
-    file_write.write('\t\tget_tree().quit(-13)\n')
-    file_write.write('\tvar timers_d : Dictionary = dict_state["timers"] as Dictionary\n')
-    file_write.write('\tvar variables_d : Dictionary = dict_state["variables"] as Dictionary\n')
-    for t in timers:
-        file_write.write('\ttimer_expire[%s_TIMER] = timers_d["%s"]\n' % ( t.upper(), t ))
-    for v in variables:
-        file_write.write('\t%s_v = variables_d["%s"]\n' % ( v, v ))
-    file_write.write("\n")
 
-def generate_specific(
-    config_filepath,
-    controls,
-    common_symbols,
+# Render the diagram to GDScript. Sub-diagrams shared by several nodes are rendered as helper
+# functions when they are longer than their call. Return the body of 'invoke_decision_tree' and
+# the helpers, as lists of lines without base indentation.
+def render_decision_diagram(
+    diagram,
+    domains,
+    total_rules,
     common_signals,
-    common_groups,
-    common_defaults,
-    common_variables,
-    generate_debug,
-    output_directory,
+    control_id,
+    symbols_types,
+    symbols_declared_types,
 ):
-    control_id = {}
+    nodes = diagram["Nodes"]
+    rules = list(total_rules.keys())
+    references = [0] * len(nodes)
+    for node_id in range(len(nodes)):
+        if nodes[node_id][0] is not None:
+            for child, _ in decision_diagram_branches(diagram, domains, node_id):
+                references[child] += 1
+    rendered = {}
+    helpers = []
+
+    def render(node_id):
+        if node_id in rendered:
+            return rendered[node_id]
+        level, children = nodes[node_id]
+        lines = []
+        if level is None:
+            for r in bitset_rules(children):
+                event_code = io.StringIO()
+                write_event(
+                    event_code,
+                    0,
+                    rules[r],
+                    total_rules,
+                    common_signals,
+                    control_id,
+                    symbols_types,
+                    symbols_declared_types,
+                )
+                lines += event_code.getvalue().splitlines()
+        else:
+            attribute = diagram["Order"][level]
+            if symbols_declared_types[attribute] == "Timer":
+                symbol = "%s()" % attribute
+            else:
+                symbol = "%s_v" % attribute
+            branches = decision_diagram_branches(diagram, domains, node_id)
+            keyword = "if"
+            for child, values in branches:
+                child_lines = render(child)
+                if len(child_lines) == 0:
+                    continue
+                if symbols_declared_types[attribute] != "Control":
+                    if keyword == "elif":
+                        lines.append("else:")
+                    else:
+                        negate = "" if values[0] else "!"
+                        lines.append("if %s%s:" % (negate, symbol))
+                elif values != [OTHER_VALUE]:
+                    tests = ["%s == %s" % (symbol, v) for v in values]
+                    lines.append("%s %s:" % (keyword, " || ".join(tests)))
+                elif keyword == "elif":
+                    lines.append("else:")
+                else:
+                    # Only the other values lead to events.
+                    tests = [
+                        "%s != %s" % (symbol, v)
+                        for (_, tested) in branches
+                        for v in tested
+                        if v != OTHER_VALUE
+                    ]
+                    lines.append("if %s:" % " && ".join(tests))
+                lines += ["\t" + line for line in child_lines]
+                keyword = "elif"
+        if references[node_id] > 1 and len(lines) > 1:
+            name = "_decision_node_%d" % len(helpers)
+            helpers.append(("func %s() -> void:" % name, lines))
+            lines = ["%s()" % name]
+        rendered[node_id] = lines
+        return lines
+
+    body = []
+    for root in diagram["Roots"]:
+        body += render(root)
+    if len(body) == 0:
+        body = ["pass"]
+    helper_lines = []
+    for header, lines in helpers:
+        helper_lines.append(header)
+        helper_lines += ["\t" + line for line in lines]
+        helper_lines.append("")
+    return body, helper_lines
+
+
+# Create decision diagram. Same purpose as 'create_decision_tree' : the body of
+# 'invoke_decision_tree' is written in 'out_gd', the helper functions in 'out_helpers'.
+def create_decision_diagram(
+    total_rules,
+    symbols_types,
+    symbols_declared_types,
+    config_name,
+    common_signals,
+    control_id,
+    is_debug,
+    artifacts,
+    out_gd,
+    out_helpers,
+):
+    rule_index = build_rule_index(total_rules)
+    domains = decision_diagram_domains(rule_index, symbols_declared_types)
+    # Keep the smallest of both clusterings.
+    diagram = None
+    for same_support in [False, True]:
+        clusters = decision_diagram_clusters(total_rules, same_support)
+        candidate = sift_decision_diagram(rule_index, domains, clusters)
+        candidate_size = decision_diagram_size(candidate)
+        if diagram is None or candidate_size < decision_diagram_size(diagram):
+            diagram = candidate
+    body, helpers = render_decision_diagram(
+        diagram,
+        domains,
+        total_rules,
+        common_signals,
+        control_id,
+        symbols_types,
+        symbols_declared_types,
+    )
+    print(
+        "## Decision diagram : %d clusters, %d nodes, %d helpers, order %s"
+        % (
+            len(diagram["Roots"]),
+            decision_diagram_size(diagram)[0],
+            len([line for line in helpers if line.startswith("func ")]),
+            diagram["Order"],
+        )
+    )
+
+    rules = rule_index["Rules"]
+    if is_debug:  # Generate the debug JSON and the dot.
+        nodes = diagram["Nodes"]
+        description = []
+        for level, children in nodes:
+            if level is None:
+                description.append(
+                    {"Events": [rules[r] for r in bitset_rules(children)]}
+                )
+            else:
+                attribute = diagram["Order"][level]
+                description.append(
+                    {
+                        "Attributes": attribute,
+                        "Values": dict(
+                            (str(domains[attribute][i]), children[i])
+                            for i in range(len(children))
+                        ),
+                    }
+                )
+        file_content = json.dumps(
+            {
+                "Order": diagram["Order"],
+                "Roots": diagram["Roots"],
+                "Nodes": description,
+            },
+            indent=4,
+        )
+        artifacts["debug/decision_tree_%s.json" % config_name] = file_content + "\n"
+        out_dot = io.StringIO()
+        out_dot.write("digraph G {\n")
+        for node_id in range(len(nodes)):
+            level, children = nodes[node_id]
+            if level is None:
+                label = "\\n".join([rules[r] for r in bitset_rules(children)])
+                out_dot.write(
+                    '\tnode_%d [ label = "%s", shape = box ]\n' % (node_id, label)
+                )
+            else:
+                out_dot.write(
+                    '\tnode_%d [ label = "%s", shape = diamond ]\n'
+                    % (node_id, diagram["Order"][level])
+                )
+        for node_id in range(len(nodes)):
+            if nodes[node_id][0] is None:
+                continue
+            for child, values in decision_diagram_branches(diagram, domains, node_id):
+                out_dot.write(
+                    'node_%d -> node_%d [ label = "%s"]\n'
+                    % (node_id, child, ", ".join([str(v) for v in values]))
+                )
+        out_dot.write("}\n")
+        artifacts["debug/decision_tree_%s.dot" % config_name] = out_dot.getvalue()
+
+    for line in body:
+        out_gd.write("%s\n" % line)
+    for line in helpers:
+        out_helpers.write("%s\n" % line)
+
+    # Events reachable in the diagram.
+    diagram["Events"] = []
+    for level, children in diagram["Nodes"]:
+        if level is None:
+            for r in bitset_rules(children):
+                if rules[r] not in diagram["Events"]:
+                    diagram["Events"].append(rules[r])
+    return diagram
+
+
+# Lookup table engine.
+# The symbols of the conditions are packed in a word, in mixed radix : booleans and timers are
+# a digit of radix 2, controls hold their identifier (0 to the number of controls). The word
+# indexes a constant table of event combinations, and each combination is a branch of a match.
+# Tables larger than TABLE_SIZE_LIMIT entries are not generated.
+TABLE_SIZE_LIMIT = 4096
+
+
+# Create decision table. Same purpose as 'create_decision_tree' : the body of
+# 'invoke_decision_tree' is written in 'out_gd', the helper functions and the table in
+# 'out_helpers'. Return None if the table is too large.
+def create_decision_table(
+    total_rules,
+    symbols_types,
+    symbols_declared_types,
+    config_name,
+    common_signals,
+    control_id,
+    is_debug,
+    artifacts,
+    out_gd,
+    out_helpers,
+):
+    rule_index = build_rule_index(total_rules)
+    rules = rule_index["Rules"]
+    symbols = [a for a in rule_index["NonNone"] if rule_index["NonNone"][a] != 0]
+    # Rules compatible with each digit of the symbols.
+    digits = []
+    table_size = 1
+    for a in symbols:
+        none_rules = rule_index["Values"][a].get(None, 0)
+        if symbols_declared_types[a] == "Control":
+            values = range(len(control_id) + 1)
+        else:
+            values = [False, True]
+        digits.append([none_rules | rule_index["Values"][a].get(v, 0) for v in values])
+        table_size *= len(values)
+    if table_size > TABLE_SIZE_LIMIT:
+        print(
+            "## Decision table would hold %d entries (limit %d). Use the decision tree."
+            % (table_size, TABLE_SIZE_LIMIT)
+        )
+        return None
+
+    # Matching rules per word. The first symbol is the lowest digit.
+    matches = [(1 << len(rules)) - 1]
+    for compatible in reversed(digits):
+        matches = [m & c for m in matches for c in compatible]
+    combinations = [0]
+    combination_id = {0: 0}
+    table = []
+    for m in matches:
+        if m not in combination_id:
+            combination_id[m] = len(combinations)
+            combinations.append(m)
+        table.append(combination_id[m])
+    # Events found in several combinations are helper functions, unless a single line.
+    event_code = {}
+    helpers = []
+    for r in range(len(rules)):
+        occurrences = len([c for c in combinations if (c >> r) & 1])
+        code = io.StringIO()
+        write_event(
+            code,
+            0,
+            rules[r],
+            total_rules,
+            common_signals,
+            control_id,
+            symbols_types,
+            symbols_declared_types,
+        )
+        event_code[r] = code.getvalue().splitlines()
+        if occurrences > 1 and len(event_code[r]) > 1:
+            name = "_decision_event_%s" % rules[r].lower()
+            helpers.append(("func %s() -> void:" % name, event_code[r]))
+            event_code[r] = ["%s()" % name]
+    print(
+        "## Decision table : %d entries, %d event combinations, %d helpers"
+        % (len(table), len(combinations) - 1, len(helpers))
+    )
+
+    if is_debug:  # Generate the debug JSON.
+        description = {
+            "Symbols": symbols,
+            "Combinations": [[rules[r] for r in bitset_rules(c)] for c in combinations],
+            "Table": table,
+        }
+        file_content = json.dumps(description, indent=4)
+        artifacts["debug/decision_tree_%s.json" % config_name] = file_content + "\n"
+        out_dot = io.StringIO()
+        # The packed word, linked to each combination with its number of entries.
+        out_dot.write("digraph G {\n")
+        out_dot.write('\tword [ label = "%s", shape = record ]\n' % " | ".join(symbols))
+        for c in range(1, len(combinations)):
+            label = "\\n".join([rules[r] for r in bitset_rules(combinations[c])])
+            out_dot.write(
+                '\tcombination_%d [ label = "%s", shape = box ]\n' % (c, label)
+            )
+            out_dot.write(
+                'word -> combination_%d [ label = "%d"]\n' % (c, table.count(c))
+            )
+        out_dot.write("}\n")
+        artifacts["debug/decision_tree_%s.dot" % config_name] = out_dot.getvalue()
+
+    terms = []
+    stride = 1
+    for i in range(len(symbols)):
+        a = symbols[i]
+        if symbols_declared_types[a] == "Timer":
+            digit = "int(%s())" % a
+        elif symbols_declared_types[a] == "bool":
+            digit = "int(%s_v)" % a
+        else:
+            digit = "%s_v" % a
+        terms.append(digit if stride == 1 else "%d * %s" % (stride, digit))
+        stride *= len(digits[i])
+    write_indent(out_gd, 0, "var word : int = %s" % " + ".join(terms))
+    write_indent(out_gd, 0, "match DECISION_TABLE[word]:")
+    for c in range(1, len(combinations)):
+        write_indent(out_gd, 1, "%d:" % c)
+        for r in bitset_rules(combinations[c]):
+            for line in event_code[r]:
+                write_indent(out_gd, 2, line)
+    for header, lines in helpers:
+        out_helpers.write("%s\n" % header)
+        for line in lines:
+            write_indent(out_helpers, 1, line)
+        out_helpers.write("\n")
+    out_helpers.write(
+        "const DECISION_TABLE : Array = [ %s ]\n" % ", ".join([str(t) for t in table])
+    )
+
+    # Events reachable in the table.
+    reachable = 0
+    for c in combinations:
+        reachable |= c
+    return {"Events": [rules[r] for r in bitset_rules(reachable)]}
+
+
+# State expansion engine.
+# A state is identified by the pressed controls, in naming order (ordered controls first, in
+# activation order, then the others in declaration order), and by its node in the sequence
+# tree. Both are kept as integers : control indices, a pressed bitmask and a node identifier.
+# States are identified by integers down to the artifacts, names are only produced by
+# 'state_name_table', for the debug outputs and the "Name" entries of the pre-computed graph.
+EFFECT_NONE = 0
+EFFECT_FIRE = 1  # The control completes a sequence.
+# The control makes a sequence progress. The sequence timer is reset.
+EFFECT_PROGRESS = 2
+# The control press is ignored : the pressed controls would break a reachability constraint.
+EFFECT_BLOCKED = 3
+
+TIMEOUT_TRANSITION = -1
+
+
+# Index the sequence tree nodes in breadth first order. The root is the node 0.
+# Return the children (control index -> node) of each node, the sequence description of the
+# terminal nodes (None for the others), the freeze flag and the control path of each node.
+def index_sequence_tree(sequences_tree, controls):
+    control_index = dict((controls[i], i) for i in range(len(controls)))
+    children = []
+    terminal = []
+    freeze = []
+    progress = []
+    nodes = collections.deque([(sequences_tree, [])])
+    while nodes:
+        node, path = nodes.popleft()
+        node_children = {}
+        children.append(node_children)
+        terminal.append(node if "Name" in node else None)
+        freeze.append(node.get("Freeze", False))
+        progress.append(path)
+        for key in node:
+            if key in control_index and isinstance(node[key], dict):
+                node_children[control_index[key]] = len(progress) + len(nodes)
+                nodes.append((node[key], path + [key]))
+    return children, terminal, freeze, progress
+
+
+# Breadth first expansion of the control states, from "Idle".
+# Each control toggle of each state leads to a state. Only the first transition towards a
+# given target is kept, the sequence timeout one included.
+# The reachability constraints prune the expansion : at most 'max_pressed' controls are pressed
+# at once (no limit if None), and at most one of each 'exclusive' set of controls. A press that
+# breaks them is a blocked transition, towards the state itself.
+# Return the expansion description : per state order, node and transitions, where a
+# transition is (control index or TIMEOUT_TRANSITION, pressed, target, effect, tree node).
+def expand_states(
+    controls, order_matters, sequences_tree, max_pressed=None, exclusive=[]
+):
+    control_count = len(controls)
+    ordered_mask = 0
+    for c in order_matters:
+        if c in controls:
+            ordered_mask |= 1 << controls.index(c)
+    exclusive_masks = []
+    for exclusive_set in exclusive:
+        exclusive_mask = 0
+        for c in exclusive_set:
+            exclusive_mask |= 1 << controls.index(c)
+        exclusive_masks.append(exclusive_mask)
+    children, terminal, freeze, progress = index_sequence_tree(sequences_tree, controls)
+    node_count = len(children)
+    radix = control_count + 1
+
+    state_order = []
+    state_mask = []
+    state_node = []
+    state_transitions = []
+    known_states = {}
+
+    def discover(order, mask, node):
+        code = 0
+        for k in order:
+            code = code * radix + k + 1
+        key = code * node_count + node
+        state_id = known_states.get(key)
+        if state_id is None:
+            state_id = len(state_order)
+            known_states[key] = state_id
+            state_order.append(order)
+            state_mask.append(mask)
+            state_node.append(node)
+            state_transitions.append([])
+            frontier.append(state_id)
+        return state_id
+
+    frontier = collections.deque()
+    discover((), 0, 0)  # "Idle"
+    while frontier:
+        current = frontier.popleft()
+        order = state_order[current]
+        mask = state_mask[current]
+        node = state_node[current]
+        transitions = state_transitions[current]
+        targets = set()
+
+        # Timeout management : go to the same controls without any sequence.
+        if node != 0:
+            target = discover(order, mask, 0)
+            transitions.append((TIMEOUT_TRANSITION, False, target, EFFECT_NONE, 0))
+            targets.add(target)
+
+        # We can change only one control at a time
+        for c in range(control_count):
+            new_mask = mask ^ (1 << c)
+            pressed = (new_mask >> c) & 1 == 1
+            if pressed and (
+                (max_pressed is not None and popcount(new_mask) > max_pressed)
+                or any([popcount(new_mask & e) > 1 for e in exclusive_masks])
+            ):
+                transitions.append((c, True, current, EFFECT_BLOCKED, 0))
+                continue
+            effect = EFFECT_NONE
+            effect_node = 0
+            new_node = node
+            if pressed:
+                effect_node = children[node].get(c)
+                if effect_node is None:
+                    effect_node = 0
+                    new_node = 0
+                elif terminal[effect_node] is not None:
+                    effect = EFFECT_FIRE
+                    new_node = 0
+                else:
+                    effect = EFFECT_PROGRESS
+                    new_node = effect_node
+            # Ordered controls kept pressed stay first, then the others in declaration order.
+            prefix = [k for k in order if (ordered_mask & new_mask) >> k & 1]
+            prefix_mask = 0
+            for k in prefix:
+                prefix_mask |= 1 << k
+            remaining = new_mask & ~prefix_mask
+            while remaining:
+                low = remaining & -remaining
+                prefix.append(low.bit_length() - 1)
+                remaining ^= low
+            target = discover(tuple(prefix), new_mask, new_node)
+            if target not in targets:
+                targets.add(target)
+                transitions.append((c, pressed, target, effect, effect_node))
+
+    return {
+        "Order": state_order,
+        "Node": state_node,
+        "Transitions": state_transitions,
+        "Terminal": terminal,
+        "Freeze": freeze,
+        "Progress": progress,
+    }
+
+
+def expansion_state_name(controls, expansion, state_id):
+    name = "_".join([controls[k] for k in expansion["Order"][state_id]])
+    if name == "":
+        name = "Idle"
+    node = expansion["Node"][state_id]
+    if node != 0:
+        name = "%s#%s" % (name, "-".join(expansion["Progress"][node]))
+    return name
+
+
+# Build the states description from the expansion : the transitions of each state, in state
+# identifier order. Targets are state identifiers.
+def describe_states(controls, expansion):
+    states = []
+    for i in range(len(expansion["Order"])):
+        triggers = []
+        for c, pressed, target, effect, effect_node in expansion["Transitions"][i]:
+            if c == TIMEOUT_TRANSITION:
+                triggers.append({"Timeout": "SequenceTimer", "Target": target})
+                continue
+            trigger = {"Control": controls[c], "Pressed": pressed}
+            if effect == EFFECT_FIRE:
+                seq_finish = expansion["Terminal"][effect_node]
+                trigger["Fire"] = seq_finish["Name"]
+                trigger["Cooldown"] = seq_finish["Cooldown"]
+                trigger["Duration"] = seq_finish["Duration"]
+                if "Infer" in seq_finish:
+                    trigger["Infer"] = seq_finish["Infer"]
+                trigger["Freeze"] = True
+            elif effect == EFFECT_PROGRESS:
+                trigger["Timer"] = "SequenceTimer"
+                trigger["Freeze"] = expansion["Freeze"][effect_node]
+            elif effect == EFFECT_BLOCKED:
+                trigger["Blocked"] = True
+            trigger["Target"] = target
+            triggers.append(trigger)
+        states.append({"Transitions": triggers})
+        if VERBOSE_MODE:
+            print(
+                "- State '%s' : %s"
+                % (expansion_state_name(controls, expansion, i), triggers)
+            )
+    return states
+
+
+# Name of each state of the groups, in state identifier order : the states of each group are
+# stored one after the other. The names of the states of a named group are prefixed with it
+# ("Move:LEFT"). Each group holds its expansion and the expansion identifier of its states
+# ("Expansion" and "Origin").
+def state_name_table(groups):
+    names = []
+    for group in groups:
+        for state_id in group["Origin"]:
+            name = expansion_state_name(group["Controls"], group["Expansion"], state_id)
+            if group["Name"] is not None:
+                name = "%s:%s" % (group["Name"], name)
+            names.append(name)
+    return names
+
+
+# Sequence matcher
+# With the '--sequence-matcher' option, the sequences are not part of the control states : the
+# sequence tree is shipped as an automaton that 'BaseCharacterController' runs beside the
+# pressed-state machine, which then only tracks the pressed controls.
+# Each node has a failure link towards the node of its longest proper suffix (Aho-Corasick), so
+# that a control breaking a sequence can still start or continue another one. The nodes are in
+# breadth first order, the root being the node 0 : a failure link targets an earlier node.
+# Return the nodes : edges (control identifier, node), failure link, fired sequence identifier
+# and freeze flag.
+def create_sequence_matcher(sequences_tree, controls, sequences_id):
+    children, terminal, freeze, _ = index_sequence_tree(sequences_tree, controls)
+    fail = [0] * len(children)
+    for n in range(len(children)):
+        for c, child in children[n].items():
+            if n == 0:
+                continue
+            f = fail[n]
+            while f != 0 and c not in children[f]:
+                f = fail[f]
+            fail[child] = children[f].get(c, 0)
+    nodes = []
+    for n in range(len(children)):
+        node = {
+            "Edges": [[c + 1, children[n][c]] for c in sorted(children[n])],
+            "Fail": fail[n],
+        }
+        if terminal[n] is not None:
+            node["Fire"] = sequences_id[terminal[n]["Name"]]
+        if freeze[n]:
+            node["Freeze"] = True
+        nodes.append(node)
+    return nodes
+
+
+# Transition behaviour, the target aside, as seen by 'BaseCharacterController'.
+def transition_signature(trigger):
+    if trigger is None:
+        return None
+    return (
+        trigger.get("Pressed"),
+        trigger.get("Fire"),
+        trigger.get("Freeze", False),
+        "Timer" in trigger,
+        trigger.get("Blocked", False),
+    )
+
+
+# Merge the states that behave the same (Hopcroft partition refinement).
+# Two states are equivalent when, for every control and for the sequence timeout, they have the
+# same transition behaviour (fire, freeze, timer reset) towards equivalent states.
+# The first state of each class (in identifier order) is kept. Return the reduced states,
+# renumbered, and the former identifier of each of them.
+def minimize_states(states, controls):
+    state_count = len(states)
+    letters = controls + ["Timeout"]
+    # targets[i][letter] : target of state i for the letter. Missing if no transition.
+    targets = []
+    signatures = []
+    for state in states:
+        state_targets = {}
+        state_triggers = {}
+        for t in state["Transitions"]:
+            letter = t["Control"] if "Control" in t else "Timeout"
+            if letter not in state_triggers:
+                state_triggers[letter] = t
+                state_targets[letter] = t["Target"]
+        targets.append(state_targets)
+        signatures.append(
+            tuple(transition_signature(state_triggers.get(c)) for c in letters)
+        )
+    # Reverse transitions : predecessors[letter][i] are the states going to i with letter.
+    predecessors = dict((a, collections.defaultdict(list)) for a in letters)
+    for i in range(state_count):
+        for a in targets[i]:
+            predecessors[a][targets[i][a]].append(i)
+
+    # Initial partition : behaviour signature.
+    blocks = []
+    block_of = [0] * state_count
+    signature_block = {}
+    for i in range(state_count):
+        if signatures[i] not in signature_block:
+            signature_block[signatures[i]] = len(blocks)
+            blocks.append(set())
+        block_of[i] = signature_block[signatures[i]]
+        blocks[block_of[i]].add(i)
+
+    waiting = collections.deque()
+    in_waiting = set()
+    for b in range(len(blocks)):
+        for a in letters:
+            waiting.append((b, a))
+            in_waiting.add((b, a))
+    while waiting:
+        splitter = waiting.popleft()
+        in_waiting.discard(splitter)
+        b, a = splitter
+        incoming = set()
+        for i in blocks[b]:
+            incoming.update(predecessors[a][i])
+        touched = collections.defaultdict(set)
+        for i in incoming:
+            touched[block_of[i]].add(i)
+        for y, inside in touched.items():
+            if len(inside) == len(blocks[y]):
+                continue
+            new_block = len(blocks)
+            blocks[y] -= inside
+            blocks.append(inside)
+            for i in inside:
+                block_of[i] = new_block
+            for c in letters:
+                if (y, c) in in_waiting:
+                    waiting.append((new_block, c))
+                    in_waiting.add((new_block, c))
+                else:
+                    smallest = y if len(blocks[y]) <= len(inside) else new_block
+                    waiting.append((smallest, c))
+                    in_waiting.add((smallest, c))
+
+    # New identifier of the representative of each block.
+    representative = {}
+    origin = []
+    for i in range(state_count):
+        if block_of[i] not in representative:
+            representative[block_of[i]] = len(origin)
+            origin.append(i)
+    reduced = []
+    for i in origin:
+        state = states[i]
+        for t in state["Transitions"]:
+            t["Target"] = representative[block_of[t["Target"]]]
+        reduced.append(state)
+    return reduced, origin
+
+
+# Binary descriptor
+# Release counterpart of the pre-computed graph : the state names (the "Name" entry of each
+# state and the "State" field of each transition) are debug only and the values matching the
+# defaults set by 'BaseCharacterController.init_states()', before 'load_json_descriptor' reads
+# the transitions, are omitted.
+def release_descriptor(pre_computed):
+    release = dict(pre_computed)
+    release_transitions = []
+    for state in pre_computed["Transitions"]:
+        release_state = []
+        for t in state:
+            if "Name" in t:
+                continue
+            release_transition = {}
+            for key, value in t.items():
+                if key == "State":
+                    continue
+                if key in ["Pressed", "Freeze", "Blocked"] and not value:
+                    continue
+                release_transition[key] = value
+            release_state.append(release_transition)
+        release_transitions.append(release_state)
+    release["Transitions"] = release_transitions
+    return release
+
+
+# Packed counterpart of the pre-computed graph, loaded by 'load_binary_descriptor' in
+# control_fsm.gd. Every value is a little-endian int32.
+# - Header : magic "CFSM", version, start state, control count, sequence timeout, state count,
+#   sequence count, total inferred sequence count.
+# - Sequences : durations, cooldowns, offsets of each sequence in the inferred list (sequence
+#   count + 1 values), inferred sequence identifiers.
+# - States : access, pressed, fire, freeze and timer_reset arrays, of state count *
+#   (control count + 1) values each (state major), the timeout_route array, then the blocked
+#   array, of state count * (control count + 1) values.
+# - Groups : the control group count, the start state of each group, then the group of each
+#   control (control count + 1 values).
+# - Matcher : the sequence matcher node count (0 without matcher), the goto array of node count
+#   * (control count + 1) values (failure links resolved), then the fire and freeze arrays of
+#   node count values.
+# The loaders reject any other version.
+BINARY_DESCRIPTOR_MAGIC = b"CFSM"
+BINARY_DESCRIPTOR_VERSION = 1
+
+
+def pack_int_array(values):
+    return struct.pack("<%di" % len(values), *values)
+
+
+def pack_descriptor(pre_computed):
+    control_count = pre_computed["ControlCount"]
+    sequences = pre_computed["Sequences"]
+    transitions = pre_computed["Transitions"]
+    stride = control_count + 1
+
+    infer_offsets = [0]
+    infer_ids = []
+    for seq in sequences:
+        if "Infer" in seq:
+            infer_ids += seq["Infer"]
+        infer_offsets.append(len(infer_ids))
+
+    # Default values match the ones of 'BaseCharacterController.init_states()'.
+    access = [0] * (len(transitions) * stride)
+    pressed = [0] * (len(transitions) * stride)
+    fire = [-1] * (len(transitions) * stride)
+    freeze = [0] * (len(transitions) * stride)
+    timer_reset = [0] * (len(transitions) * stride)
+    timeout_route = [0] * len(transitions)
+    blocked = [0] * (len(transitions) * stride)
+    for s in range(len(transitions)):
+        for t in transitions[s]:
+            if "Timeout" in t:
+                timeout_route[s] = t["Target"]
+            if "Control" not in t:
+                continue
+            slot = s * stride + t["Control"]
+            access[slot] = t["Target"]
+            pressed[slot] = 1 if t.get("Pressed", False) else 0
+            if "Fire" in t:
+                fire[slot] = t["Fire"]
+            if "Freeze" in t:
+                freeze[slot] = 1 if t["Freeze"] else 0
+            if "Timer" in t:
+                timer_reset[slot] = 1
+            if "Blocked" in t:
+                blocked[slot] = 1 if t["Blocked"] else 0
+
+    content = BINARY_DESCRIPTOR_MAGIC
+    content += pack_int_array(
+        [
+            BINARY_DESCRIPTOR_VERSION,
+            pre_computed["Start"],
+            control_count,
+            pre_computed["SequenceTimeout"],
+            len(transitions),
+            len(sequences),
+            len(infer_ids),
+        ]
+    )
+    content += pack_int_array([seq["Duration"] for seq in sequences])
+    content += pack_int_array([seq["Cooldown"] for seq in sequences])
+    content += pack_int_array(infer_offsets)
+    content += pack_int_array(infer_ids)
+    for array in [access, pressed, fire, freeze, timer_reset, timeout_route, blocked]:
+        content += pack_int_array(array)
+
+    # Without control groups, every control is in a single group.
+    groups = pre_computed.get(
+        "Groups", [{"Start": pre_computed["Start"], "Controls": []}]
+    )
+    control_group = [0] * stride
+    for g in range(len(groups)):
+        for c in groups[g]["Controls"]:
+            control_group[c] = g
+    content += pack_int_array([len(groups)])
+    content += pack_int_array([group["Start"] for group in groups])
+    content += pack_int_array(control_group)
+
+    # The failure links are followed once here, the matcher then takes a step per control.
+    matcher = pre_computed.get("Matcher", [])
+    goto = []
+    for n in range(len(matcher)):
+        if n == 0:
+            node_goto = [0] * stride
+        else:
+            node_goto = goto[matcher[n]["Fail"]].copy()
+        for c, target in matcher[n]["Edges"]:
+            node_goto[c] = target
+        goto.append(node_goto)
+    content += pack_int_array([len(matcher)])
+    for node_goto in goto:
+        content += pack_int_array(node_goto)
+    content += pack_int_array([node.get("Fire", -1) for node in matcher])
+    content += pack_int_array([1 if "Freeze" in node else 0 for node in matcher])
+    return content
+
+
+def generate_save_load(
+    file_write,
+    input_symbols
+):
+    timers = []
+    variables = []
+    for s in input_symbols:
+        if s["Type"] == "Timer":
+            timers.append(s["Name"])
+        else:
+            variables.append(s["Name"])
+
+    # Save State
+    file_write.write("func save_state() -> Dictionary:\n")
+    file_write.write("\tvar timers : Dictionary = {}\n")
+    for t in timers:
+        file_write.write('\ttimers["%s"] = timer_expire[%s_TIMER]\n' % ( t, t.upper() ))
+    file_write.write("\tvar variables : Dictionary = {}\n")
+    for v in variables:
+        file_write.write('\tvariables["%s"] = %s_v\n' % ( v, v ))
+    file_write.write("\tvar saved_status : Dictionary = {}\n")
+    file_write.write('\tsaved_status["timers"] = timers\n\tsaved_status["variables"] = variables\n\treturn saved_status\n\n')
+
+    # Load State
+    file_write.write("func load_state(dict_state : Dictionary) -> void:\n")
+    file_write.write('\tif not(dict_state.has("timers") and dict_state.has("variables")):\n')
+    file_write.write('\t\tprint("Invalid status store ! Should never happen. Contact devs.")\n')
+    file_write.write('\t\tprint_debug()\n\t\tprint_stack()\n')
+    file_write.write('\t\tget_tree().quit(-13)\n')
+    file_write.write('\tvar timers_d : Dictionary = dict_state["timers"] as Dictionary\n')
+    file_write.write('\tvar variables_d : Dictionary = dict_state["variables"] as Dictionary\n')
+    for t in timers:
+        file_write.write('\ttimer_expire[%s_TIMER] = timers_d["%s"]\n' % ( t.upper(), t ))
+    if len(timers) > 0:
+        file_write.write('\tupdate_next_expiry()\n')
+    for v in variables:
+        file_write.write('\t%s_v = variables_d["%s"]\n' % ( v, v ))
+    file_write.write("\n")
+
+
+# Generate the artifacts of the specific configuration file and write them in the output
+# directory. Return the artifact paths, relative to the output directory.
+def generate_specific(
+    config_filepath,
+    controls,
+    common_symbols,
+    common_signals,
+    common_groups,
+    common_defaults,
+    common_variables,
+    generate_debug,
+    output_directory,
+    options,
+):
+    profile_begin("Loading")
+    with open(config_filepath, "r") as config_file:
+        configuration = json.load(config_file)
+    result = generate_specific_content(
+        configuration,
+        controls,
+        common_symbols,
+        common_signals,
+        common_groups,
+        common_defaults,
+        common_variables,
+        generate_debug,
+        options,
+    )
+    profile_switch("Write")
+    write_artifacts(output_directory, result["Artifacts"])
+    profile_end()
+    for path in result["Artifacts"]:
+        print("Result stored in %s/%s" % (output_directory, path))
+    return list(result["Artifacts"].keys())
+
+
+# Generate the artifacts of a parsed specific configuration, in memory. The "Loading" phase is
+# expected to be profiled by the caller.
+# Return the result : the configuration "Name", the "States" (transitions of each state,
+# targets being state identifiers), the pre-computed graph ("PreComputed"), the sequence
+# "Matcher" (None without the '--sequence-matcher' option), the "Decision" structure of the
+# selected engine (tree, diagram or table) and the "Artifacts" (content of each artifact,
+# indexed by its path relative to the output directory).
+# Raise a 'ConfigurationError' when the configurations are inconsistent, or malformed (missing
+# entry, unexpected type).
+def generate_specific_content(
+    configuration,
+    controls,
+    common_symbols,
+    common_signals,
+    common_groups,
+    common_defaults,
+    common_variables,
+    generate_debug,
+    options,
+):
+    try:
+        return build_specific_content(
+            configuration,
+            controls,
+            common_symbols,
+            common_signals,
+            common_groups,
+            common_defaults,
+            common_variables,
+            generate_debug,
+            options,
+        )
+    except KeyError as error:
+        raise ConfigurationError("The configurations have no %s entry" % error)
+    except (IndexError, TypeError, AttributeError) as error:
+        raise ConfigurationError("The configurations are malformed (%s)" % error)
+
+
+def build_specific_content(
+    configuration,
+    controls,
+    common_symbols,
+    common_signals,
+    common_groups,
+    common_defaults,
+    common_variables,
+    generate_debug,
+    options,
+):
+    control_id = {}
     for i in range(len(controls)):
         control_id[controls[i]] = i + 1
 
-        order_matters = []
-        sequences = {}
-        config_name = ""
-        sequence_timeout = 0
-        local_symbols = []
-        events = {}
-        control_triggered_symbols = {}
-        process_triggered_symbols = []
-        can_move_conditions = {}
-        default_evaluations = common_defaults.copy()
-        local_variables = common_variables.copy()
-        # Command line arguments are controls.
-        with open(config_filepath, "r") as config_file:
-            configuration = json.load(config_file)
-            config_file.close()
-            order_matters = configuration["Rules"]["Order"]
-            sequences = configuration["Rules"]["Sequences"]
-            config_name = configuration["Name"]
-            sequence_timeout = configuration["Rules"]["Sequences"]["Timeout"]
-            local_symbols = configuration["Rules"]["Symbols"]
-            events = configuration["Rules"]["Events"]
-            process_triggered_symbols = configuration["Rules"]["Frame"]
-            control_triggered_symbols = configuration["Rules"]["Trigger"]
-            can_move_conditions = configuration["Rules"]["Controlable"]
-            if "Defaults" in configuration:
-                default_evaluations.update(configuration["Defaults"])
-            if "Variables" in configuration:
-                local_variables.update(configuration["Variables"])
-
-        # Determine events condition tree
-
-        # Check that local symbols don't overshadow common symbols.
-        for i in local_symbols:
-            symbol_name = i["Name"]
+    order_matters = []
+    max_pressed = None
+    exclusive_controls = []
+    control_groups = None
+    sequences = {}
+    config_name = ""
+    sequence_timeout = 0
+    local_symbols = []
+    events = {}
+    control_triggered_symbols = {}
+    process_triggered_symbols = []
+    can_move_conditions = {}
+    default_evaluations = common_defaults.copy()
+    local_variables = common_variables.copy()
+    try:
+        order_matters = configuration["Rules"]["Order"]
+        sequences = configuration["Rules"]["Sequences"]
+        config_name = configuration["Name"]
+        sequence_timeout = configuration["Rules"]["Sequences"]["Timeout"]
+        local_symbols = configuration["Rules"]["Symbols"]
+        events = configuration["Rules"]["Events"]
+        process_triggered_symbols = configuration["Rules"]["Frame"]
+        control_triggered_symbols = configuration["Rules"]["Trigger"]
+        can_move_conditions = configuration["Rules"]["Controlable"]
+    except KeyError as error:
+        raise ConfigurationError("The specific configuration has no %s entry" % error)
+    if "Defaults" in configuration:
+        default_evaluations.update(configuration["Defaults"])
+    if "Variables" in configuration:
+        local_variables.update(configuration["Variables"])
+    if "MaxPressed" in configuration["Rules"]:
+        max_pressed = configuration["Rules"]["MaxPressed"]
+    if "Exclusive" in configuration["Rules"]:
+        exclusive_controls = configuration["Rules"]["Exclusive"]
+    if "ControlGroups" in configuration["Rules"]:
+        control_groups = configuration["Rules"]["ControlGroups"]
+
+    # Determine events condition tree
+
+    # Check that local symbols don't overshadow common symbols.
+    for i in local_symbols:
+        if "Name" not in i:
+            raise ConfigurationError(
+                "The local symbol %d has no 'Name' entry" % (local_symbols.index(i) + 1)
+            )
+        symbol_name = i["Name"]
         for j in common_symbols:
             if symbol_name == j["Name"]:
-                print(
-                    "!!! The symbol '%s' is declared both globally and locally !!!"
+                raise ConfigurationError(
+                    "The symbol '%s' is declared both globally and locally"
                     % symbol_name
                 )
-                sys.exit(1)
     # Merge the symbols.
     symbols = common_symbols.copy()
     symbols += local_symbols
     symbols_types = {}
     for s in symbols:
+        if "Name" not in s:
+            raise ConfigurationError(
+                "The symbol %d has no 'Name' entry" % (symbols.index(s) + 1)
+            )
+        for entry in ["Type", "Default"]:
+            if entry not in s:
+                raise ConfigurationError(
+                    "The symbol '%s' has no '%s' entry" % (s["Name"], entry)
+                )
         symbol_name = s["Name"]
         symbol_type = s["Type"]
+        if symbol_type == "Control" and s["Default"] not in controls:
+            raise ConfigurationError(
+                "The default value '%s' of symbol '%s' is not a declared control"
+                % (s["Default"], symbol_name)
+            )
         symbols_types[symbol_name] = symbol_type
 
     # Using the events, build the decision tree.
     # First, verify that the symbols of the conditions exist.
     for event in events:
+        if "Conditions" not in events[event]:
+            raise ConfigurationError("The event '%s' has no 'Conditions' entry" % event)
         event_conditions = events[event]["Conditions"]
         for condition_symbol in event_conditions:
             # Existence check
             if condition_symbol not in symbols_types:
-                print(
-                    "!!! In event '%s', condition symbol '%s' is not defined !!!"
+                raise ConfigurationError(
+                    "In event '%s', condition symbol '%s' is not defined"
                     % (event, condition_symbol)
                 )
-                sys.exit(1)
             # Type check
             type_to_check = type(event_conditions[condition_symbol])
             declared_type = symbols_types[condition_symbol]
@@ -860,11 +2233,10 @@ def generate_specific(
                     )
                 )
             ):
-                print(
-                    "!!! In event '%s', condition symbol '%s' type mismatch !!! (should be %s but is %s)"
+                raise ConfigurationError(
+                    "In event '%s', condition symbol '%s' type mismatch (should be %s but is %s)"
                     % (event, condition_symbol, declared_type, type_to_check)
                 )
-                sys.exit(1)
 
     # Change the Control type to 'int'.
     for event in events:
@@ -885,10 +2257,74 @@ def generate_specific(
     # Create the symbol->type mapping
     symbols_class = dict((k, type_to_class[v]) for (k, v) in symbols_types.items())
 
+    # Control groups. Each group has its own state machine. Without groups, a single unnamed
+    # group holds every control.
+    if control_groups is None:
+        groups = [{"Name": None, "Controls": controls}]
+    else:
+        groups = []
+        for group_name in control_groups:
+            groups.append({"Name": group_name, "Controls": control_groups[group_name]})
+    group_of = {}
+    for g in range(len(groups)):
+        for c in groups[g]["Controls"]:
+            if c not in controls:
+                raise ConfigurationError(
+                    "The control '%s' of group '%s' is not a declared control"
+                    % (c, groups[g]["Name"])
+                )
+            if c in group_of:
+                raise ConfigurationError(
+                    "The control '%s' belongs to groups '%s' and '%s'"
+                    % (c, groups[group_of[c]]["Name"], groups[g]["Name"])
+                )
+            group_of[c] = g
+    for c in controls:
+        if c not in group_of:
+            raise ConfigurationError(
+                "The control '%s' doesn't belong to any control group" % c
+            )
+
+    # Reachability constraints of the control states.
+    if max_pressed is not None and (type(max_pressed) is not int or max_pressed < 1):
+        raise ConfigurationError(
+            "'MaxPressed' must be a positive integer (%s)" % max_pressed
+        )
+    for exclusive_set in exclusive_controls:
+        if type(exclusive_set) is not list:
+            raise ConfigurationError("'Exclusive' must be a list of control lists")
+        if len(exclusive_set) < 2:
+            raise ConfigurationError(
+                "The exclusive controls %s must hold at least two controls"
+                % exclusive_set
+            )
+        for c in exclusive_set:
+            if c not in controls:
+                raise ConfigurationError(
+                    "The exclusive control '%s' is not a declared control" % c
+                )
+            if group_of[c] != group_of[exclusive_set[0]]:
+                raise ConfigurationError(
+                    "The exclusive controls %s are not in the same control group"
+                    % exclusive_set
+                )
+
     # Sequences define a tree. Each leaf is a special movement.
+    profile_switch("Expansion")
     sequences_tree = {}
 
     for s in sequences["List"]:
+        if "Name" not in s:
+            raise ConfigurationError(
+                "The sequence %d has no 'Name' entry"
+                % (sequences["List"].index(s) + 1),
+                -1,
+            )
+        for entry in ["Sequence", "Duration", "Cooldown"]:
+            if entry not in s:
+                raise ConfigurationError(
+                    "The sequence '%s' has no '%s' entry" % (s["Name"], entry), -1
+                )
         cursor_node = sequences_tree
         controls_sequence = s["Sequence"]
         if "Freeze" in s:
@@ -897,26 +2333,29 @@ def generate_specific(
             freeze = False
         for key in controls_sequence:
             if key not in controls:
-                print(
-                    "!!! The sequence control '%s' is not a declared control !!!" % key
+                raise ConfigurationError(
+                    "The sequence control '%s' is not a declared control" % key, -1
+                )
+            if group_of[key] != group_of[controls_sequence[0]]:
+                raise ConfigurationError(
+                    "The sequence '%s' spans several control groups" % s["Name"], -1
                 )
-                sys.exit(-1)
             if key not in cursor_node:
                 cursor_node[key] = {"Freeze": freeze}
             elif "Name" in cursor_node[key]:
-                print(
-                    "!!! The sequence '%s' collides with sequence '%s'!!!"
-                    % (s["Name"], cursor_node[key]["Name"])
+                raise ConfigurationError(
+                    "The sequence '%s' collides with sequence '%s'"
+                    % (s["Name"], cursor_node[key]["Name"]),
+                    -1,
                 )
-                sys.exit(-1)
             cursor_node = cursor_node[key]
         # At the end, the cursor node will contain informations about special move.
         if len(cursor_node) > 1:  # The node will always have one node.
-            print(
-                "!!! The sequence '%s' is a prefix of another one ! ABORT !!! (%s)"
-                % (s["Name"], cursor_node)
+            raise ConfigurationError(
+                "The sequence '%s' is a prefix of another one (%s)"
+                % (s["Name"], cursor_node),
+                -1,
             )
-            sys.exit(-1)
         else:
             cursor_node["Name"] = s["Name"]
             cursor_node["Duration"] = s["Duration"]
@@ -926,151 +2365,56 @@ def generate_specific(
         print("## The sequence tree has been correctly defined has follow")
         pprint(sequences_tree)
 
-    # THE important dictionary.
-    states = {}
-    ##########################
-
-    # Start Node : "Idle"
-    idle_state_controls = {}
-    for c in controls:
-        idle_state_controls[c] = False
-
-    idle_state = {
-        "Transitions": [],  # Transition to other state.
-        "Pressed": [],  # Pressed key, ordered as stated in the computation rules.
-        "Controls": idle_state_controls,  # Controls status.
-        "Sequence": sequences_tree,  # Current sequence tree node.
-        "Progress": [],  # Current sequence progression.
-        "Freeze": False,  # Freeze
-    }
-
-    states["Idle"] = idle_state
-
-    # Until there's no state left to expand.
+    # With the sequence matcher, the control states only track the pressed controls.
+    states_sequences_tree = sequences_tree
+    if options["SequenceMatcher"]:
+        states_sequences_tree = {}
 
-    state_seeds = queue.Queue()
-    state_seeds.put("Idle")
+    # THE important dictionary.
+    # The state machines of the groups are independent : the states of each group are stored
+    # one after the other, so that the state count is the sum of the group state counts.
+    # States are identified by their index, names are only built for the debug outputs.
+    states = []
+    for group in groups:
+        group_controls = group["Controls"]
+        group["Expansion"] = expand_states(
+            group_controls,
+            order_matters,
+            dict(
+                (k, v)
+                for (k, v) in states_sequences_tree.items()
+                if k in group_controls
+            ),
+            max_pressed,
+            [e for e in exclusive_controls if e[0] in group_controls],
+        )
+        group_states = describe_states(group_controls, group["Expansion"])
+        group["Origin"] = range(len(group_states))
+        ##########################
 
-    while not state_seeds.empty():
-        current_state = state_seeds.get()
         if VERBOSE_MODE:
-            print("-------------")
-            print("Expand '%s' state" % current_state)
-
-        # Timeout management.
-        # It is actually pretty easy as we only have one timer.
-        # We just need to go to the state without any sequence.
-        if len(states[current_state]["Progress"]) > 0:
-            target_name = "_".join(states[current_state]["Pressed"])
-            if target_name == "":
-                target_name = "Idle"
-            trigger = {"Timeout": "SequenceTimer", "Target": target_name}
-            states[current_state]["Transitions"].append(trigger)
-            if target_name not in states:
-                states[target_name] = {
-                    "Transitions": [],
-                    "Pressed": states[current_state]["Pressed"],
-                    "Controls": states[current_state]["Controls"],
-                    "Sequence": sequences_tree,
-                    "Progress": [],
-                    "Freeze": False,
-                }
-                state_seeds.put(target_name)
-
-        # Controls management.
-        log_verbose("-? Controls order : %s" % states[current_state]["Pressed"])
-        current_state_controls = states[current_state]["Controls"]
-        # We can change only one control at a time
-        for c in controls:
-            trigger = {}
-            trigger["Control"] = c
-            new_controls = current_state_controls.copy()
-            new_controls[c] = not current_state_controls[c]
-            log_verbose("- Control %s=%s" % (c, new_controls[c]))
-            control_order = states[current_state]["Pressed"].copy()
-            if new_controls[c]:
-                control_order.append(c)
-            else:
-                control_order.remove(c)
-            trigger["Pressed"] = new_controls[c]
-
-            # Sequence progression.
-            new_progress = states[current_state]["Progress"].copy()
-            new_sequence = states[current_state]["Sequence"]
-            if new_controls[c]:
-                if c in new_sequence:
-                    if "Name" in new_sequence[c]:
-                        # Combo activation
-                        seq_finish = new_sequence[c]
-                        trigger["Fire"] = seq_finish["Name"]
-                        trigger["Cooldown"] = seq_finish["Cooldown"]
-                        trigger["Duration"] = seq_finish["Duration"]
-                        if "Infer" in seq_finish:
-                            trigger["Infer"] = seq_finish["Infer"]
-                        new_sequence = sequences_tree
-                        new_progress = []
-                        trigger["Freeze"] = True
-                    else:
-                        trigger["Timer"] = "SequenceTimer"
-                        new_sequence = new_sequence[c]
-                        new_progress.append(c)
-                        trigger["Freeze"] = new_sequence["Freeze"]
-                else:
-                    new_progress = []
-                    new_sequence = sequences_tree
-
-            # State name building
-            # Use order to generate new state depending on the activation order.
-            # Order will always be in prefix.
-            # For count activated controls
-            name_controls = []
-            toinsert_controls = new_controls.copy()
-            # First, ordered controls
-            log_verbose("-- New controls : %s" % new_controls)
-            for k in states[current_state]["Pressed"]:
-                if k in order_matters and current_state_controls[k] and new_controls[k]:
-                    log_verbose("-- Add %s" % k)
-                    name_controls.append(k)
-                    toinsert_controls.pop(k)
-            for k in toinsert_controls:
-                if new_controls[k]:
-                    log_verbose("-+ Add %s" % k)
-                    name_controls.append(k)
-            tokens = name_controls.copy()
-            new_name = "_".join(tokens)
-            if new_name == "":
-                new_name = "Idle"
-            # Second, add sequence
-            sequence_tag = "-".join(new_progress)
-            if not sequence_tag == "":
-                new_name = "%s#%s" % (new_name, sequence_tag)
-
-            trigger["Target"] = new_name
-
-            if not (new_name == "Idle" or new_name in states):
-                states[new_name] = {
-                    "Transitions": [],
-                    "Pressed": name_controls,
-                    "Controls": new_controls,
-                    "Sequence": new_sequence,
-                    "Progress": new_progress,
-                }
-                log_verbose("--+ Add '%s' state" % new_name)
-                log_verbose("--+ With control order %s" % control_order)
-                state_seeds.put(new_name)
-            else:
-                log_verbose("--! Existing state or start state '%s'" % new_name)
+            print("--- End of Computation ---")
+            print("There is %d states" % len(group_states))
 
-            found = False
-            for i in states[current_state]["Transitions"]:
-                found |= i["Target"] == new_name
-            if not found:
-                states[current_state]["Transitions"].append(trigger)
+        if options["Minimize"]:
+            state_count = len(group_states)
+            group_states, group["Origin"] = minimize_states(
+                group_states, group_controls
+            )
+            print(
+                "## Minimization removed %d states (%d -> %d)"
+                % (state_count - len(group_states), state_count, len(group_states))
+            )
 
-    if VERBOSE_MODE:
-        print("--- End of Computation ---")
-        print("There is %d states" % len(states))
+        # "Idle" is the first state of the group, the targets are shifted after the states
+        # of the previous groups.
+        group["Start"] = len(states)
+        for state in group_states:
+            for t in state["Transitions"]:
+                t["Target"] += group["Start"]
+        states += group_states
 
+    profile_switch("Description")
     sequences_list = sequences["List"]
     sequences_id = {}
     pre_computed_sequences = []
@@ -1083,61 +2427,97 @@ def generate_specific(
 
     for i in range(len(sequences_list)):
         if "Infer" in sequences_list[i]:
+            for inf in sequences_list[i]["Infer"]:
+                if inf not in sequences_id:
+                    raise ConfigurationError(
+                        "The sequence '%s' infers the undefined sequence '%s'"
+                        % (sequences_list[i]["Name"], inf),
+                        -1,
+                    )
             # Compute new inference sequence id.
             infer_id = list(
                 map(lambda inf: sequences_id[inf], sequences_list[i]["Infer"])
             )
             pre_computed_sequences[i]["Infer"] = infer_id
-    # Generate human readable description file.
-    enhanced_transitions = []
-
-    for name in states:
-        new_state = {}
-        new_state["Description"] = ""
-        new_state["State"] = name
-        new_state["Triggers"] = states[name]["Transitions"]
-        enhanced_transitions.append(new_state)
-
-    complete_content = {
-        "Start": "Idle",
-        "SequenceTimeout": sequence_timeout,
-        "Transitions": enhanced_transitions,
-    }
-
-    file_content = json.dumps(complete_content, indent=4)
-
+    matcher = None
+    if options["SequenceMatcher"]:
+        matcher = create_sequence_matcher(sequences_tree, controls, sequences_id)
+        print("## The sequence matcher has %d nodes" % len(matcher))
+    # The state names are only needed by the debug outputs and the "Name" entries of the
+    # pre-computed graph.
+    names = None
+    if generate_debug or not options["Release"]:
+        names = state_name_table(groups)
+
+    artifacts = {}
     if generate_debug:
-        save_target = "%s/debug/%s_fsm.json" % (output_directory, config_name)
-        with open(save_target, "w") as generated_file:
-            generated_file.write(file_content)
-            generated_file.close()
-            print("Debug Result stored in %s" % save_target)
+        # Generate human readable description file.
+        enhanced_transitions = []
+        for i in range(len(states)):
+            new_state = {}
+            new_state["Description"] = ""
+            new_state["State"] = names[i]
+            new_state["Triggers"] = []
+            for t in states[i]["Transitions"]:
+                trigger = dict(t)
+                trigger["Target"] = names[t["Target"]]
+                new_state["Triggers"].append(trigger)
+            enhanced_transitions.append(new_state)
+
+        complete_content = {
+            "Start": names[groups[0]["Start"]],
+            "SequenceTimeout": sequence_timeout,
+            "Transitions": enhanced_transitions,
+        }
+        if matcher is not None:
+            complete_content["Matcher"] = matcher
+        if control_groups is not None:
+            complete_content["Groups"] = [
+                {
+                    "Name": g["Name"],
+                    "Start": names[g["Start"]],
+                    "Controls": g["Controls"],
+                }
+                for g in groups
+            ]
 
-    # Generate pre-computed description file.
-    states_id = {}
-    for i in range(len(enhanced_transitions)):
-        states_id[enhanced_transitions[i]["State"]] = i
+        save_target = "debug/%s_fsm.json" % config_name
+        artifacts[save_target] = json.dumps(complete_content, indent=4)
 
+    # Generate pre-computed description file.
     pre_computed = {
-        "Start": states_id["Idle"],
+        "Start": groups[0]["Start"],
         "ControlCount": len(controls),
         "SequenceTimeout": sequence_timeout,
     }
+    if control_groups is not None:
+        pre_computed["Groups"] = [
+            {
+                "Name": g["Name"],
+                "Start": g["Start"],
+                "Controls": [control_id[c] for c in g["Controls"]],
+            }
+            for g in groups
+        ]
     pre_computed["Sequences"] = pre_computed_sequences
+    if matcher is not None:
+        pre_computed["Matcher"] = matcher
     pre_computed_transitions = []
-    for name in states:
+    for i in range(len(states)):
         new_state = []
-        new_state.append({"Name": name})
+        if names is not None:
+            new_state.append({"Name": names[i]})
         # No need to identify the state as the ID = index in the array
-        for t in states[name]["Transitions"]:
+        for t in states[i]["Transitions"]:
             if "Description" in t:
                 continue
             new_transition = {}
             if "Control" in t:
                 new_transition["Control"] = control_id[t["Control"]]
                 new_transition["Pressed"] = t["Pressed"]
-            new_transition["Target"] = states_id[t["Target"]]
-            new_transition["State"] = t["Target"]
+            new_transition["Target"] = t["Target"]
+            if names is not None:
+                new_transition["State"] = names[t["Target"]]
             if "Timer" in t:
                 new_transition["Timer"] = t["Timer"]
             if "Timeout" in t:
@@ -1146,476 +2526,507 @@ def generate_specific(
                 new_transition["Fire"] = sequences_id[t["Fire"]]
             if "Freeze" in t:
                 new_transition["Freeze"] = t["Freeze"]
+            if "Blocked" in t:
+                new_transition["Blocked"] = t["Blocked"]
             new_state.append(new_transition)
         pre_computed_transitions.append(new_state)
     pre_computed["Transitions"] = pre_computed_transitions
 
-    file_content = json.dumps(pre_computed, indent=4)
-
-    save_target = "%s/%s_fsm_pc.json" % (output_directory, config_name.lower())
-    with open(save_target, "w") as generated_file:
-        generated_file.write(file_content)
-        generated_file.close()
-        print("Precomputed result stored in %s" % save_target)
-
-    with open(
-        "%s/%s_controller.gd" % (output_directory, config_name.lower()), "w"
-    ) as specific_constants:
-        name_tokens = config_name.split("_")
-        specific_script_class_name = "".join(e.title() for e in name_tokens)
-        specific_constants.write(
-            "class_name %sCharacterController\n" % specific_script_class_name
+    if options["Release"]:
+        file_content = json.dumps(
+            release_descriptor(pre_computed), separators=(",", ":")
         )
-        specific_constants.write("extends BaseCharacterController\n\n")
-        timers_identifier = {}
-        sequences_list = sequences["List"]
-        for s in range(len(sequences_list)):
-            useq_name = sequences_list[s]["Name"].upper()
-            specific_constants.write("const SEQUENCE_%s : int = %d\n" % (useq_name, s))
-            specific_constants.write(
-                "const SEQUENCE_%s_DURATION_TIMER : int = %d\n" % (useq_name, (s * 2))
-            )
-            timers_identifier["SEQUENCE_%s_DURATION" % (useq_name)] = s * 2
-            specific_constants.write(
-                "const SEQUENCE_%s_COOLDOWN_TIMER : int = %d\n"
-                % (useq_name, ((s * 2) + 1))
-            )
-            timers_identifier["SEQUENCE_%s_COOLDOWN" % (useq_name)] = (s * 2) + 1
-        specific_constants.write(
-            "const SEQUENCE_TIMER : int = %d\n" % (len(sequences_list) * 2)
+    else:
+        file_content = json.dumps(pre_computed, indent=4)
+
+    save_target = "%s_fsm_pc.json" % config_name.lower()
+    artifacts[save_target] = file_content
+
+    if options["Binary"]:
+        save_target = "%s_fsm_pc.bin" % config_name.lower()
+        artifacts[save_target] = pack_descriptor(pre_computed)
+
+    specific_script = io.StringIO()
+    name_tokens = config_name.split("_")
+    specific_script_class_name = "".join(e.title() for e in name_tokens)
+    specific_script.write(
+        "class_name %sCharacterController\n" % specific_script_class_name
+    )
+    specific_script.write("extends BaseCharacterController\n\n")
+    timers_identifier = {}
+    sequences_list = sequences["List"]
+    for s in range(len(sequences_list)):
+        useq_name = sequences_list[s]["Name"].upper()
+        specific_script.write("const SEQUENCE_%s : int = %d\n" % (useq_name, s))
+        specific_script.write(
+            "const SEQUENCE_%s_DURATION_TIMER : int = %d\n" % (useq_name, (s * 2))
         )
-        timers_identifier["SEQUENCE"] = len(sequences_list) * 2
-        count = len(sequences_list) * 2 + 1
-        # Add timer symbols
-        for s in symbols:
-            if s["Type"] == "Timer":
-                specific_constants.write(
-                    "const %s_TIMER : int = %d\n" % (s["Name"].upper(), count)
-                )
-                timers_identifier[s["Name"].upper()] = count
-                count += 1
-        # And timer name to identifier dictionary
-        specific_constants.write(
-            "const TIMERS_IDENTIFIER : Dictionary = %s\n" % (timers_identifier)
+        timers_identifier["SEQUENCE_%s_DURATION" % (useq_name)] = s * 2
+        specific_script.write(
+            "const SEQUENCE_%s_COOLDOWN_TIMER : int = %d\n" % (useq_name, ((s * 2) + 1))
         )
-        # Add events
-        count = 0
-        event_descriptor = []
-        for e in events:
-            event_name = e.upper()
-            identifier = "EVENT_%s" % event_name
-            event_descriptor.append(e)
-            specific_constants.write("const %s : int = %d\n" % (identifier, count))
+        timers_identifier["SEQUENCE_%s_COOLDOWN" % (useq_name)] = (s * 2) + 1
+    specific_script.write(
+        "const SEQUENCE_TIMER : int = %d\n" % (len(sequences_list) * 2)
+    )
+    timers_identifier["SEQUENCE"] = len(sequences_list) * 2
+    # One sequence timer per control group, the first one being 'SEQUENCE_TIMER'.
+    if control_groups is not None:
+        for g in range(len(groups)):
+            ugroup_name = groups[g]["Name"].upper()
+            specific_script.write(
+                "const SEQUENCE_%s_TIMER : int = %d\n"
+                % (ugroup_name, len(sequences_list) * 2 + g)
+            )
+            timers_identifier["SEQUENCE_%s" % ugroup_name] = len(sequences_list) * 2 + g
+    count = len(sequences_list) * 2 + len(groups)
+    # Add timer symbols
+    for s in symbols:
+        if s["Type"] == "Timer":
+            specific_script.write(
+                "const %s_TIMER : int = %d\n" % (s["Name"].upper(), count)
+            )
+            timers_identifier[s["Name"].upper()] = count
             count += 1
-        specific_constants.write(
-            "const EVENT_DESCRIPTOR : Array = %s" % (event_descriptor)
-        )
+    # And timer name to identifier dictionary
+    specific_script.write(
+        "const TIMERS_IDENTIFIER : Dictionary = %s\n" % (timers_identifier)
+    )
+    # Add events
+    count = 0
+    event_descriptor = []
+    for e in events:
+        event_name = e.upper()
+        identifier = "EVENT_%s" % event_name
+        event_descriptor.append(e)
+        specific_script.write("const %s : int = %d\n" % (identifier, count))
+        count += 1
+    specific_script.write("const EVENT_DESCRIPTOR : Array = %s" % (event_descriptor))
 
     if generate_debug:
-        with open(
-            "%s/debug/%s_debug.dot" % (output_directory, config_name), "w"
-        ) as debug_file:
-            debug_file.write("digraph debug_fsm {\n")
-            debug_file.write("\tedge [arrowhead=normal, fontsize=6];\n")
-            debug_file.write("\tnode [shape=box, fontsize=8];\n")
-            for s in enhanced_transitions:
-                start_name = s["State"]
-                for t in s["Triggers"]:
-                    edge_description = "Timeout"
-                    edge_color = "blue"
-                    edge_fire = ""
-                    if "Control" in t:
-                        edge_description = t["Control"]
-                        edge_color = "green" if t["Pressed"] else "red"
-                        if "Fire" in t:
-                            edge_fire = ', headlabel = "%s", style="bold"' % t["Fire"]
-                    debug_file.write(
-                        '\t"%s" -> "%s" [taillabel = "%s", color=%s%s];\n'
-                        % (
-                            start_name,
-                            t["Target"],
-                            edge_description,
-                            edge_color,
-                            edge_fire,
-                        )
+        debug_file = io.StringIO()
+        debug_file.write("digraph debug_fsm {\n")
+        debug_file.write("\tedge [arrowhead=normal, fontsize=6];\n")
+        debug_file.write("\tnode [shape=box, fontsize=8];\n")
+        for s in enhanced_transitions:
+            start_name = s["State"]
+            for t in s["Triggers"]:
+                edge_description = "Timeout"
+                edge_color = "blue"
+                edge_fire = ""
+                if "Control" in t:
+                    edge_description = t["Control"]
+                    edge_color = "green" if t["Pressed"] else "red"
+                    if "Blocked" in t:
+                        edge_color = "gray"
+                    if "Fire" in t:
+                        edge_fire = ', headlabel = "%s", style="bold"' % t["Fire"]
+                debug_file.write(
+                    '\t"%s" -> "%s" [taillabel = "%s", color=%s%s];\n'
+                    % (
+                        start_name,
+                        t["Target"],
+                        edge_description,
+                        edge_color,
+                        edge_fire,
                     )
-            debug_file.write("}\n")
-            debug_file.close()
+                )
+        debug_file.write("}\n")
+        artifacts["debug/%s_debug.dot" % config_name] = debug_file.getvalue()
 
     # And finally, generate decision tree to generate the specific script.
     # We got all we need. The symbols, the triggers, the timers.
-    decision_tree = create_decision_tree(
-        events,
-        symbols_class,
-        symbols_types,
-        config_name,
-        common_signals,
-        control_id,
-        generate_debug,
-        output_directory,
-    )
-    print("## Generated Decision Tree")
-
-    # Find missing events.
+    profile_switch("DecisionTree")
     actual_events = list(events.keys())
-    parkour = queue.Queue()
-    parkour.put(decision_tree)
-    while not parkour.empty():
-        cursor = parkour.get()
-        if "Event" in cursor:
-            actual_events.remove(cursor["Event"])
-        if "Values" in cursor:
-            for v in cursor["Values"]:
-                parkour.put(cursor["Values"][v])
-    if len(actual_events) > 0:
-        print("!!! Missing events in decision tree : %s !!!" % actual_events)
-        sys.exit(1)
+    decision_table = None
+    # Body of 'invoke_decision_tree', and helper functions.
+    decision_code = io.StringIO()
+    decision_helpers = io.StringIO()
+    if options["Engine"] == "table":
+        decision_table = create_decision_table(
+            events,
+            symbols_class,
+            symbols_types,
+            config_name,
+            common_signals,
+            control_id,
+            generate_debug,
+            artifacts,
+            decision_code,
+            decision_helpers,
+        )
+    decision = decision_table
+    if decision_table is not None:
+        print("## Generated Decision Table")
+        for e in decision_table["Events"]:
+            actual_events.remove(e)
+    elif options["Engine"] == "mdd":
+        decision_diagram = create_decision_diagram(
+            events,
+            symbols_class,
+            symbols_types,
+            config_name,
+            common_signals,
+            control_id,
+            generate_debug,
+            artifacts,
+            decision_code,
+            decision_helpers,
+        )
+        decision = decision_diagram
+        print("## Generated Decision Diagram")
+        for e in decision_diagram["Events"]:
+            actual_events.remove(e)
+    else:
+        decision_tree = create_decision_tree(
+            events,
+            symbols_class,
+            symbols_types,
+            config_name,
+            common_signals,
+            control_id,
+            generate_debug,
+            artifacts,
+            decision_code,
+            options,
+        )
+        decision = decision_tree
+        print("## Generated Decision Tree")
+
+        # Find missing events.
+        parkour = queue.Queue()
+        parkour.put(decision_tree)
+        while not parkour.empty():
+            cursor = parkour.get()
+            if "Event" in cursor:
+                actual_events.remove(cursor["Event"])
+            if "Values" in cursor:
+                for v in cursor["Values"]:
+                    parkour.put(cursor["Values"][v])
+    if len(actual_events) > 0:
+        raise InternalError("Missing events in decision tree : %s" % actual_events)
     else:
         print("## Decision tree manage all the events.")
 
     # And now, we are ready to generate the specific script, the last thing we'll do here.
-    script_path = "%s/%s_controller.gd" % (output_directory, config_name.lower())
-    print("## Print specific controller script in : %s" % script_path)
-    with open(script_path, "a") as specific_script:
-        specific_script.write("\n\n")
-        # All signals
-        for s in common_signals:
-            attributes = ", ".join(list(common_signals[s].keys()))
-            specific_script.write("signal %s(%s)\n" % (s, attributes))
+    profile_switch("Emission")
+    script_path = "%s_controller.gd" % config_name.lower()
+    specific_script.write("\n\n")
+    # All signals
+    for s in common_signals:
+        attributes = ", ".join(list(common_signals[s].keys()))
+        specific_script.write("signal %s(%s)\n" % (s, attributes))
+    specific_script.write("\n")
+    # All exported nodepath
+    for g in common_groups:
+        specific_script.write(
+            "export (NodePath) var controlled_nodepath_%s : NodePath\n" % (g.lower())
+        )
+    specific_script.write("\n")
+    for g in common_groups:
+        specific_script.write("onready var controlled_node_%s\n" % (g.lower()))
+    specific_script.write("\n")
+    # All local variables
+    specific_script.write("# Local Variables\n")
+    for s in local_variables:
+        if "onready" in local_variables[s] and local_variables[s]["onready"]:
+            specific_script.write("onready ")
+        specific_script.write("var %s" % (s))
+        if "type" in local_variables[s]:
+            specific_script.write(" : %s" % (local_variables[s]["type"]))
+        if "value" in local_variables[s]:
+            specific_script.write(" = %s" % (local_variables[s]["value"]))
         specific_script.write("\n")
-        # All exported nodepath
-        for g in common_groups:
+    specific_script.write("\n")
+    # All symbols
+    specific_script.write("# Decision tree symbols\n")
+    for s in symbols:
+        if not s["Type"] == "Timer":
+            # Compute default value.
+            default_value = None
+            if s["Type"] == "Control":
+                default_value = control_id[s["Default"]]
+            else:
+                default_value = s["Default"]
             specific_script.write(
-                "export (NodePath) var controlled_nodepath_%s : NodePath\n"
-                % (g.lower())
+                "var %s_v : %s = %s\n"
+                % (s["Name"], symbols_class[s["Name"]].__name__, default_value)
             )
-        specific_script.write("\n")
-        for g in common_groups:
-            specific_script.write("onready var controlled_node_%s\n" % (g.lower()))
-        specific_script.write("\n")
-        # All local variables
-        specific_script.write("# Local Variables\n")
-        for s in local_variables:
-            if "onready" in local_variables[s] and local_variables[s]["onready"]:
-                specific_script.write("onready ")
-            specific_script.write("var %s" % (s))
-            if "type" in local_variables[s]:
-                specific_script.write(" : %s" % (local_variables[s]["type"]))
-            if "value" in local_variables[s]:
-                specific_script.write(" = %s" % (local_variables[s]["value"]))
-            specific_script.write("\n")
-        specific_script.write("\n")
-        # All symbols
-        specific_script.write("# Decision tree symbols\n")
-        for s in symbols:
-            if not s["Type"] == "Timer":
-                # Compute default value.
-                default_value = None
-                if s["Type"] == "Control":
-                    default_value = control_id[s["Default"]]
-                else:
-                    default_value = s["Default"]
-                specific_script.write(
-                    "var %s_v : %s = %s\n"
-                    % (s["Name"], symbols_class[s["Name"]].__name__, default_value)
-                )
-        specific_script.write("\nfunc _ready():\n")
-        # Add controlled nodes
-        for g in common_groups:
-            group_name = g.lower()
+    specific_script.write("\nfunc _ready():\n")
+    # Add controlled nodes
+    for g in common_groups:
+        group_name = g.lower()
+        specific_script.write("\tif controlled_nodepath_%s != null:\n" % (group_name))
+        specific_script.write(
+            "\t\tcontrolled_node_%s = get_node(controlled_nodepath_%s)\n"
+            % (group_name, group_name)
+        )
+        specific_script.write("\telse:\n\t\tcontrolled_node_%s = null\n" % (group_name))
+    specific_script.write("\n")
+    # Add local timers
+    for s in symbols:
+        if s["Type"] == "Timer":
             specific_script.write(
-                "\tif controlled_nodepath_%s != null:\n" % (group_name)
+                "\tinit_timer(%s_TIMER, %d)\n" % (s["Name"].upper(), s["Default"])
             )
+    specific_script.write("\n")
+    # Symbol accessors
+    for s in symbols:
+        if s["Type"] == "Timer":
+            timer_name = "%s_TIMER" % s["Name"].upper()
+            specific_script.write("func %s() -> bool:\n" % s["Name"])
             specific_script.write(
-                "\t\tcontrolled_node_%s = get_node(controlled_nodepath_%s)\n"
-                % (group_name, group_name)
+                "\tif %s >= timer_expire.size():\n\t\treturn false\n" % timer_name
             )
             specific_script.write(
-                "\telse:\n\t\tcontrolled_node_%s = null\n" % (group_name)
+                "\treturn timer_expire[%s] > 0 && current_time < timer_expire[%s]\n\n"
+                % (timer_name, timer_name)
             )
-        specific_script.write("\n")
-        # Add local timers
-        for s in symbols:
-            if s["Type"] == "Timer":
-                timer_name = "%s_TIMER" % s["Name"].upper()
-                specific_script.write(
-                    "\ttimer_expire[%s] = -1\n\ttimer_timeout[%s] = %d\n"
-                    % (timer_name, timer_name, s["Default"])
-                )
-        specific_script.write("\n")
-        # Symbol accessors
-        for s in symbols:
-            if s["Type"] == "Timer":
-                specific_script.write("func %s() -> bool:\n" % s["Name"])
-                specific_script.write(
-                    '\tvar identifier : int = TIMERS_IDENTIFIER["%s"]\n'
-                    % (s["Name"].upper())
-                )
-                specific_script.write(
-                    "\tif identifier >= timer_expire.size():\n\t\treturn false\n"
-                )
-                specific_script.write(
-                    "\treturn timer_expire[identifier] > 0 && current_time < timer_expire[identifier]\n\n"
-                )
-            else:
-                specific_script.write(
-                    "func %s() -> %s:\n\treturn %s_v\n\n"
-                    % (s["Name"], symbols_class[s["Name"]].__name__, s["Name"])
-                )
-        # Decision tree !
+        else:
+            specific_script.write(
+                "func %s() -> %s:\n\treturn %s_v\n\n"
+                % (s["Name"], symbols_class[s["Name"]].__name__, s["Name"])
+            )
+    # Decision tree !
+    # Coalesced, the call sites only request an evaluation : 'BaseCharacterController' runs the
+    # tree once, at the end of the frame.
+    if options["Coalesce"]:
+        specific_script.write("func invoke_decision_tree() -> void:\n")
+        specific_script.write("\tdecision_requested = true\n\n")
+        specific_script.write("func run_decision_tree() -> void:\n")
+    else:
         specific_script.write("func invoke_decision_tree() -> void:\n")
-        decision_tree_path = "%s/decision_tree_%s.gd" % (output_directory, config_name)
-        with open(decision_tree_path, "r") as generated_dt:
-            lines = generated_dt.readlines()
-            for line in lines:
-                specific_script.write("\t%s" % line)
-            generated_dt.close()
-        os.remove(decision_tree_path)
-        # Delegate process : Manage per-frame trigger
+    for line in decision_code.getvalue().splitlines(True):
+        specific_script.write("\t%s" % line)
+    # Helper functions of the decision diagram, or table of the decision table.
+    if len(decision_helpers.getvalue()) > 0:
+        specific_script.write("\n%s" % decision_helpers.getvalue())
+    # Delegate process : Manage per-frame trigger
+    specific_script.write(
+        "\nfunc delegate_process() -> void:\n\tvar invoke : bool = false\n"
+    )
+    evaluate_symbols(
+        "\t",
+        process_triggered_symbols,
+        "new",
+        specific_script,
+        symbols_class,
+        symbols_types,
+    )
+    # Delegate process : Manage on control trigger.
+    specific_script.write(
+        "func process_move(control : int, pressed : bool) -> void:\n\tvar invoke : bool = false\n"
+    )
+    # Disable move control using conditions in Rules/Controlable.
+    for t in control_triggered_symbols["Controls"]:
         specific_script.write(
-            "\nfunc delegate_process() -> void:\n\tvar invoke : bool = false\n"
+            "\tif control == GlobalControls.PLAYER_CONTROL_%s:\n" % t.upper()
         )
-        evaluate_symbols(
-            "\t",
-            process_triggered_symbols,
-            "new",
-            specific_script,
-            symbols_class,
-            symbols_types,
+        press_list = (
+            control_triggered_symbols["Controls"][t]["onPress"]
+            if "onPress" in control_triggered_symbols["Controls"][t]
+            else []
         )
-        # Delegate process : Manage on control trigger.
-        specific_script.write(
-            "func process_move(control : int, pressed : bool) -> void:\n\tvar invoke : bool = false\n"
+        if len(press_list) > 0:
+            specific_script.write("\t\tif pressed:\n")
+            evaluate_symbols(
+                "\t\t\t",
+                press_list,
+                "temp",
+                specific_script,
+                symbols_class,
+                symbols_types,
+                False,
+            )
+        unpressed_list = (
+            control_triggered_symbols["Controls"][t]["onRelease"]
+            if "onRelease" in control_triggered_symbols["Controls"][t]
+            else []
         )
-        # Disable move control using conditions in Rules/Controlable.
-        for t in control_triggered_symbols["Controls"]:
-            specific_script.write(
-                "\tif control == GlobalControls.PLAYER_CONTROL_%s:\n" % t.upper()
+        if len(unpressed_list) > 0:
+            if len(press_list) > 0:
+                specific_script.write("\t\telse:\n")
+            else:
+                specific_script.write("\t\tif not pressed:\n")
+            evaluate_symbols(
+                "\t\t\t",
+                unpressed_list,
+                "temp",
+                specific_script,
+                symbols_class,
+                symbols_types,
+                False,
             )
-            press_list = (
-                control_triggered_symbols["Controls"][t]["onPress"]
-                if "onPress" in control_triggered_symbols["Controls"][t]
-                else []
+    specific_script.write("\n\n\tif invoke:\n\t\tinvoke_decision_tree()\n\n")
+    # Triggering on sequence activation
+    specific_script.write(
+        "func activate_sequence(sequence_id : int, duration : int, cooldown : int) -> bool:\n"
+    )
+    specific_script.write("\tvar invoke : bool = false\n")
+    first_seq = True
+    for seq in sequences["List"]:
+        if "Self" in seq or "Distribute" in seq or "Timers" in seq or "Signals" in seq:
+            sequence_name = "SEQUENCE_%s" % seq["Name"].upper()
+            if first_seq:
+                specific_script.write("\tif sequence_id == %s:\n" % sequence_name)
+                first_seq = False
+            else:
+                specific_script.write("\telif sequence_id == %s:\n" % sequence_name)
+        if "Timers" in seq:
+            if "Self" in seq["Timers"]:
+                trigger_timers(specific_script, 2, seq["Timers"]["Self"])
+            if "Distribute" in seq["Timers"]:
+                distribute_triggers = seq["Timers"]["Distribute"]
+                for grp in distribute_triggers:
+                    write_indent(specific_script, 2, group_others_loop(grp))
+                    trigger_timers(specific_script, 3, distribute_triggers[grp], "i.")
+            specific_script.write("\n")
+        if "Signals" in seq and len(seq["Signals"]) > 0:
+            trigger_signals(
+                2, seq["Signals"], common_signals, control_id, specific_script
             )
-            if len(press_list) > 0:
-                specific_script.write("\t\tif pressed:\n")
-                evaluate_symbols(
-                    "\t\t\t",
-                    press_list,
-                    "temp",
-                    specific_script,
-                    symbols_class,
-                    symbols_types,
-                    False,
-                )
-            unpressed_list = (
-                control_triggered_symbols["Controls"][t]["onRelease"]
-                if "onRelease" in control_triggered_symbols["Controls"][t]
-                else []
+            specific_script.write("\n")
+        if "Self" in seq:
+            symbols_to_evaluate = seq["Self"]
+            specific_script.write("\t\tinvoke = false\n")
+            evaluate_symbols(
+                "\t\t",
+                symbols_to_evaluate,
+                "new",
+                specific_script,
+                symbols_class,
+                symbols_types,
             )
-            if len(unpressed_list) > 0:
-                if len(press_list) > 0:
-                    specific_script.write("\t\telse:\n")
-                else:
-                    specific_script.write("\t\tif not pressed:\n")
+        if "Distribute" in seq:
+            for target in seq["Distribute"]:
+                symbols_to_evaluate = seq["Distribute"][target]
+                write_indent(specific_script, 2, group_others_loop(target))
+                specific_script.write("\t\t\tinvoke = false\n")
                 evaluate_symbols(
                     "\t\t\t",
-                    unpressed_list,
-                    "temp",
+                    symbols_to_evaluate,
+                    "new_dist",
                     specific_script,
                     symbols_class,
                     symbols_types,
-                    False,
+                    True,
+                    "i.",
                 )
-        specific_script.write("\n\n\tif invoke:\n\t\tinvoke_decision_tree()\n\n")
-        # Triggering on sequence activation
-        specific_script.write(
-            "func activate_sequence(sequence_id : int, duration : int, cooldown : int) -> bool:\n"
-        )
-        specific_script.write("\tvar invoke : bool = false\n")
-        first_seq = True
-        for seq in sequences["List"]:
-            if (
-                "Self" in seq
-                or "Distribute" in seq
-                or "Timers" in seq
-                or "Signals" in seq
-            ):
-                sequence_name = "SEQUENCE_%s" % seq["Name"].upper()
-                if first_seq:
-                    specific_script.write("\tif sequence_id == %s:\n" % sequence_name)
-                    first_seq = False
-                else:
-                    specific_script.write("\telif sequence_id == %s:\n" % sequence_name)
-            if "Timers" in seq:
-                if "Self" in seq["Timers"]:
-                    trigger_timers(specific_script, 2, seq["Timers"]["Self"])
-                if "Distribute" in seq["Timers"]:
-                    distribute_triggers = seq["Timers"]["Distribute"]
-                    for grp in distribute_triggers:
-                        group_name = grp.lower()
-                        write_indent(
-                            specific_script,
-                            2,
-                            'for i in get_tree().get_nodes_in_group("%s"):' % grp,
-                        )
-                        write_indent(
-                            specific_script,
-                            3,
-                            "if i == controlled_node_%s:" % group_name,
-                        )
-                        write_indent(specific_script, 4, "continue")
-                        trigger_timers(
-                            specific_script, 3, distribute_triggers[grp], "i."
-                        )
-                specific_script.write("\n")
-            if "Signals" in seq and len(seq["Signals"]) > 0:
-                trigger_signals(
-                    2, seq["Signals"], common_signals, control_id, specific_script
+    specific_script.write(
+        "\treturn delegate_sequence_activation(sequence_id, duration, cooldown)\n\n"
+    )
+    # Override "reset" function to set the symbols/variable in their "default" values.
+    specific_script.write("func reset() -> void:\n")
+    for s in symbols:
+        if not s["Type"] == "Timer":
+            # Compute default value.
+            default_value = None
+            if s["Type"] == "Control":
+                default_value = control_id[s["Default"]]
+            else:
+                default_value = s["Default"]
+            specific_script.write("\t%s_v = %s\n" % (s["Name"], default_value))
+    specific_script.write("\t.reset()\n\n")
+    # Print debug function. Print values of all symbols and state of all timers.
+    specific_script.write("func print_symbols() -> void:\n")
+    for s in symbols:
+        if s["Type"] == "Timer":
+            timer_name = "%s_TIMER" % s["Name"].upper()
+            specific_script.write(
+                '\tprint("Timer : %s is %%s" %% ("active" if timer_expire[%s] > 0 else "inactive"))\n'
+                % (s["Name"].upper(), timer_name)
+            )
+        elif s["Type"] == "Control":
+            specific_script.write(
+                (
+                    '\tprint("%s = %%s" %% '
+                    "(GlobalControls.PLAYER_CONTROLS_DESCRIPTION[%s_v - 1]"
+                    ' if %s_v > 0 else "None"))\n'
                 )
-                specific_script.write("\n")
-            if "Self" in seq:
-                symbols_to_evaluate = seq["Self"]
-                specific_script.write("\t\tinvoke = false\n")
+                % (s["Name"], s["Name"], s["Name"])
+            )
+        else:
+            specific_script.write(
+                '\tprint("%s = %%s" %% (%s_v))\n' % (s["Name"], s["Name"])
+            )
+    specific_script.write("\n")
+    # Marshall/unmarshal
+    generate_save_load(specific_script, symbols)
+    # Compute 'can_move' based on "Rules/Controlable".
+    specific_script.write("func can_move() -> bool:\n")
+    if len(can_move_conditions) == 0:
+        specific_script.write("\treturn true\n\n")
+    else:
+        # TODO Convert the value using the type and replacing the possible literals.
+        condition_tokens = [
+            "%s() == %s" % (k, str(v).lower()) for (k, v) in can_move_conditions.items()
+        ]
+        condition_string = " && ".join(condition_tokens)
+        specific_script.write("\treturn %s\n\n" % condition_string)
+    # Timer expiration
+    specific_script.write(
+        "func on_timer_expire(timer : int) -> void:\n\tvar invoke : bool = false\n"
+    )
+    if "Timers" in control_triggered_symbols:
+        timer_expirations = control_triggered_symbols["Timers"]
+        for timer in timer_expirations:
+            evaluation_group = timer_expirations[timer]
+            specific_script.write("\tif timer == %s_TIMER:\n" % timer.upper())
+            if len(evaluation_group) == 0:
+                specific_script.write("\t\tinvoke = true\n\n")
+            else:
                 evaluate_symbols(
                     "\t\t",
-                    symbols_to_evaluate,
-                    "new",
+                    evaluation_group,
+                    "temp",
                     specific_script,
                     symbols_class,
                     symbols_types,
+                    False,
                 )
-            if "Distribute" in seq:
-                for target in seq["Distribute"]:
-                    symbols_to_evaluate = seq["Distribute"][target]
-                    specific_script.write(
-                        '\t\tfor i in get_tree().get_nodes_in_group("%s"):\n' % target
-                    )
-                    specific_script.write(
-                        "\t\t\tif i == controlled_node_%s:\n\t\t\t\tcontinue\n\t\t\tinvoke = false\n"
-                        % (target.lower())
-                    )
-                    evaluate_symbols(
-                        "\t\t\t",
-                        symbols_to_evaluate,
-                        "new_dist",
-                        specific_script,
-                        symbols_class,
-                        symbols_types,
-                        True,
-                        "i.",
-                    )
+        specific_script.write("\n\tif invoke:\n\t\tinvoke_decision_tree()\n\n")
+    specific_script.write("\ton_timer_delegate(timer)\n\n")
+    # Finish with filled-by-user functions.
+    specific_script.write("func on_timer_delegate(timer : int) -> void:\n\tpass\n\n")
+    specific_script.write(
+        "func delegate_sequence_activation(sequence_id : int, duration : int, cooldown : int) -> bool:\n"
+    )
+    specific_script.write("\treturn false\n\n")
+    specific_script.write("func trigger(event : int) -> void:\n\tpass\n\n")
+    # All the evaluation and setting functions.
+    for s in symbols:
         specific_script.write(
-            "\treturn delegate_sequence_activation(sequence_id, duration, cooldown)\n\n"
+            "func evaluate_%s() -> %s:\n"
+            % (s["Name"], symbols_class[s["Name"]].__name__)
         )
-        # Override "reset" function to set the symbols/variable in their "default" values.
-        specific_script.write("func reset() -> void:\n")
-        for s in symbols:
-            if not s["Type"] == "Timer":
-                # Compute default value.
-                default_value = None
-                if s["Type"] == "Control":
-                    default_value = control_id[s["Default"]]
-                else:
-                    default_value = s["Default"]
-                specific_script.write("\t%s_v = %s\n" % (s["Name"], default_value))
-        specific_script.write("\t.reset()\n\n")
-        # Print debug function. Print values of all symbols and state of all timers.
-        specific_script.write("func print_symbols() -> void:\n")
-        for s in symbols:
-            if s["Type"] == "Timer":
-                timer_name = 'TIMERS_IDENTIFIER["%s"]' % s["Name"].upper()
-                specific_script.write(
-                    '\tprint("Timer : %s is %%s" %% ("active" if timer_expire[%s] > 0 else "inactive"))\n'
-                    % (s["Name"].upper(), timer_name)
-                )
-            elif s["Type"] == "Control":
-                specific_script.write(
-                    (
-                        '\tprint("%s = %%s" %% '
-                        "(GlobalControls.PLAYER_CONTROLS_DESCRIPTION[%s_v - 1]"
-                        ' if %s_v > 0 else "None"))\n'
-                    )
-                    % (s["Name"], s["Name"], s["Name"])
-                )
-            else:
-                specific_script.write(
-                    '\tprint("%s = %%s" %% (%s_v))\n' % (s["Name"], s["Name"])
-                )
-        specific_script.write("\n")
-        # Marshall/unmarshal
-        generate_save_load(specific_script, symbols)
-        # Compute 'can_move' based on "Rules/Controlable".
-        specific_script.write("func can_move() -> bool:\n")
-        if len(can_move_conditions) == 0:
-            specific_script.write("\treturn true\n\n")
+        if s["Name"] in default_evaluations:
+            write_code(specific_script, 1, default_evaluations[s["Name"]])
+            specific_script.write("\n")
         else:
-            # TODO Convert the value using the type and replacing the possible literals.
-            condition_tokens = [
-                "%s() == %s" % (k, str(v).lower())
-                for (k, v) in can_move_conditions.items()
-            ]
-            condition_string = " && ".join(condition_tokens)
-            specific_script.write("\treturn %s\n\n" % condition_string)
-        # Timer expiration
-        specific_script.write(
-            "func on_timer_expire(timer : int) -> void:\n\tvar invoke : bool = false\n"
-        )
-        if "Timers" in control_triggered_symbols:
-            timer_expirations = control_triggered_symbols["Timers"]
-            for timer in timer_expirations:
-                evaluation_group = timer_expirations[timer]
-                specific_script.write(
-                    '\tif timer == TIMERS_IDENTIFIER["%s"]:\n' % timer.upper()
-                )
-                if len(evaluation_group) == 0:
-                    specific_script.write("\t\tinvoke = true\n\n")
-                else:
-                    evaluate_symbols(
-                        "\t\t",
-                        evaluation_group,
-                        "temp",
-                        specific_script,
-                        symbols_class,
-                        symbols_types,
-                        False,
-                    )
-            specific_script.write("\n\tif invoke:\n\t\tinvoke_decision_tree()\n\n")
-        specific_script.write("\ton_timer_delegate(timer)\n\n")
-        # Finish with filled-by-user functions.
-        specific_script.write(
-            "func on_timer_delegate(timer : int) -> void:\n\tpass\n\n"
-        )
-        specific_script.write(
-            "func delegate_sequence_activation(sequence_id : int, duration : int, cooldown : int) -> bool:\n"
-        )
-        specific_script.write("\treturn false\n\n")
-        specific_script.write("func trigger(event : int) -> void:\n\tpass\n\n")
-        # All the evaluation and setting functions.
-        for s in symbols:
+            if symbols_class[s["Name"]] == bool:
+                specific_script.write("\treturn false\n\n")
+            else:
+                specific_script.write("\treturn 0\n\n")
+
+        if symbols_types[s["Name"]] != "Timer":
             specific_script.write(
-                "func evaluate_%s() -> %s:\n"
+                "func set_%s(var arg : %s) -> void:\n"
                 % (s["Name"], symbols_class[s["Name"]].__name__)
             )
-            if s["Name"] in default_evaluations:
-                write_code(specific_script, 1, default_evaluations[s["Name"]])
-                specific_script.write("\n")
-            else:
-                if symbols_class[s["Name"]] == bool:
-                    specific_script.write("\treturn false\n\n")
-                else:
-                    specific_script.write("\treturn 0\n\n")
-
-            if symbols_types[s["Name"]] != "Timer":
-                specific_script.write(
-                    "func set_%s(var arg : %s) -> void:\n"
-                    % (s["Name"], symbols_class[s["Name"]].__name__)
-                )
-                specific_script.write(
-                    "\tif arg != %s_v:\n\t\t%s_v = arg\n\t\tinvoke_decision_tree()\n\n"
-                    % (s["Name"], s["Name"])
-                )
-        specific_script.close()
+            specific_script.write(
+                "\tif arg != %s_v:\n\t\t%s_v = arg\n\t\tinvoke_decision_tree()\n\n"
+                % (s["Name"], s["Name"])
+            )
+    artifacts[script_path] = specific_script.getvalue()
+
+    return {
+        "Name": config_name,
+        "States": states,
+        "PreComputed": pre_computed,
+        "Matcher": matcher,
+        "Decision": decision,
+        "Artifacts": artifacts,
+    }
 
 
 def write_code(script_file, level, lines):
@@ -1628,24 +3039,483 @@ def write_code(script_file, level, lines):
             print("!! Invalid kind of script %s" % (str(type(statement))))
 
 
-def generate_main_constants(controls, common_symbols, output_directory):
-    with open(
-        "%s/global_controls.gd" % output_directory, "w"
-    ) as global_constants_singleton:
+# Registry of the group members, appended to 'global_controls.gd'.
+# Godot doesn't notify the group changes : the members are read again from the scene tree at
+# most once per frame, on the first query, so that nodes joining a group once in the tree
+# ('add_to_group' in '_ready') or leaving it ('remove_from_group') are seen without any explicit
+# registration. A node leaving the tree is dropped at once, it may be freed. The other members
+# of a group, seen from a controller, are computed once per membership change instead of on
+# each effect.
+GROUP_REGISTRY_SCRIPT = """
+# Members of each group.
+var group_members : Dictionary = {}
+
+# For each group, the members except a given node, indexed by this node. Reset when the group
+# membership changes.
+var group_others : Dictionary = {}
+
+# Frame at which the members of each group have been read.
+var group_frame : Dictionary = {}
+
+func _ready() -> void:
+	for g in CONTROL_GROUPS:
+		group_members[g] = get_tree().get_nodes_in_group(g)
+		group_others[g] = {}
+		group_frame[g] = current_frame()
+	get_tree().connect("node_removed", self, "_on_node_removed")
+
+func current_frame() -> Array:
+	return [Engine.get_idle_frames(), Engine.get_physics_frames()]
+
+# The node may be freed : it is neither a member nor an excluded node anymore.
+func _on_node_removed(node : Node) -> void:
+	for g in CONTROL_GROUPS:
+		if node in group_members[g]:
+			group_members[g].erase(node)
+			group_others[g] = {}
+		else:
+			group_others[g].erase(node)
+
+# Read the members of the group again, once per frame.
+func update_group(group : String) -> void:
+	var frame : Array = current_frame()
+	if group_frame[group] == frame:
+		return
+	group_frame[group] = frame
+	var members : Array = get_tree().get_nodes_in_group(group)
+	if members != group_members[group]:
+		group_members[group] = members
+		group_others[group] = {}
+
+# Members of the group, except 'excluded'.
+func get_group_others(group : String, excluded : Object) -> Array:
+	update_group(group)
+	var others : Dictionary = group_others[group]
+	if not others.has(excluded):
+		var members : Array = []
+		for m in group_members[group]:
+			if m != excluded:
+				members.append(m)
+		others[excluded] = members
+	return others[excluded]
+"""
+
+
+def global_constants_script(controls, common_groups):
+    global_constants_singleton = io.StringIO()
+    global_constants_singleton.write(
+        "# Global constants for player controls identification\nextends Node\n\n"
+    )
+    for c in range(len(controls)):
         global_constants_singleton.write(
-            "# Global constants for player controls identification\nextends Node\n\n"
+            "const PLAYER_CONTROL_%s : int = %d\n" % (controls[c].upper(), c + 1)
         )
-        for c in range(len(controls)):
-            global_constants_singleton.write(
-                "const PLAYER_CONTROL_%s : int = %d\n" % (controls[c].upper(), c + 1)
-            )
-        global_constants_singleton.write(
-            "const PLAYER_CONTROLS_DESCRIPTION : Array = [ "
+    global_constants_singleton.write("const PLAYER_CONTROLS_DESCRIPTION : Array = [ ")
+    description = ",".join(map(lambda s: '"%s"' % s.upper(), controls))
+    global_constants_singleton.write(description)
+    global_constants_singleton.write(" ]\n")
+    global_constants_singleton.write(
+        "const CONTROL_GROUPS : Array = [ %s ]\n"
+        % ",".join(map(lambda g: '"%s"' % g, common_groups))
+    )
+    global_constants_singleton.write(GROUP_REGISTRY_SCRIPT)
+    return global_constants_singleton.getvalue()
+
+
+def generate_main_constants(controls, common_groups, output_directory):
+    write_artifacts(
+        output_directory,
+        {"global_controls.gd": global_constants_script(controls, common_groups)},
+    )
+
+
+# Library API
+# The generation can run in process, on parsed configurations, without writing anything : the
+# command line is a wrapper writing the artifacts of 'generate_specific_content'. Errors are
+# raised as 'GenerationError' exceptions. The progress is printed on the standard output, as for
+# the command line.
+
+
+# Generate the artifacts shared by the specific configurations. Return the content of each
+# artifact, indexed by its path relative to the output directory.
+def generate_global(global_configuration):
+    controls, _, _, common_groups, _, _ = read_global_configuration(
+        global_configuration
+    )
+    return {"global_controls.gd": global_constants_script(controls, common_groups)}
+
+
+# Generate the artifacts of a specific configuration. The 'options' missing entries take their
+# 'default_options()' value. Return the result of 'generate_specific_content'.
+# The generation alters the configurations it reads, it works on copies so that the caller
+# can generate them again.
+def generate_configuration(
+    global_configuration, specific_configuration, generate_debug=False, options=None
+):
+    complete_options = default_options()
+    if options is not None:
+        complete_options.update(options)
+    return generate_specific_content(
+        copy.deepcopy(specific_configuration),
+        *read_global_configuration(copy.deepcopy(global_configuration)),
+        generate_debug,
+        complete_options,
+    )
+
+
+# Build cache
+# Each entry is a directory named after the cache key. It holds a copy of the artifacts
+# produced by 'generate_specific' (with their path relative to the output directory) and a
+# manifest listing them. The entry modification date is used for LRU eviction.
+
+
+def generator_fingerprint():
+    with open(os.path.abspath(__file__), "rb") as generator_source:
+        source_hash = hashlib.sha256(generator_source.read()).hexdigest()
+    return "%s-%s" % (GENERATOR_VERSION, source_hash)
+
+
+def compute_cache_key(global_filepath, specific_filepath, generate_debug, options):
+    key = hashlib.sha256()
+    key.update(generator_fingerprint().encode("utf-8"))
+    for filepath in [global_filepath, specific_filepath]:
+        with open(filepath, "rb") as config_file:
+            key.update(hashlib.sha256(config_file.read()).digest())
+    key.update(json.dumps([generate_debug, options], sort_keys=True).encode("utf-8"))
+    return key.hexdigest()
+
+
+def restore_from_cache(cache_directory, key, output_directory):
+    entry = os.path.join(cache_directory, key)
+    manifest_path = os.path.join(entry, "manifest.json")
+    if not os.path.isfile(manifest_path):
+        return False
+    with open(manifest_path, "r") as manifest_file:
+        artifacts = json.load(manifest_file)
+    for a in artifacts:
+        if not os.path.isfile(os.path.join(entry, a)):
+            log_verbose("## Incomplete cache entry %s" % key)
+            return False
+    try:
+        for a in artifacts:
+            shutil.copyfile(os.path.join(entry, a), os.path.join(output_directory, a))
+        # Mark the entry as recently used.
+        os.utime(entry)
+    except OSError as error:
+        # The entry may be evicted by a concurrent generation.
+        log_verbose("## Unable to restore cache entry %s (%s)" % (key, error))
+        return False
+    return True
+
+
+def store_in_cache(cache_directory, key, output_directory, artifacts):
+    entry = os.path.join(cache_directory, key)
+    for a in artifacts:
+        os.makedirs(os.path.dirname(os.path.join(entry, a)), exist_ok=True)
+        shutil.copyfile(os.path.join(output_directory, a), os.path.join(entry, a))
+    # The manifest is written last. An entry without manifest is ignored.
+    with open(os.path.join(entry, "manifest.json"), "w") as manifest_file:
+        json.dump(artifacts, manifest_file)
+
+
+def directory_size(path):
+    size = 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            try:
+                size += os.path.getsize(os.path.join(root, f))
+            except OSError:
+                continue
+    return size
+
+
+# Remove the least recently used entries until the cache fits in 'max_size' megabytes.
+def evict_cache(cache_directory, max_size):
+    entries = []
+    total_size = 0
+    for key in os.listdir(cache_directory):
+        entry = os.path.join(cache_directory, key)
+        if not os.path.isdir(entry):
+            continue
+        try:
+            date = os.path.getmtime(entry)
+        except OSError:
+            continue
+        size = directory_size(entry)
+        entries.append((date, size, entry))
+        total_size += size
+    entries.sort()
+    limit = max_size * 1024 * 1024
+    for _, size, entry in entries:
+        if total_size <= limit:
+            break
+        log_verbose("## Evict cache entry %s" % entry)
+        shutil.rmtree(entry, ignore_errors=True)
+        total_size -= size
+
+
+def generate_specific_cached(
+    global_filepath,
+    config_filepath,
+    controls,
+    common_symbols,
+    common_signals,
+    common_groups,
+    common_defaults,
+    common_variables,
+    generate_debug,
+    output_directory,
+    options,
+    cache_directory,
+    cache_size,
+):
+    if cache_directory is not None:
+        key = compute_cache_key(
+            global_filepath, config_filepath, generate_debug, options
+        )
+        if restore_from_cache(cache_directory, key, output_directory):
+            print("Cache hit for '%s' (%s)" % (config_filepath, key[:12]))
+            return
+    profiler = None
+    if options["Profile"]:
+        start_profile()
+        if options["ProfileDirectory"] is not None:
+            profiler = cProfile.Profile()
+            profiler.enable()
+    try:
+        artifacts = generate_specific(
+            config_filepath,
+            controls,
+            common_symbols,
+            common_signals,
+            common_groups,
+            common_defaults,
+            common_variables,
+            generate_debug,
+            output_directory,
+            options,
         )
-        description = ",".join(map(lambda s: '"%s"' % s.upper(), controls))
-        global_constants_singleton.write(description)
-        global_constants_singleton.write(" ]\n")
-        global_constants_singleton.close()
+    finally:
+        # A failing generation must not leave the profiling active for the next one.
+        if options["Profile"]:
+            if profiler is not None:
+                profiler.disable()
+            records = stop_profile()
+    if options["Profile"]:
+        report_profile(config_filepath, records, profiler, options["ProfileDirectory"])
+    if cache_directory is not None:
+        store_in_cache(cache_directory, key, output_directory, artifacts)
+        evict_cache(cache_directory, cache_size)
+
+
+# Parallel generation
+# Each specific configuration is generated by a worker process. The console output of a worker
+# is captured so that it can be printed as a whole, in the order of the configurations.
+
+
+def initialize_worker(verbose_mode):
+    global VERBOSE_MODE
+    VERBOSE_MODE = verbose_mode
+
+
+# Return the configuration path, the captured output and the exit status (0 on success).
+def run_specific_job(job):
+    filepath = job[1]
+    output = io.StringIO()
+    status = 0
+    with contextlib.redirect_stdout(output):
+        print("Read '%s'" % filepath)
+        try:
+            generate_specific_cached(*job)
+        except GenerationError as error:
+            print("!!! %s !!!" % error)
+            status = error.status
+        except SystemExit as error:
+            if isinstance(error.code, int):
+                status = error.code
+            elif error.code is not None:
+                print(error.code)
+                status = 1
+        except Exception:
+            traceback.print_exc(file=output)
+            status = 1
+    return (filepath, output.getvalue(), status)
+
+
+# Generate all the jobs on 'job_count' processes. Exit with the status of the first failing
+# configuration (in the command line order), once every configuration has been processed.
+def run_parallel_jobs(jobs, job_count):
+    failure = None
+    with multiprocessing.Pool(
+        processes=job_count, initializer=initialize_worker, initargs=(VERBOSE_MODE,)
+    ) as pool:
+        for filepath, output, status in pool.imap(run_specific_job, jobs):
+            sys.stdout.write(output)
+            sys.stdout.flush()
+            if status != 0:
+                print(
+                    "!!! Generation failed for '%s' (status %d) !!!"
+                    % (filepath, status)
+                )
+                if failure is None:
+                    failure = status
+    if failure is not None:
+        sys.exit(failure)
+
+
+# Return the controls, symbols, signals, groups, default evaluations and variables of the
+# parsed global configuration, shared by the specific configurations.
+def read_global_configuration(configuration):
+    common_defaults = {}
+    common_variables = {}
+    try:
+        controls = configuration["Controls"]
+        common_symbols = configuration["Symbols"]
+        common_signals = configuration["Signals"]
+        common_groups = configuration["Groups"]
+    except KeyError as error:
+        raise ConfigurationError("The global configuration has no %s entry" % error)
+    if "Variables" in configuration:
+        common_variables = configuration["Variables"]
+    if "Defaults" in configuration:
+        common_defaults = configuration["Defaults"]
+    return (
+        controls,
+        common_symbols,
+        common_signals,
+        common_groups,
+        common_defaults,
+        common_variables,
+    )
+
+
+def load_global_configuration(global_filepath):
+    with open(global_filepath, "r") as config_file:
+        return read_global_configuration(json.load(config_file))
+
+
+def list_project_configurations(project_directory):
+    return [
+        os.path.join(project_directory, fl)
+        for fl in sorted(
+            filter(lambda x: x.endswith(".json"), os.listdir(project_directory))
+        )
+    ]
+
+
+# Watch mode
+# The generator stays alive and polls the modification date of the configurations. The global
+# configuration is only parsed again when it changes, and only the changed specific
+# configurations are generated again (all of them when the global configuration changes). A
+# change is handled once the files have been left untouched for WATCH_DEBOUNCE seconds, so that
+# an editor saving in several steps triggers a single generation. A failing configuration is
+# reported and the watch goes on.
+WATCH_INTERVAL = 0.2  # seconds
+WATCH_DEBOUNCE = 0.5  # seconds
+
+
+# Modification date of a file, None if it doesn't exist.
+def modification_date(filepath):
+    try:
+        return os.stat(filepath).st_mtime_ns
+    except OSError:
+        return None
+
+
+# Generate the jobs in the current process, with the duration of each one.
+def regenerate_configurations(jobs):
+    start = time.perf_counter()
+    for job in jobs:
+        job_start = time.perf_counter()
+        filepath, output, status = run_specific_job(job)
+        sys.stdout.write(output)
+        if status != 0:
+            print("!!! Generation failed for '%s' (status %d) !!!" % (filepath, status))
+            continue
+        print(
+            "## '%s' generated in %.1f ms"
+            % (filepath, (time.perf_counter() - job_start) * 1000)
+        )
+    print(
+        "## %d configuration(s) processed in %.1f ms"
+        % (len(jobs), (time.perf_counter() - start) * 1000)
+    )
+    sys.stdout.flush()
+
+
+def watch_configurations(
+    global_filepath,
+    specific_filepaths,
+    project_directory,
+    generate_debug,
+    output_directory,
+    options,
+    cache_directory,
+    cache_size,
+):
+    common = None
+    dates = {}
+    changed = set()
+    last_change = 0.0
+    print("## Watching the configurations (Ctrl+C to stop)")
+    try:
+        while True:
+            # New configurations of the project directory are picked up.
+            if project_directory is not None:
+                specific_filepaths = [
+                    f
+                    for f in list_project_configurations(project_directory)
+                    if f != global_filepath
+                ]
+            watched = [global_filepath] + specific_filepaths
+            for filepath in list(dates.keys()):
+                if filepath not in watched:
+                    del dates[filepath]
+                    changed.discard(filepath)
+            for filepath in watched:
+                date = modification_date(filepath)
+                if filepath not in dates or dates[filepath] != date:
+                    dates[filepath] = date
+                    changed.add(filepath)
+                    last_change = time.monotonic()
+
+            if len(changed) == 0 or time.monotonic() - last_change < WATCH_DEBOUNCE:
+                time.sleep(WATCH_INTERVAL)
+                continue
+
+            targets = [f for f in specific_filepaths if f in changed]
+            if global_filepath in changed:
+                try:
+                    common = load_global_configuration(global_filepath)
+                    generate_main_constants(common[0], common[3], output_directory)
+                    targets = specific_filepaths
+                except (OSError, ValueError, GenerationError) as error:
+                    print(
+                        "!!! Can't read the global configuration '%s' !!!"
+                        % global_filepath
+                    )
+                    print(error)
+                    common = None
+            changed.clear()
+            # The specific configurations wait for a valid global configuration.
+            if common is not None and len(targets) > 0:
+                print("## Changed : %s" % targets)
+                regenerate_configurations(
+                    [
+                        (global_filepath, filepath)
+                        + common
+                        + (
+                            generate_debug,
+                            output_directory,
+                            options,
+                            cache_directory,
+                            cache_size,
+                        )
+                        for filepath in targets
+                    ]
+                )
+    except KeyboardInterrupt:
+        print("## Watch stopped")
 
 
 # Main
@@ -1657,16 +3527,46 @@ def main():
     specific_filepaths = []
     generate_debug = False
     output_directory = "build"
+    use_cache = True
+    cache_size = DEFAULT_CACHE_SIZE
+    job_count = 1
+    project_directory = None
+    watch = False
+    options = default_options()
 
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "vdg:s:P:o:")
+        opts, args = getopt.getopt(
+            sys.argv[1:],
+            "vdg:s:P:o:j:",
+            [
+                "no-cache",
+                "cache-size=",
+                "minimize",
+                "sequence-matcher",
+                "coalesce",
+                "binary",
+                "release",
+                "strategy=",
+                "engine=",
+                "profile",
+                "profile-report=",
+                "watch",
+            ],
+        )
     except getopt.GetoptError:
         print(
             (
                 "%s -d -g [path_to_global_conf.json] "
                 "-s [path_to_first_specific.json] "
                 "-s ... -P [path_to_project_directory] "
-                "-o [output_directory]"
+                "-o [output_directory] "
+                "-j [job_count] "
+                "--no-cache --cache-size [megabytes] "
+                "--minimize --sequence-matcher --coalesce --binary --release "
+                "--strategy [count|entropy] "
+                "--engine [tree|mdd|table] "
+                "--profile --profile-report [directory] "
+                "--watch"
             )
             % sys.argv[0]
         )
@@ -1677,10 +3577,8 @@ def main():
         elif opt == "-s":
             specific_filepaths.append(arg)
         elif opt == "-P":
-            specific_filepaths = [
-                os.path.join(arg, fl)
-                for fl in filter(lambda x: x.endswith(".json"), os.listdir(arg))
-            ]
+            project_directory = arg
+            specific_filepaths = list_project_configurations(arg)
         elif opt == "-v":
             print("## Activate Verbose Mode")
             VERBOSE_MODE = True
@@ -1688,6 +3586,49 @@ def main():
             output_directory = arg
         elif opt == "-d":
             generate_debug = True
+        elif opt == "--no-cache":
+            use_cache = False
+        elif opt == "--cache-size":
+            try:
+                cache_size = int(arg)
+            except ValueError:
+                print("!!! Invalid cache size '%s' !!!" % arg)
+                sys.exit(1)
+        elif opt == "--minimize":
+            options["Minimize"] = True
+        elif opt == "--sequence-matcher":
+            options["SequenceMatcher"] = True
+        elif opt == "--coalesce":
+            options["Coalesce"] = True
+        elif opt == "--binary":
+            options["Binary"] = True
+        elif opt == "--release":
+            options["Release"] = True
+        elif opt == "--strategy":
+            if arg not in ["count", "entropy"]:
+                print("!!! Unknown decision tree strategy '%s' !!!" % arg)
+                sys.exit(1)
+            options["Strategy"] = arg
+        elif opt == "--engine":
+            if arg not in ["tree", "mdd", "table"]:
+                print("!!! Unknown decision engine '%s' !!!" % arg)
+                sys.exit(1)
+            options["Engine"] = arg
+        elif opt == "--profile":
+            options["Profile"] = True
+        elif opt == "--profile-report":
+            options["Profile"] = True
+            options["ProfileDirectory"] = arg
+        elif opt == "--watch":
+            watch = True
+        elif opt == "-j":
+            try:
+                job_count = int(arg)
+            except ValueError:
+                job_count = 0
+            if job_count < 1:
+                print("!!! Invalid job count '%s' !!!" % arg)
+                sys.exit(1)
 
     try:
         os.mkdir(output_directory)
@@ -1697,6 +3638,14 @@ def main():
             print(error)
             sys.exit(1)
 
+    if options["ProfileDirectory"] is not None:
+        try:
+            os.makedirs(options["ProfileDirectory"], exist_ok=True)
+        except OSError as error:
+            print("!!! Can't create profile folder !!!")
+            print(error)
+            sys.exit(1)
+
     if generate_debug:
         try:
             os.mkdir("%s/debug" % (output_directory))
@@ -1712,40 +3661,56 @@ def main():
     print("Specific Filepaths = '%s'" % specific_filepaths)
     print("Output directory : %s" % output_directory)
 
-    controls = []
-    common_symbols = []
-    common_signals = {}
-    common_groups = []
-    common_defaults = {}
-    common_variables = {}
-
-    with open(global_filepath, "r") as config_file:
-        configuration = json.load(config_file)
-        config_file.close()
-        controls = configuration["Controls"]
-        common_symbols = configuration["Symbols"]
-        common_signals = configuration["Signals"]
-        common_groups = configuration["Groups"]
-        if "Variables" in configuration:
-            common_variables = configuration["Variables"]
-        if "Defaults" in configuration:
-            common_defaults = configuration["Defaults"]
-
-    generate_main_constants(controls, common_symbols, output_directory)
+    cache_directory = None
+    if use_cache and options["Profile"]:
+        # A configuration restored from the cache would not be profiled.
+        print("## Profiling disables the cache")
+        use_cache = False
+    if use_cache:
+        cache_directory = "%s/.cache" % (output_directory)
+        try:
+            os.makedirs(cache_directory, exist_ok=True)
+        except OSError as error:
+            print("!!! Can't create cache folder. Cache disabled !!!")
+            print(error)
+            cache_directory = None
 
-    for filepath in specific_filepaths:
-        print("Read '%s'" % filepath)
-        generate_specific(
-            filepath,
-            controls,
-            common_symbols,
-            common_signals,
-            common_groups,
-            common_defaults,
-            common_variables,
+    if watch:
+        watch_configurations(
+            global_filepath,
+            specific_filepaths,
+            project_directory,
             generate_debug,
             output_directory,
+            options,
+            cache_directory,
+            cache_size,
         )
+        return
+
+    try:
+        common = load_global_configuration(global_filepath)
+    except GenerationError as error:
+        print("!!! %s !!!" % error)
+        sys.exit(error.status)
+    generate_main_constants(common[0], common[3], output_directory)
+
+    jobs = [
+        (global_filepath, filepath)
+        + common
+        + (generate_debug, output_directory, options, cache_directory, cache_size)
+        for filepath in specific_filepaths
+    ]
+    if job_count > 1 and len(jobs) > 1:
+        run_parallel_jobs(jobs, min(job_count, len(jobs)))
+    else:
+        for job in jobs:
+            print("Read '%s'" % job[1])
+            try:
+                generate_specific_cached(*job)
+            except GenerationError as error:
+                print("!!! %s !!!" % error)
+                sys.exit(error.status)
 
 
 if __name__ == "__main__":
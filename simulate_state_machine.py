@@ -0,0 +1,392 @@
+#!/bin/python3
+
+# Batch simulator for the pre-computed state machine ({name}_fsm_pc.json).
+# Replays many input traces in lockstep and reports the fired sequences. The semantics follow
+# 'set_move', 'break_sequence' and '_process' from control_fsm.gd, with 'can_move()' always
+# true and no control filtering.
+
+import sys
+import json
+import getopt
+
+import numpy as np
+
+# Version of the binary descriptor layout, see 'BINARY_DESCRIPTOR_VERSION' in generate.py.
+BINARY_DESCRIPTOR_VERSION = 1
+
+
+# Load the packed binary descriptor (see 'pack_descriptor' in generate.py).
+def load_binary_state_machine(filepath):
+    with open(filepath, "rb") as source:
+        content = source.read()
+    if content[:4] != b"CFSM":
+        print("!!! '%s' is not a binary descriptor !!!" % filepath)
+        sys.exit(1)
+    values = np.frombuffer(content, dtype="<i4", offset=4)
+    version, start, control_count, sequence_timeout = values[0:4]
+    state_count, sequence_count, infer_count = values[4:7]
+    if version != BINARY_DESCRIPTOR_VERSION:
+        print("!!! Unsupported binary descriptor version %d !!!" % version)
+        sys.exit(1)
+    cursor = 7
+
+    def take(count):
+        nonlocal cursor
+        cursor += count
+        return values[cursor - count:cursor]
+
+    duration = take(sequence_count).astype(np.int64)
+    cooldown = take(sequence_count).astype(np.int64)
+    infer_offsets = take(sequence_count + 1)
+    infer_ids = take(infer_count)
+    infer = np.zeros((sequence_count, sequence_count), dtype=bool)
+    for q in range(sequence_count):
+        infer[q, infer_ids[infer_offsets[q]:infer_offsets[q + 1]]] = True
+    shape = (state_count, control_count + 1)
+    access = take(state_count * (control_count + 1)).reshape(shape).astype(np.int32)
+    pressed = take(state_count * (control_count + 1)).reshape(shape) != 0
+    fire = take(state_count * (control_count + 1)).reshape(shape).astype(np.int32)
+    take(state_count * (control_count + 1))  # Freeze, not needed.
+    timer_reset = take(state_count * (control_count + 1)).reshape(shape) != 0
+    timeout_route = take(state_count).astype(np.int32)
+    blocked = take(state_count * (control_count + 1)).reshape(shape) != 0
+    group_count = take(1)[0]
+    starts = take(group_count).astype(np.int32)
+    control_group = take(control_count + 1).astype(np.int32)
+    matcher_goto = None
+    matcher_fire = None
+    matcher_freeze = None
+    node_count = take(1)[0]
+    if node_count > 0:
+        matcher_goto = take(node_count * (control_count + 1))
+        matcher_goto = matcher_goto.reshape((node_count, control_count + 1))
+        matcher_fire = take(node_count).astype(np.int32)
+        matcher_freeze = take(node_count) != 0
+    return {
+        "Starts": starts,
+        "ControlGroup": control_group,
+        "MatcherGoto": matcher_goto,
+        "MatcherFire": matcher_fire,
+        "MatcherFreeze": matcher_freeze,
+        "SequenceTimeout": int(sequence_timeout),
+        "Access": access,
+        "Pressed": pressed,
+        "Fire": fire,
+        "TimerReset": timer_reset,
+        "TimeoutRoute": timeout_route,
+        "Blocked": blocked,
+        "Duration": duration,
+        "Cooldown": cooldown,
+        "Infer": infer,
+    }
+
+
+# Load the pre-computed description into dense arrays.
+# Every state has a slot per control identifier (0 is the "no control" identifier). Missing
+# transitions keep the default values used by 'BaseCharacterController.init_states()'.
+def load_state_machine(filepath):
+    if filepath.endswith(".bin"):
+        return load_binary_state_machine(filepath)
+    with open(filepath, "r") as source:
+        content = json.load(source)
+    control_count = content["ControlCount"]
+    transitions = content["Transitions"]
+    state_count = len(transitions)
+    sequences = content["Sequences"]
+    sequence_count = len(sequences)
+
+    access = np.zeros((state_count, control_count + 1), dtype=np.int32)
+    pressed = np.zeros((state_count, control_count + 1), dtype=bool)
+    fire = np.full((state_count, control_count + 1), -1, dtype=np.int32)
+    timer_reset = np.zeros((state_count, control_count + 1), dtype=bool)
+    timeout_route = np.zeros(state_count, dtype=np.int32)
+    blocked = np.zeros((state_count, control_count + 1), dtype=bool)
+    starts = np.array([content["Start"]], dtype=np.int32)
+    control_group = np.zeros(control_count + 1, dtype=np.int32)
+    if "Groups" in content:
+        starts = np.array([g["Start"] for g in content["Groups"]], dtype=np.int32)
+        for g in range(len(content["Groups"])):
+            control_group[content["Groups"][g]["Controls"]] = g
+    for s in range(state_count):
+        for t in transitions[s]:
+            if "Name" in t:
+                continue
+            if "Control" in t:
+                control = t["Control"]
+                access[s, control] = t["Target"]
+                pressed[s, control] = t.get("Pressed", False)
+                if "Fire" in t:
+                    fire[s, control] = t["Fire"]
+                if "Timer" in t:
+                    timer_reset[s, control] = True
+                if "Blocked" in t:
+                    blocked[s, control] = t["Blocked"]
+            if "Timeout" in t:
+                timeout_route[s] = t["Target"]
+
+    # Sequence matcher : the failure links are resolved in breadth first order.
+    matcher_goto = None
+    matcher_fire = None
+    matcher_freeze = None
+    if "Matcher" in content:
+        nodes = content["Matcher"]
+        matcher_goto = np.zeros((len(nodes), control_count + 1), dtype=np.int32)
+        matcher_fire = np.full(len(nodes), -1, dtype=np.int32)
+        matcher_freeze = np.zeros(len(nodes), dtype=bool)
+        for n in range(len(nodes)):
+            if n != 0:
+                matcher_goto[n] = matcher_goto[nodes[n]["Fail"]]
+            for c, target in nodes[n]["Edges"]:
+                matcher_goto[n, c] = target
+            matcher_fire[n] = nodes[n].get("Fire", -1)
+            matcher_freeze[n] = "Freeze" in nodes[n]
+
+    duration = np.array([q["Duration"] for q in sequences], dtype=np.int64)
+    cooldown = np.array([q["Cooldown"] for q in sequences], dtype=np.int64)
+    infer = np.zeros((sequence_count, sequence_count), dtype=bool)
+    for q in range(sequence_count):
+        if "Infer" in sequences[q]:
+            infer[q, sequences[q]["Infer"]] = True
+
+    return {
+        "Starts": starts,
+        "ControlGroup": control_group,
+        "MatcherGoto": matcher_goto,
+        "MatcherFire": matcher_fire,
+        "MatcherFreeze": matcher_freeze,
+        "SequenceTimeout": content["SequenceTimeout"],
+        "Access": access,
+        "Pressed": pressed,
+        "Fire": fire,
+        "TimerReset": timer_reset,
+        "TimeoutRoute": timeout_route,
+        "Blocked": blocked,
+        "Duration": duration,
+        "Cooldown": cooldown,
+        "Infer": infer,
+    }
+
+
+# Create the simulation context of 'trace_count' controllers, all in the start state.
+# Each control group has its own state, sequence matcher node and sequence timer.
+def create_context(state_machine, trace_count):
+    sequence_count = len(state_machine["Duration"])
+    group_count = len(state_machine["Starts"])
+    return {
+        "Time": np.zeros(trace_count, dtype=np.int64),
+        "State": np.tile(state_machine["Starts"], (trace_count, 1)),
+        "Node": np.zeros((trace_count, group_count), dtype=np.int32),
+        # Timer expiration dates. -1 if the timer is not in use.
+        "SequenceTimer": np.full((trace_count, group_count), -1, dtype=np.int64),
+        "DurationTimer": np.full((trace_count, sequence_count), -1, dtype=np.int64),
+        "CooldownTimer": np.full((trace_count, sequence_count), -1, dtype=np.int64),
+        "FireCount": np.zeros((trace_count, sequence_count), dtype=np.int64),
+    }
+
+
+# Advance every trace by one step.
+# control : control identifier per trace. 0 means no control change (time still elapses).
+# pressed : control status per trace.
+# dt : elapsed time (ms) since the previous step, per trace.
+# sequence_active : mirror of 'BaseCharacterController.sequence_active'.
+# Return the sequence identifier fired by each trace during this step (-1 if none).
+def step(state_machine, context, control, pressed, dt, sequence_active=True):
+    now = context["Time"] + dt
+    context["Time"] = now
+    state = context["State"]
+
+    # '_process' : timers expiration.
+    for timers in [context["DurationTimer"], context["CooldownTimer"]]:
+        expired = (timers > 0) & (timers <= now[:, None])
+        timers[expired] = -1
+    sequence_timer = context["SequenceTimer"]
+    expired = (sequence_timer > 0) & (sequence_timer <= now[:, None])
+    sequence_timer[expired] = -1
+    # 'break_sequence'
+    matcher = state_machine["MatcherGoto"] is not None
+    if matcher:
+        context["Node"][expired] = 0
+    else:
+        state[expired] = state_machine["TimeoutRoute"][state[expired]]
+
+    # 'set_move' : only the state machine of the control group moves.
+    fired = np.full(len(state), -1, dtype=np.int32)
+    group = state_machine["ControlGroup"][control]
+    group_state = state[np.arange(len(state)), group]
+    moving = np.nonzero(
+        (control > 0)
+        & (state_machine["Pressed"][group_state, control] == pressed)
+        & ~state_machine["Blocked"][group_state, control]
+    )[0]
+    if len(moving) == 0:
+        return fired
+    moving_state = group_state[moving]
+    moving_control = control[moving]
+    moving_group = group[moving]
+    reset = state_machine["TimerReset"][moving_state, moving_control]
+    sequence_timer[moving[reset], moving_group[reset]] = (
+        now[moving[reset]] + state_machine["SequenceTimeout"]
+    )
+    sequence_id = state_machine["Fire"][moving_state, moving_control]
+    if matcher:
+        # 'step_matcher'
+        node = context["Node"]
+        matching = pressed[moving]
+        matching_trace = moving[matching]
+        matching_group = moving_group[matching]
+        reached = state_machine["MatcherGoto"][
+            node[matching_trace, matching_group], moving_control[matching]
+        ]
+        reached_id = state_machine["MatcherFire"][reached]
+        progress = (reached != 0) & (reached_id < 0)
+        sequence_timer[matching_trace[progress], matching_group[progress]] = (
+            now[matching_trace[progress]] + state_machine["SequenceTimeout"]
+        )
+        node[matching_trace, matching_group] = np.where(reached_id >= 0, 0, reached)
+        sequence_id[matching] = reached_id
+    if sequence_active:
+        candidates = moving[pressed[moving] & (sequence_id >= 0)]
+        candidates_id = sequence_id[pressed[moving] & (sequence_id >= 0)]
+        sequence_timer[candidates, group[candidates]] = -1
+        cooldown_timers = context["CooldownTimer"]
+        ready = cooldown_timers[candidates, candidates_id] < 0
+        triggered = candidates[ready]
+        triggered_id = candidates_id[ready]
+        triggered_now = now[triggered]
+        duration = state_machine["Duration"][triggered_id]
+        context["DurationTimer"][triggered, triggered_id] = np.where(
+            duration > 0,
+            triggered_now + duration,
+            context["DurationTimer"][triggered, triggered_id],
+        )
+        cooldown_timers[triggered, triggered_id] = (
+            triggered_now + state_machine["Cooldown"][triggered_id]
+        )
+        # Other cooldown inference.
+        inferred = state_machine["Infer"][triggered_id]
+        cooldown_timers[triggered] = np.where(
+            inferred,
+            triggered_now[:, None] + state_machine["Cooldown"][None, :],
+            cooldown_timers[triggered],
+        )
+        context["FireCount"][triggered, triggered_id] += 1
+        fired[triggered] = triggered_id
+    # Switch to next state.
+    state[moving, moving_group] = state_machine["Access"][moving_state, moving_control]
+    return fired
+
+
+# Replay traces given as (trace, step) arrays. Return the fire count per trace and sequence,
+# and the list of fired sequences as (trace, step, sequence, time) rows.
+def simulate(state_machine, control, pressed, dt, sequence_active=True):
+    trace_count, step_count = control.shape
+    context = create_context(state_machine, trace_count)
+    events = []
+    for i in range(step_count):
+        fired = step(
+            state_machine,
+            context,
+            control[:, i],
+            pressed[:, i],
+            dt[:, i],
+            sequence_active,
+        )
+        traces = np.nonzero(fired >= 0)[0]
+        if len(traces) > 0:
+            events.append(
+                np.stack(
+                    [
+                        traces,
+                        np.full(len(traces), i),
+                        fired[traces],
+                        context["Time"][traces],
+                    ],
+                    axis=1,
+                )
+            )
+    if len(events) > 0:
+        fire_events = np.concatenate(events)
+        fire_events = fire_events[np.lexsort((fire_events[:, 1], fire_events[:, 0]))]
+    else:
+        fire_events = np.zeros((0, 4), dtype=np.int64)
+    return context["FireCount"], fire_events
+
+
+# Traces are either stored in a NumPy archive (arrays 'control', 'pressed' and 'dt', shaped
+# (trace, step)), or in a JSON file holding a list of traces, each trace being a list of
+# [control, pressed, dt] steps. Shorter traces are padded with 'no control' steps.
+def load_traces(filepath):
+    if filepath.endswith(".npz"):
+        archive = np.load(filepath)
+        return (
+            archive["control"].astype(np.int32),
+            archive["pressed"].astype(bool),
+            archive["dt"].astype(np.int64),
+        )
+    with open(filepath, "r") as source:
+        traces = json.load(source)
+    step_count = max([len(t) for t in traces], default=0)
+    control = np.zeros((len(traces), step_count), dtype=np.int32)
+    pressed = np.zeros((len(traces), step_count), dtype=bool)
+    dt = np.zeros((len(traces), step_count), dtype=np.int64)
+    for i in range(len(traces)):
+        for j in range(len(traces[i])):
+            control[i, j], pressed[i, j], dt[i, j] = traces[i][j]
+    return control, pressed, dt
+
+
+def main():
+    descriptor_filepath = ""
+    traces_filepath = ""
+    report_filepath = None
+    sequence_active = True
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "f:t:o:i")
+    except getopt.GetoptError:
+        print(
+            "%s -f [path_to_fsm_pc.json|bin] -t [path_to_traces] -o [report.json] -i"
+            % sys.argv[0]
+        )
+        sys.exit(1)
+    for opt, arg in opts:
+        if opt == "-f":
+            descriptor_filepath = arg
+        elif opt == "-t":
+            traces_filepath = arg
+        elif opt == "-o":
+            report_filepath = arg
+        elif opt == "-i":
+            # Mirror the default value of 'sequence_active' : sequences are inactive.
+            sequence_active = False
+
+    state_machine = load_state_machine(descriptor_filepath)
+    control, pressed, dt = load_traces(traces_filepath)
+    fire_count, fire_events = simulate(
+        state_machine, control, pressed, dt, sequence_active
+    )
+
+    print("## Simulated %d traces of %d steps" % control.shape)
+    print("## Fired sequences")
+    for q in range(fire_count.shape[1]):
+        print(
+            "- Sequence %d : %d times, in %d traces"
+            % (q, fire_count[:, q].sum(), np.count_nonzero(fire_count[:, q]))
+        )
+
+    if report_filepath is not None:
+        report = []
+        for i in range(len(fire_count)):
+            report.append({"FireCount": fire_count[i].tolist(), "Fired": []})
+        for trace, step_id, sequence_id, date in fire_events.tolist():
+            report[trace]["Fired"].append(
+                {"Step": step_id, "Sequence": sequence_id, "Time": date}
+            )
+        with open(report_filepath, "w") as report_file:
+            json.dump(report, report_file, indent=4)
+            report_file.write("\n")
+        print("Report stored in %s" % report_filepath)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+# Regression test of the decision tree post-processing on a synthetic rule set of a few
+# thousand events. 'compress_decision_tree' prunes, removes the history, shortens the None
+# threads and flattens the tree in a single post-order pass : its results are compared with
+# the former separate passes, kept below as reference.
+
+import copy
+import json
+import queue
+import random
+import io
+import contextlib
+
+import generate
+
+BOOLEANS = ["flag_%d" % i for i in range(12)]
+TIMERS = ["timer_%d" % i for i in range(3)]
+CONTROLS = ["last_key", "direction"]
+EVENT_COUNT = 3000
+AMBIGUOUS_COUNT = 20
+
+
+# Each event has a distinct combination of the booleans, so that every event can be told
+# apart. Timers and controls are random, or None (any value).
+# A few combinations are also shared by a pair of identical "twin" events, which only differ
+# from the event of the combination by the 'direction' control : the twins can't be told apart
+# and their branch is pruned, leaving a None thread towards the event. Only the twins are
+# unreachable.
+def synthesize_rules(seed=0):
+    rng = random.Random(seed)
+    declared_types = {}
+    for s in BOOLEANS:
+        declared_types[s] = "bool"
+    for s in TIMERS:
+        declared_types[s] = "Timer"
+    for s in CONTROLS:
+        declared_types[s] = "Control"
+    combinations = rng.sample(range(1 << len(BOOLEANS)), EVENT_COUNT + AMBIGUOUS_COUNT)
+    rules = {}
+    for e in range(EVENT_COUNT + AMBIGUOUS_COUNT):
+        conditions = {}
+        for b in range(len(BOOLEANS)):
+            conditions[BOOLEANS[b]] = (combinations[e] >> b) & 1 == 1
+        for s in TIMERS + CONTROLS:
+            conditions[s] = None
+        if e < EVENT_COUNT:
+            for s in TIMERS:
+                conditions[s] = rng.choice([True, False, None, None])
+            for s in CONTROLS:
+                conditions[s] = rng.choice([1, 2, 3, None, None, None])
+        rules["event_%d" % e] = {"Conditions": conditions}
+        if e >= EVENT_COUNT:
+            twin = dict(conditions)
+            twin["direction"] = 1
+            rules["twin_%d_a" % e] = {"Conditions": twin}
+            rules["twin_%d_b" % e] = {"Conditions": dict(twin)}
+    symbols_types = dict(
+        (k, generate.type_to_class[v]) for (k, v) in declared_types.items()
+    )
+    return rules, symbols_types, declared_types
+
+
+# Former pruning, run by 'build_decision_tree' : the root is inspected again each time a node
+# loses all its values.
+def legacy_prune(decision_tree):
+    prune = queue.Queue()
+    prune.put(decision_tree)
+    while not prune.empty():
+        cursor = prune.get()
+        to_remove = []
+        if "Event" in cursor:
+            continue
+        for v in cursor["Values"]:
+            if "Prune" in cursor["Values"][v]:
+                to_remove.append(v)
+            else:
+                prune.put(cursor["Values"][v])
+        for v in to_remove:
+            cursor["Values"].pop(v)
+        if len(cursor["Values"]) == 0:
+            cursor["Prune"] = True
+            prune.put(decision_tree)
+
+
+# Former 'compress_decision_tree' : history removal, then None thread shortening.
+def legacy_compress(decision_tree):
+    branches = queue.Queue()
+    branches.put(decision_tree)
+    while not branches.empty():
+        cursor = branches.get()
+        if "History" in cursor:
+            cursor.pop("History")
+        if "Values" in cursor:
+            for v in cursor["Values"]:
+                branches.put(cursor["Values"][v])
+    branches.put(decision_tree)
+    while not branches.empty():
+        cursor = branches.get()
+        while (
+            "Values" in cursor
+            and len(cursor["Values"]) == 1
+            and None in cursor["Values"]
+        ):
+            next_entry = cursor["Values"][None]
+            if "Event" in next_entry:
+                cursor.clear()
+                cursor["Event"] = next_entry["Event"]
+            else:
+                cursor["Attributes"] = next_entry["Attributes"]
+                cursor["Values"] = next_entry["Values"]
+        if "Values" in cursor:
+            for v in cursor["Values"]:
+                branches.put(cursor["Values"][v])
+
+
+# Former flattening, run by 'create_decision_tree' before the code emission.
+def legacy_flatten(decision_tree, symbols_types):
+    flat_tree = []
+    decision_tree["Flat"] = flat_tree
+    branches = queue.Queue()
+    branches.put(decision_tree)
+    while not branches.empty():
+        cursor = branches.get()
+        if "Event" in cursor:
+            cursor["Flat"].append({"Event": cursor["Event"]})
+        elif "Attributes" in cursor:
+            new_decision = {"Attributes": cursor["Attributes"], "Values": {}}
+            for v in cursor["Values"]:
+                if v is None:
+                    none_cursor = cursor["Values"][None]
+                    branches.put(none_cursor)
+                    none_cursor["Flat"] = cursor["Flat"]
+                    continue
+                new_decision["Values"][v] = []
+                cursor["Values"][v]["Flat"] = new_decision["Values"][v]
+                branches.put(cursor["Values"][v])
+            if (
+                symbols_types[cursor["Attributes"]] == bool
+                and len(new_decision["Values"]) == 2
+            ):
+                false_value = new_decision["Values"].pop(False)
+                new_decision["Values"][False] = false_value
+            cursor["Flat"].append(new_decision)
+    return flat_tree
+
+
+def tree_nodes(decision_tree):
+    nodes = [decision_tree]
+    stack = [decision_tree]
+    while stack:
+        cursor = stack.pop()
+        for child in cursor.get("Values", {}).values():
+            nodes.append(child)
+            stack.append(child)
+    return nodes
+
+
+def flat_events(flat_tree):
+    events = []
+    stack = [flat_tree]
+    while stack:
+        for statement in stack.pop():
+            if "Event" in statement:
+                events.append(statement["Event"])
+            else:
+                stack += list(statement["Values"].values())
+    return events
+
+
+def build_trees():
+    rules, symbols_types, declared_types = synthesize_rules()
+    with contextlib.redirect_stdout(io.StringIO()):
+        built = generate.build_decision_tree(rules, declared_types, "count")
+    return rules, symbols_types, declared_types, built
+
+
+def test_synthetic_rule_set_exercises_pruning_and_none_threads():
+    _, _, _, built = build_trees()
+    assert any(["Prune" in n for n in tree_nodes(built)])
+    # None threads appear once the branches are pruned.
+    legacy_prune(built)
+    assert any(
+        [
+            len(n.get("Values", {})) == 1 and None in n["Values"]
+            for n in tree_nodes(built)
+        ]
+    )
+
+
+def test_every_event_stays_reachable():
+    rules, symbols_types, _, built = build_trees()
+    expected = sorted([r for r in rules if not r.startswith("twin_")])
+    flat_tree, _ = generate.compress_decision_tree(built, symbols_types)
+    events = flat_events(flat_tree)
+    assert sorted(events) == expected
+    assert len(events) == len(set(events))
+    tree_events = [n["Event"] for n in tree_nodes(built) if "Event" in n]
+    assert sorted(tree_events) == expected
+
+
+def test_no_empty_nor_none_thread_node_left():
+    _, symbols_types, _, built = build_trees()
+    flat_tree, _ = generate.compress_decision_tree(built, symbols_types)
+    for node in tree_nodes(built):
+        assert "Prune" not in node
+        assert "History" not in node
+        if "Values" in node:
+            assert len(node["Values"]) > 0
+            assert not (len(node["Values"]) == 1 and None in node["Values"])
+        else:
+            assert "Event" in node
+    stack = [flat_tree]
+    while stack:
+        statements = stack.pop()
+        assert len(statements) > 0
+        for statement in statements:
+            if "Values" in statement:
+                assert len(statement["Values"]) > 0
+                assert None not in statement["Values"]
+                stack += list(statement["Values"].values())
+
+
+def test_fused_pass_matches_legacy_passes():
+    _, symbols_types, _, built = build_trees()
+    legacy = copy.deepcopy(built)
+
+    flat_tree, history_tree = generate.compress_decision_tree(
+        built, symbols_types, keep_history=True
+    )
+
+    legacy_prune(legacy)
+    # The debug JSON used to be the pruned tree, with its history.
+    assert json.dumps(history_tree, indent=4) == json.dumps(legacy, indent=4)
+    legacy_compress(legacy)
+    assert built == legacy
+    assert flat_tree == legacy_flatten(legacy, symbols_types)
+
+
+def test_create_decision_tree_emits_every_event():
+    rules, symbols_types, declared_types, _ = build_trees()
+    code = io.StringIO()
+    artifacts = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        generate.create_decision_tree(
+            rules,
+            symbols_types,
+            declared_types,
+            "Synthetic",
+            {},
+            {},
+            False,
+            artifacts,
+            code,
+            generate.default_options(),
+        )
+    content = code.getvalue()
+    for event in [r for r in rules if not r.startswith("twin_")]:
+        assert ("EVENT_%s)" % event.upper()) in content
@@ -1,31 +1,289 @@
 #!/bin/python
 
-import json
+# Validator of the generated state machines. Reads either the human readable graph
+# (debug/{name}_fsm.json) or the pre-computed one ({name}_fsm_pc.json) and reports :
+# - the states defined twice and the transitions towards undefined states,
+# - the states unreachable from the start state (of each control group),
+# - the dead-end states, without any transition towards another state,
+# - the missing or duplicated control transitions : a state has a single transition per control
+#   of its group, either a press or a release,
+# - the strongly connected components, and the states from which the start state can't be
+#   reached again.
+# States are indexed by dictionaries and arrays, so that the validation is linear in the number of
+# states and transitions.
+# The exit status is not 0 when a state is defined twice, a target is undefined or a control
+# transition is missing.
+
 import sys
+import json
+import collections
+
+
+# Read the human readable graph. Return the state names, the transitions of each state as
+# (control name or "Timeout", target name), the state index (target -> state) and the control
+# groups as (start state, controls).
+def read_description(content):
+    names = []
+    transitions = []
+    for state in content["Transitions"]:
+        names.append(state["State"])
+        transitions.append(
+            [
+                (t["Control"] if "Control" in t else "Timeout", t["Target"])
+                for t in state["Triggers"]
+            ]
+        )
+    index = {}
+    for i in range(len(names)):
+        index.setdefault(names[i], i)
+    if "Groups" in content:
+        groups = [(g["Start"], g["Controls"]) for g in content["Groups"]]
+    else:
+        # The controls are not listed : every control used by a transition is expected.
+        controls = {}
+        for state in transitions:
+            for letter, _ in state:
+                if letter != "Timeout":
+                    controls[letter] = True
+        groups = [(content["Start"], list(controls.keys()))]
+    return names, transitions, index, groups
+
+
+# Read the pre-computed graph. Same result as 'read_description', targets and controls being
+# identifiers.
+def read_pre_computed(content):
+    names = []
+    transitions = []
+    for i in range(len(content["Transitions"])):
+        name = str(i)
+        state_transitions = []
+        for t in content["Transitions"][i]:
+            if "Name" in t:
+                name = t["Name"]
+                continue
+            letter = t["Control"] if "Control" in t else "Timeout"
+            state_transitions.append((letter, t["Target"]))
+        names.append(name)
+        transitions.append(state_transitions)
+    index = dict((i, i) for i in range(len(names)))
+    if "Groups" in content:
+        groups = [(g["Start"], g["Controls"]) for g in content["Groups"]]
+    else:
+        groups = [(content["Start"], list(range(1, content["ControlCount"] + 1)))]
+    return names, transitions, index, groups
+
+
+# Iterative Tarjan algorithm. Return the list of components, each one being a list of states.
+def strongly_connected_components(successors):
+    count = len(successors)
+    order = [-1] * count
+    low = [0] * count
+    on_stack = [False] * count
+    stack = []
+    components = []
+    counter = 0
+    for root in range(count):
+        if order[root] != -1:
+            continue
+        order[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = True
+        work = [(root, 0)]
+        while work:
+            v, i = work[-1]
+            if i < len(successors[v]):
+                work[-1] = (v, i + 1)
+                w = successors[v][i]
+                if order[w] == -1:
+                    order[w] = low[w] = counter
+                    counter += 1
+                    stack.append(w)
+                    on_stack[w] = True
+                    work.append((w, 0))
+                elif on_stack[w]:
+                    low[v] = min(low[v], order[w])
+                continue
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[v])
+            if low[v] == order[v]:
+                component = []
+                while True:
+                    w = stack.pop()
+                    on_stack[w] = False
+                    component.append(w)
+                    if w == v:
+                        break
+                components.append(component)
+    return components
+
+
+def report(title, items):
+    print("## %s (%d)" % (title, len(items)))
+    for item in items:
+        print("- %s" % item)
 
-with open(sys.argv[1], "r") as source:
-    state_machine = json.load(source)
-
-    target_state = []
-    defined_state = []
-    transitions = state_machine["Transitions"]
-    for transition in transitions:
-        current_state = transition["State"]
-        if current_state in defined_state:
-            print("The state '%s' as already been defined ! " % current_state)
-            sys.exit(-1)
-        else:
-            defined_state.append(current_state)
-            triggers = transition["Triggers"]
-            for trigger in triggers:
-                target = trigger["Target"]
-                if not target in target_state:
-                    target_state.append(target)
 
-    print("## Undefined States")
-    for t in target_state:
-        if not t in defined_state:
-            print("- '%s'" % t)
+# Validate the state machine. Return the number of errors.
+def verify(names, transitions, index, groups):
+    state_count = len(names)
+    errors = 0
+
+    defined = {}
+    duplicates = []
+    for name in names:
+        if name in defined:
+            duplicates.append("'%s'" % name)
+        defined[name] = True
+    report("Duplicated States", duplicates)
+    errors += len(duplicates)
+
+    successors = []
+    predecessors = [[] for _ in range(state_count)]
+    undefined = []
+    for i in range(state_count):
+        state_successors = []
+        for letter, target in transitions[i]:
+            target_id = index.get(target)
+            if target_id is None:
+                undefined.append("'%s' (%s from '%s')" % (target, letter, names[i]))
+                continue
+            state_successors.append(target_id)
+            predecessors[target_id].append(i)
+        successors.append(state_successors)
+    report("Undefined States", undefined)
+    errors += len(undefined)
+
+    # Breadth first search from the start states. A state belongs to the group it is reached
+    # from.
+    group_of = [None] * state_count
+    starts = []
+    frontier = collections.deque()
+    for g in range(len(groups)):
+        start = index.get(groups[g][0])
+        if start is None:
+            print("!!! The start state '%s' is not defined !!!" % groups[g][0])
+            errors += 1
+            continue
+        starts.append(start)
+        group_of[start] = g
+        frontier.append(start)
+    while frontier:
+        current = frontier.popleft()
+        for target in successors[current]:
+            if group_of[target] is None:
+                group_of[target] = group_of[current]
+                frontier.append(target)
+    report(
+        "Unreachable States",
+        ["'%s'" % names[i] for i in range(state_count) if group_of[i] is None],
+    )
+
+    report(
+        "Dead-end States",
+        [
+            "'%s'" % names[i]
+            for i in range(state_count)
+            if all([target == i for target in successors[i]])
+        ],
+    )
+
+    missing = []
+    for i in range(state_count):
+        if group_of[i] is None:
+            continue
+        letter_count = collections.Counter(letter for letter, _ in transitions[i])
+        for control in groups[group_of[i]][1]:
+            if letter_count[control] == 0:
+                missing.append("'%s' : no transition for %s" % (names[i], control))
+            elif letter_count[control] > 1:
+                missing.append(
+                    "'%s' : %d transitions for %s"
+                    % (names[i], letter_count[control], control)
+                )
+    report("Missing Transitions", missing)
+    errors += len(missing)
+
+    # Reverse breadth first search : the states from which a start state can be reached again.
+    returning = [False] * state_count
+    frontier = collections.deque(starts)
+    for start in starts:
+        returning[start] = True
+    while frontier:
+        current = frontier.popleft()
+        for source in predecessors[current]:
+            if not returning[source]:
+                returning[source] = True
+                frontier.append(source)
+
+    components = strongly_connected_components(successors)
+    print(
+        "## Strongly Connected Components (%d, largest of %d states)"
+        % (len(components), max([len(c) for c in components], default=0))
+    )
+    # Components of reachable states the start state can't be reached again from.
+    trapped = []
+    for component in components:
+        if group_of[component[0]] is not None and not returning[component[0]]:
+            trapped.append(", ".join(["'%s'" % names[i] for i in sorted(component)]))
+    report("Components Without Return To Start", trapped)
+    return errors
+
+
+# Check the sequence matcher nodes : the failure links target earlier nodes (breadth first
+# order) and every node and sequence identifier is defined (sequences aren't checked when
+# 'sequence_count' is None). Return the number of errors.
+def verify_matcher(nodes, sequence_count):
+    issues = []
+    for n in range(len(nodes)):
+        if n != 0 and not (0 <= nodes[n]["Fail"] < n):
+            issues.append("Node %d : invalid failure link %d" % (n, nodes[n]["Fail"]))
+        for control, target in nodes[n]["Edges"]:
+            if not (0 < target < len(nodes)):
+                issues.append(
+                    "Node %d : invalid target %d for %s" % (n, target, control)
+                )
+        if (
+            "Fire" in nodes[n]
+            and sequence_count is not None
+            and not (0 <= nodes[n]["Fire"] < sequence_count)
+        ):
+            issues.append("Node %d : invalid sequence %d" % (n, nodes[n]["Fire"]))
+    report("Sequence Matcher Issues", issues)
+    return len(issues)
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("%s [path_to_fsm.json|fsm_pc.json] ..." % sys.argv[0])
+        sys.exit(-1)
+    errors = 0
+    for filepath in sys.argv[1:]:
+        with open(filepath, "r") as source:
+            content = json.load(source)
+        print("# %s" % filepath)
+        # The pre-computed graph stores each state as a list of transitions.
+        pre_computed = len(content["Transitions"]) > 0 and isinstance(
+            content["Transitions"][0], list
+        )
+        if pre_computed:
+            names, transitions, index, groups = read_pre_computed(content)
+        else:
+            names, transitions, index, groups = read_description(content)
+        print(
+            "## %d states, %d transitions"
+            % (len(names), sum([len(t) for t in transitions]))
+        )
+        errors += verify(names, transitions, index, groups)
+        if "Matcher" in content:
+            # The human readable graph doesn't list the sequences.
+            sequence_count = len(content["Sequences"]) if pre_computed else None
+            errors += verify_matcher(content["Matcher"], sequence_count)
+    if errors > 0:
+        sys.exit(-1)
 
-    # Compute missing transitions
 
+if __name__ == "__main__":
+    main()